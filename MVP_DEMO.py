@@ -1,143 +1,578 @@
+from __future__ import annotations
+
 import streamlit as st
-import streamlit_authenticator as stauth
-from supabase import create_client, Client
-from datetime import datetime, time
-import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
-from typing import Dict, List, Any
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Dict, List, Any, NamedTuple
 import json
-import schedule
+from collections import OrderedDict
+from collections.abc import Mapping
+import importlib
 import threading
+import atexit
+import weakref
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
 import time as time_module
-import numpy as np
 import hashlib
-import yaml
-from yaml.loader import SafeLoader
+import sqlite3
+from contextlib import closing, contextmanager, nullcontext
+import socket
 # from dotenv import load_dotenv
 import os
-from openai import OpenAI
+import random
+import logging
+
+
+# 延迟导入：重量级依赖在首次使用时才加载，新进程渲染登录表单前不为它们付出导入时间
+class _LazyModule:
+    """Stand-in for a module that is imported on first attribute access."""
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+pd = _LazyModule('pandas')
+np = _LazyModule('numpy')
+px = _LazyModule('plotly.express')
+go = _LazyModule('plotly.graph_objects')
+schedule = _LazyModule('schedule')
+openai = _LazyModule('openai')
 
 # load_dotenv()
-# Initialize OpenAI client
-QWEN_API_KEY = st.secrets["QWEN_API_KEY"]
-openai_client = OpenAI(api_key=QWEN_API_KEY,
-                       base_url="https://dashscope.aliyuncs.com/compatible-mode/v1")
-# 配置
-SUPABASE_URL = st.secrets["SUPABASE_URL"]
-SUPABASE_KEY = st.secrets["SUPABASE_KEY"]
-
-# 初始化客户端
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-
-# Known user_data columns supported by the application (used to filter writes)
-SUPPORTED_USER_DATA_COLUMNS = {
-    'total_assets','stock_percentage','bond_percentage','property_percentage','cash_percentage','risk_level',
-    'health_score','health_status','age','height','weight','blood_pressure','exercise_freq','sleep_hours',
-    'smoke','drink','health_goals','bmi','num_children','children','education_budget','education_plan',
-    'education_progress','education_goals','life_stage','short_term_goals','medium_term_goals','long_term_goals',
-    'life_vision','priorities','wealth_score','family_score','career_score','growth_score','life_score',
-    'name','email_contact','phone','birth_date','gender','occupation','city','marital_status',
-    'daily_news','investment_alert','health_reminder','education_update','allow_ai_analysis','ux_opt_in',
-    'ai_life_suggestion','last_ai_life_date','ai_investment_suggestion','last_ai_investment_date',
-    'ai_health_suggestion','last_ai_health_date','ai_education_suggestion','last_ai_education_date',
-    'weekly_tasks','monthly_goals',
-    # child_* fields up to 9
-    'child_0_age','child_0_grade','child_0_interests','child_0_goals',
-    'child_1_age','child_1_grade','child_1_interests','child_1_goals',
-    'child_2_age','child_2_grade','child_2_interests','child_2_goals',
-    'child_3_age','child_3_grade','child_3_interests','child_3_goals',
-    'child_4_age','child_4_grade','child_4_interests','child_4_goals',
-    'child_5_age','child_5_grade','child_5_interests','child_5_goals',
-    'child_6_age','child_6_grade','child_6_interests','child_6_goals',
-    'child_7_age','child_7_grade','child_7_interests','child_7_goals',
-    'child_8_age','child_8_grade','child_8_interests','child_8_goals',
-    'child_9_age','child_9_grade','child_9_interests','child_9_goals'
-}
 
-# Field name mapping (application-level name -> database column name)
-# If your DB uses different names (e.g. 'height_cm'), set APP_TO_DB['height']='height_cm'
-APP_TO_DB: Dict[str, str] = {
-    # default passthrough; keep keys aligned with DB created by migrations above
-    'total_assets':'total_assets',
-    'stock_percentage':'stock_percentage',
-    'bond_percentage':'bond_percentage',
-    'property_percentage':'property_percentage',
-    'cash_percentage':'cash_percentage',
-    'risk_level':'risk_level',
-    'health_score':'health_score',
-    'health_status':'health_status',
-    'age':'age',
-    'height':'height_cm',
-    'weight':'weight_kg',
-    'blood_pressure':'blood_pressure',
-    'exercise_freq':'exercise_freq',
-    'sleep_hours':'sleep_hours',
-    'smoke':'smoke',
-    'drink':'drink',
-    'health_goals':'health_goals',
-    'bmi':'bmi',
-    'num_children':'num_children',
-    'children':'children',
-    'education_budget':'education_budget',
-    'education_plan':'education_plan',
-    'education_progress':'education_progress',
-    'education_goals':'education_goals',
-    'life_stage':'life_stage',
-    'short_term_goals':'short_term_goals',
-    'medium_term_goals':'medium_term_goals',
-    'long_term_goals':'long_term_goals',
-    'life_vision':'life_vision',
-    'priorities':'priorities',
-    'wealth_score':'wealth_score',
-    'family_score':'family_score',
-    'career_score':'career_score',
-    'growth_score':'growth_score',
-    'life_score':'life_score',
-    'name':'name',
-    'email_contact':'email_contact',
-    'phone':'phone',
-    'birth_date':'birth_date',
-    'gender':'gender',
-    'occupation':'occupation',
-    'city':'city',
-    'marital_status':'marital_status',
-    'daily_news':'daily_news',
-    'investment_alert':'investment_alert',
-    'health_reminder':'health_reminder',
-    'education_update':'education_update',
-    'allow_ai_analysis':'allow_ai_analysis',
-    'ux_opt_in':'ux_opt_in',
-    'ai_life_suggestion':'ai_life_suggestion',
-    'last_ai_life_date':'last_ai_life_date',
-    'ai_investment_suggestion':'ai_investment_suggestion',
-    'last_ai_investment_date':'last_ai_investment_date',
-    'ai_health_suggestion':'ai_health_suggestion',
-    'last_ai_health_date':'last_ai_health_date',
-    'ai_education_suggestion':'ai_education_suggestion',
-    'last_ai_education_date':'last_ai_education_date',
-    'weekly_tasks':'weekly_tasks',
-    'monthly_goals':'monthly_goals'
+# 日志：每次调用/每次 rerun 的明细为 DEBUG 级别，失败为 WARNING
+logger = logging.getLogger('family_office')
+
+
+# 初始化客户端（首次使用时创建，进程内共享）
+@st.cache_resource
+def get_supabase():
+    """Process-wide Supabase client, created on first use."""
+    from supabase import create_client
+    return create_client(st.secrets["SUPABASE_URL"], st.secrets["SUPABASE_KEY"])
+
+
+# --- Storage backends ---
+# users, user_data, daily_updates and the shared suggestion cache table sit behind one
+# interface so the app can run without the hosted service. Both backends provide:
+#   ensure_schema()
+#   get_user_by_id(user_id, columns) / get_user_by_username(username, columns) -> row | None
+#   insert_user(row)                              raises if the username is taken
+#   get_user_data(user_id, columns=None)          -> row | None (columns: DB names, None: all)
+#   upsert_user_data(rows)                        -> stored rows, merged by user_id
+#   page_user_data(columns, after, limit, legacy_children_only=False)
+#                                                 -> rows ordered by user_id (keyset paging)
+#   get_daily_updates(date_str, columns)          -> row | None
+#   insert_daily_updates(row)                     no-op when the date already has a row
+#   get_cached_suggestion(key) / put_cached_suggestion(row)
+# `columns` are comma-separated strings or iterables of DB column names.
+# STORAGE_BACKEND = "sqlite" in secrets selects the local file STORAGE_DB.
+SQLITE_STORAGE_DEFAULT_PATH = 'family_office.db'
+
+
+def _column_list(columns) -> List[str]:
+    return columns.split(',') if isinstance(columns, str) else sorted(columns)
+
+
+class SupabaseStorage:
+    """The hosted Supabase tables (default backend)."""
+
+    def ensure_schema(self):
+        # tables are managed in Supabase; only probe that they answer
+        for table, column in (('users', 'id'), ('user_data', 'user_id'), ('daily_updates', 'date')):
+            try:
+                get_supabase().table(table).select(column).limit(1).execute()
+            except Exception:
+                pass
+
+    def get_user_by_id(self, user_id, columns: str):
+        res = get_supabase().table('users').select(columns).eq('id', user_id).limit(1).execute()
+        return res.data[0] if res.data else None
+
+    def get_user_by_username(self, username: str, columns: str):
+        res = get_supabase().table('users').select(columns).eq('username', username).limit(1).execute()
+        return res.data[0] if res.data else None
+
+    def insert_user(self, row: Dict[str, Any]):
+        get_supabase().table('users').insert(row).execute()
+
+    def get_user_data(self, user_id, columns=None):
+        select = '*' if columns is None else ','.join(_column_list(columns))
+        res = get_supabase().table('user_data').select(select).eq('user_id', user_id).execute()
+        return res.data[0] if res.data else None
+
+    def upsert_user_data(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        # every row in a bulk upsert must carry the same columns
+        res = get_supabase().table('user_data').upsert(rows, on_conflict='user_id').execute()
+        return res.data or []
+
+    def page_user_data(self, columns, after=None, limit: int = 1000, legacy_children_only: bool = False):
+        query = get_supabase().table('user_data').select(','.join(_column_list(columns)))
+        if legacy_children_only:
+            query = query.is_('children', 'null').gt('num_children', 0)
+        query = query.order('user_id').limit(limit)
+        if after is not None:
+            query = query.gt('user_id', after)
+        return query.execute().data or []
+
+    def get_daily_updates(self, date_str: str, columns: str):
+        res = get_supabase().table('daily_updates').select(columns).eq('date', date_str).execute()
+        return res.data[0] if res.data else None
+
+    def insert_daily_updates(self, row: Dict[str, Any]):
+        get_supabase().table('daily_updates').upsert(row, on_conflict='date', ignore_duplicates=True).execute()
+
+    def get_cached_suggestion(self, key: str):
+        res = get_supabase().table(AI_SUGGESTION_CACHE_TABLE).select('content,created_at').eq('key', key).limit(1).execute()
+        return res.data[0] if res.data else None
+
+    def put_cached_suggestion(self, row: Dict[str, Any]):
+        get_supabase().table(AI_SUGGESTION_CACHE_TABLE).upsert(row, on_conflict='key').execute()
+
+
+class SqliteStorage:
+    """Local SQLite implementation for single-node deployments, tests and benchmarks.
+
+    Runs in WAL mode so readers never wait on the writer; each operation opens its own
+    connection, which makes the store safe to share between session threads. user_data
+    rows are kept as one JSON document per user_id, since their columns follow
+    USER_DATA_SCHEMA; projections are applied on read.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.ensure_schema()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def ensure_schema(self):
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS users ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT NOT NULL, email TEXT,"
+                " password TEXT NOT NULL, created_at TEXT)"
+            )
+            conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS users_username ON users(username)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS user_data ("
+                " user_id TEXT PRIMARY KEY, data TEXT NOT NULL) WITHOUT ROWID"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS daily_updates ("
+                " date TEXT PRIMARY KEY, finance_news TEXT, health_tips TEXT, education_info TEXT,"
+                " created_at TEXT)"
+            )
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {AI_SUGGESTION_CACHE_TABLE} ("
+                " key TEXT PRIMARY KEY, model TEXT NOT NULL, data_type TEXT NOT NULL,"
+                " content TEXT NOT NULL, created_at TEXT NOT NULL)"
+            )
+
+    @staticmethod
+    def _project(row, columns):
+        if row is None:
+            return None
+        row = dict(row)
+        return row if columns is None else {c: row.get(c) for c in _column_list(columns)}
+
+    def get_user_by_id(self, user_id, columns: str):
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT * FROM users WHERE id = ?", (user_id,)).fetchone()
+        return self._project(row, columns)
+
+    def get_user_by_username(self, username: str, columns: str):
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT * FROM users WHERE username = ?", (username,)).fetchone()
+        return self._project(row, columns)
+
+    def insert_user(self, row: Dict[str, Any]):
+        with closing(self._connect()) as conn:
+            conn.execute("INSERT INTO users (username, email, password, created_at) VALUES (?, ?, ?, ?)",
+                         (row['username'], row.get('email'), row['password'], row.get('created_at')))
+
+    def get_user_data(self, user_id, columns=None):
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT data FROM user_data WHERE user_id = ?", (str(user_id),)).fetchone()
+        return self._project(json.loads(row[0]), columns) if row else None
+
+    def upsert_user_data(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        stored = []
+        with closing(self._connect()) as conn:
+            # IMMEDIATE takes the write lock up front so the read-merge-write is atomic
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for fields in rows:
+                    key = str(fields['user_id'])
+                    current = conn.execute("SELECT data FROM user_data WHERE user_id = ?", (key,)).fetchone()
+                    row = json.loads(current[0]) if current else {'created_at': _utc_now().isoformat()}
+                    row.update(fields)
+                    conn.execute(
+                        "INSERT INTO user_data (user_id, data) VALUES (?, ?)"
+                        " ON CONFLICT(user_id) DO UPDATE SET data = excluded.data",
+                        (key, json.dumps(row, ensure_ascii=False, default=str))
+                    )
+                    stored.append(row)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return stored
+
+    def page_user_data(self, columns, after=None, limit: int = 1000, legacy_children_only: bool = False):
+        sql = "SELECT data FROM user_data WHERE user_id > ?"
+        if legacy_children_only:
+            sql += " AND json_extract(data, '$.children') IS NULL AND json_extract(data, '$.num_children') > 0"
+        with closing(self._connect()) as conn:
+            rows = conn.execute(sql + " ORDER BY user_id LIMIT ?",
+                                ('' if after is None else str(after), limit)).fetchall()
+        return [self._project(json.loads(r[0]), columns) for r in rows]
+
+    def get_daily_updates(self, date_str: str, columns: str):
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT * FROM daily_updates WHERE date = ?", (date_str,)).fetchone()
+        return self._project(row, columns)
+
+    def insert_daily_updates(self, row: Dict[str, Any]):
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "INSERT INTO daily_updates (date, finance_news, health_tips, education_info, created_at)"
+                " VALUES (?, ?, ?, ?, ?) ON CONFLICT(date) DO NOTHING",
+                (row['date'], row.get('finance_news'), row.get('health_tips'), row.get('education_info'),
+                 row.get('created_at'))
+            )
+
+    def get_cached_suggestion(self, key: str):
+        with closing(self._connect()) as conn:
+            row = conn.execute(f"SELECT content, created_at FROM {AI_SUGGESTION_CACHE_TABLE} WHERE key = ?",
+                               (key,)).fetchone()
+        return dict(row) if row else None
+
+    def put_cached_suggestion(self, row: Dict[str, Any]):
+        with closing(self._connect()) as conn:
+            conn.execute(
+                f"INSERT INTO {AI_SUGGESTION_CACHE_TABLE} (key, model, data_type, content, created_at)"
+                " VALUES (?, ?, ?, ?, ?) ON CONFLICT(key) DO UPDATE SET model = excluded.model,"
+                " data_type = excluded.data_type, content = excluded.content, created_at = excluded.created_at",
+                (row['key'], row['model'], row['data_type'], row['content'], row['created_at'])
+            )
+
+
+@st.cache_resource
+def get_storage():
+    """Process-wide data store: SQLite when STORAGE_BACKEND is "sqlite", Supabase otherwise."""
+    if st.secrets.get("STORAGE_BACKEND", "supabase") == "sqlite":
+        return SqliteStorage(st.secrets.get("STORAGE_DB", SQLITE_STORAGE_DEFAULT_PATH))
+    return SupabaseStorage()
+
+# --- Children storage ---
+# Children live in the `children` jsonb column as a list of {age, grade, interests,
+# goals}, read with the rest of the row and held in memory as a tuple of Child
+# (plain tuples, no per-child dict). Rows written before this still carry the flat
+# child_{i}_* columns: decode_user_row falls back to them while `children` is null,
+# and migrate_children_storage copies them into the JSON column.
+#   alter table user_data add column if not exists children jsonb;
+USER_DATA_MAX_CHILDREN = 10  # legacy child_0_* .. child_9_* columns
+EDUCATION_MAX_CHILDREN = 20  # limit of the education form; the JSON column has none
+CHILD_ATTRS = ('age', 'grade', 'interests', 'goals')
+LEGACY_CHILD_FIELDS = [f'child_{i}_{attr}' for i in range(USER_DATA_MAX_CHILDREN) for attr in CHILD_ATTRS]
+
+
+class Child(NamedTuple):
+    age: int
+    grade: str
+    interests: str
+    goals: str
+
+
+def _child(age=None, grade=None, interests=None, goals=None) -> Child:
+    """Child with the page defaults for missing values."""
+    try:
+        age = int(age) if age is not None else 10
+    except (TypeError, ValueError):
+        age = 10
+    return Child(age, grade or '小学', interests or '', goals or '')
+
+
+def raw_children(value) -> Any:
+    """The children column as a list of dicts (stored values as-is), or None when unset.
+
+    Items that are neither dicts nor lists are skipped.
+    """
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            return None
+    if not isinstance(value, list):
+        return None
+    return [c if isinstance(c, dict) else dict(zip(CHILD_ATTRS, c))
+            for c in value if isinstance(c, (dict, list))]
+
+
+def legacy_children(row: Dict[str, Any], num_children) -> List[Dict[str, Any]]:
+    """Children from the flat child_{i}_* columns of a row (DB column names), as stored."""
+    try:
+        n = max(0, min(int(num_children or 0), USER_DATA_MAX_CHILDREN))
+    except (TypeError, ValueError):
+        n = 0
+    return [{attr: row.get(f'child_{i}_{attr}') for attr in CHILD_ATTRS} for i in range(n)]
+
+
+def _encode_children(value) -> List[Dict[str, Any]]:
+    return [c._asdict() if isinstance(c, Child) else {attr: c.get(attr) for attr in CHILD_ATTRS}
+            for c in value or []]
+
+
+# --- user_data record schema ---
+# Single source of truth for user_data fields: application key, DB column, how a loaded
+# value is normalized for the pages (decode) and how a submitted value is coerced before
+# it is written (encode). Fields with always=True are present on every loaded record,
+# taking their decoded default when the column is missing. Anything outside the schema
+# is never written.
+AI_SUGGESTION_TYPES = ('life', 'investment', 'health', 'education')  # ai_{type}_suggestion columns
+
+
+class UserField:
+    __slots__ = ('key', 'column', 'decode', 'encode', 'always')
+
+    def __init__(self, key: str, column: str = None, decode=None, encode=None, always: bool = False):
+        self.key = key
+        self.column = column or key
+        self.decode = decode
+        self.encode = encode
+        self.always = always
+
+
+def _or_default(default, cast=None):
+    """Decoder: falsy values become `default`, then `cast` is applied."""
+    if cast is None:
+        return lambda v: v or default
+    return lambda v: cast(v or default)
+
+
+def _encode_float(value) -> float:
+    try:
+        return float(value or 0.0)
+    except Exception:
+        return 0.0
+
+
+def _encode_percentage(value) -> int:
+    try:
+        return max(0, int(value) if value is not None else 0)
+    except Exception:
+        return 0
+
+
+def _encode_str_list(value) -> List[str]:
+    return [str(x) for x in value] if isinstance(value, (list, tuple)) else []
+
+
+_decode_int = _or_default(0, int)
+
+USER_DATA_SCHEMA: List[UserField] = [
+    UserField('total_assets', decode=_or_default(0.0, float), encode=_encode_float, always=True),
+    UserField('stock_percentage', decode=_decode_int, encode=_encode_percentage, always=True),
+    UserField('bond_percentage', decode=_decode_int, encode=_encode_percentage, always=True),
+    UserField('property_percentage', decode=_decode_int, encode=_encode_percentage, always=True),
+    UserField('cash_percentage', decode=_decode_int, encode=_encode_percentage, always=True),
+    UserField('risk_level', decode=_or_default('平衡'), always=True),
+    UserField('health_score', decode=_decode_int, always=True),
+    UserField('health_status'),
+    UserField('age'),
+    UserField('height', 'height_cm'),
+    UserField('weight', 'weight_kg'),
+    UserField('blood_pressure'),
+    UserField('exercise_freq', decode=_or_default('每周3-4次'), always=True),
+    UserField('sleep_hours'),
+    UserField('smoke', encode=bool),
+    UserField('drink', decode=_or_default('偶尔'), always=True),
+    UserField('health_goals', decode=_or_default(''), always=True),
+    UserField('bmi'),
+    UserField('num_children', decode=_decode_int, always=True),
+    UserField('children', encode=_encode_children),
+    UserField('education_budget'),
+    UserField('education_plan', decode=_or_default(''), always=True),
+    UserField('education_progress', decode=_decode_int, always=True),
+    UserField('education_goals'),
+    UserField('life_stage'),
+    UserField('short_term_goals'),
+    UserField('medium_term_goals'),
+    UserField('long_term_goals'),
+    UserField('life_vision'),
+    UserField('priorities', encode=_encode_str_list),
+    UserField('wealth_score'),
+    UserField('family_score'),
+    UserField('career_score'),
+    UserField('growth_score'),
+    UserField('life_score', decode=_decode_int, always=True),
+    UserField('name'),
+    UserField('email_contact'),
+    UserField('phone'),
+    UserField('birth_date'),
+    UserField('gender'),
+    UserField('occupation'),
+    UserField('city'),
+    UserField('marital_status'),
+    UserField('daily_news', encode=bool),
+    UserField('investment_alert', encode=bool),
+    UserField('health_reminder', encode=bool),
+    UserField('education_update', encode=bool),
+    UserField('allow_ai_analysis'),
+    UserField('ux_opt_in'),
+    *[UserField(f'{prefix}_{data_type}_{suffix}')
+      for data_type in AI_SUGGESTION_TYPES
+      for prefix, suffix in (('ai', 'suggestion'), ('last_ai', 'date'))],
+    UserField('weekly_tasks'),
+    UserField('monthly_goals'),
+    *[UserField(key) for key in LEGACY_CHILD_FIELDS],
+]
+
+_USER_FIELDS_BY_KEY: Dict[str, UserField] = {f.key: f for f in USER_DATA_SCHEMA}
+_USER_FIELDS_BY_COLUMN: Dict[str, UserField] = {f.column: f for f in USER_DATA_SCHEMA}
+_USER_FIELDS_ALWAYS = [f for f in USER_DATA_SCHEMA if f.always]
+
+
+class UserRecord(Mapping):
+    """Read-only user_data record with one slot per schema field.
+
+    Behaves like the dict the pages used to get (get, [], in, keys, dict(record));
+    unset slots are absent keys. Columns outside the schema (user_id, timestamps)
+    are kept in `_extra`.
+    """
+
+    __slots__ = tuple(_USER_FIELDS_BY_KEY) + ('_extra',)
+
+    def __init__(self):
+        self._extra = None
+
+    def __getitem__(self, key):
+        slot = _USER_RECORD_SLOTS.get(key)
+        if slot is not None:
+            try:
+                return slot.__get__(self)
+            except AttributeError:
+                raise KeyError(key) from None
+        if self._extra is not None and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def __iter__(self):
+        for key, slot in _USER_RECORD_SLOTS.items():
+            try:
+                slot.__get__(self)
+            except AttributeError:
+                continue
+            yield key
+        if self._extra:
+            yield from self._extra
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f"UserRecord({dict(self)!r})"
+
+
+_USER_RECORD_SLOTS = {key: UserRecord.__dict__[key] for key in _USER_FIELDS_BY_KEY}
+
+
+def decode_user_row(row: Dict[str, Any]) -> UserRecord:
+    """DB row (column names) -> UserRecord with app keys and page defaults, in one pass.
+
+    `children` is always a tuple of Child, taken from the JSON column or, for rows not
+    migrated yet, from the flat child_{i}_* columns.
+    """
+    record = UserRecord()
+    if not row:
+        return record
+    for column, value in row.items():
+        field = _USER_FIELDS_BY_COLUMN.get(column)
+        if field is None:
+            if record._extra is None:
+                record._extra = {}
+            record._extra[column] = value
+        else:
+            setattr(record, field.key, field.decode(value) if field.decode else value)
+    for field in _USER_FIELDS_ALWAYS:
+        if field.column not in row:
+            setattr(record, field.key, field.decode(None))
+    children = raw_children(row.get('children'))
+    if children is None:
+        children = legacy_children(row, record.num_children)
+    # keys outside CHILD_ATTRS (e.g. a stored 'name') are ignored, as in _encode_children
+    record.children = tuple(_child(**{attr: c.get(attr) for attr in CHILD_ATTRS}) for c in children)
+    return record
+
+
+def encode_user_data(data: Dict[str, Any]) -> Dict[str, Any]:
+    """App-level fields -> coerced values keyed by DB column; keys outside the schema are dropped."""
+    encoded = {}
+    for key, value in data.items():
+        field = _USER_FIELDS_BY_KEY.get(key)
+        if field is not None:
+            encoded[field.column] = field.encode(value) if field.encode else value
+    return encoded
+
+
+# --- Column projections ---
+# user_data fields (app keys) each page and operation reads. load_user_data fetches
+# only the projected columns this rerun has not loaded yet and merges them into the
+# snapshot, so a page needing four numbers no longer pulls the suggestion texts, goal
+# free text and child_* columns. A projection of None loads every column.
+_CHILD_FIELDS = ['num_children', 'children']  # legacy flat columns are loaded on demand
+_ALLOCATION_FIELDS = ['total_assets', 'stock_percentage', 'bond_percentage', 'property_percentage',
+                      'cash_percentage', 'risk_level']
+
+
+def _suggestion_fields(*data_types: str) -> List[str]:
+    return [f'{prefix}_{data_type}_{suffix}' for data_type in data_types
+            for prefix, suffix in (('ai', 'suggestion'), ('last_ai', 'date'))]
+
+
+USER_DATA_PROJECTIONS: Dict[str, Any] = {
+    'session_init': _ALLOCATION_FIELDS + [
+        'age', 'height', 'weight', 'exercise_freq', 'sleep_hours', 'smoke', 'drink',
+        'life_stage', 'short_term_goals', 'medium_term_goals', 'long_term_goals', 'life_vision', 'priorities',
+        'weekly_tasks', 'monthly_goals', 'name', 'phone', 'gender', 'marital_status'] + _CHILD_FIELDS,
+    'dashboard': _ALLOCATION_FIELDS + [
+        'health_score', 'health_status', 'education_progress', 'education_goals', 'life_score',
+        'life_stage'] + _suggestion_fields('life'),
+    'investment': _ALLOCATION_FIELDS + _suggestion_fields('investment'),
+    'health': ['age', 'height', 'weight', 'bmi', 'blood_pressure', 'exercise_freq', 'sleep_hours', 'smoke',
+               'drink', 'health_goals', 'health_score'] + _suggestion_fields('health'),
+    'education': ['education_budget', 'education_plan'] + _CHILD_FIELDS
+                 + _suggestion_fields('education'),
+    'life_planning': [
+        'life_stage', 'short_term_goals', 'medium_term_goals', 'long_term_goals', 'life_vision', 'priorities',
+        'total_assets', 'wealth_score', 'family_score', 'career_score', 'growth_score', 'health_score',
+        'education_progress', 'life_score'] + _suggestion_fields('life'),
+    'profile': None,  # the data export needs every column
+    'precompute': ['total_assets', 'stock_percentage', 'risk_level', 'health_status', 'education_goals',
+                   'life_stage', 'age', 'bmi', 'exercise_freq', 'sleep_hours', 'health_goals',
+                   'education_budget', 'education_plan'] + _CHILD_FIELDS + LEGACY_CHILD_FIELDS
+                  + _suggestion_fields(*AI_SUGGESTION_TYPES),
 }
 
-# inverse mapping (db column -> app key)
-DB_TO_APP: Dict[str, str] = {v: k for k, v in APP_TO_DB.items()}
-
-def _map_app_to_db(data: Dict[str, Any]) -> Dict[str, Any]:
-    """Translate application keys to DB column names using APP_TO_DB."""
-    mapped = {}
-    for k, v in data.items():
-        dbk = APP_TO_DB.get(k, k)
-        mapped[dbk] = v
-    return mapped
-
-def _map_db_row_to_app(row: Dict[str, Any]) -> Dict[str, Any]:
-    """Translate DB row keys to application keys using DB_TO_APP."""
-    mapped = {}
-    for k, v in row.items():
-        appk = DB_TO_APP.get(k, k)
-        mapped[appk] = v
-    return mapped
+
+def projection_columns(projection) -> Any:
+    """DB column names for a projection name or list of app keys; None means all columns."""
+    if projection is None:
+        return None
+    keys = USER_DATA_PROJECTIONS[projection] if isinstance(projection, str) else projection
+    if keys is None:
+        return None
+    return frozenset(_USER_FIELDS_BY_KEY[k].column for k in keys) | {'user_id'}
+
 
 # 页面配置
 st.set_page_config(
@@ -203,51 +638,27 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # 数据库初始化
+@st.cache_resource(show_spinner=False)
 def init_database():
-    """初始化数据库表"""
-    try:
-        # 用户表
-        supabase.table('users').select("*").limit(1).execute()
-    except:
-        pass
-    
-    try:
-        # 用户数据表
-        supabase.table('user_data').select("*").limit(1).execute()
-    except:
-        pass
-    
+    """初始化数据库表（每个进程只执行一次）"""
     try:
-        # 每日更新表
-        supabase.table('daily_updates').select("*").limit(1).execute()
-    except:
-        pass
+        # 用户表、用户数据表、每日更新表
+        get_storage().ensure_schema()
+    except Exception as e:
+        logger.warning('Storage schema check failed: %s', e)
 
 # 用户认证
 def authenticate_user():
-    """用户登录认证（使用 streamlit_authenticator）"""
+    """用户登录认证"""
     if 'authentication_status' not in st.session_state:
         st.session_state['authentication_status'] = None
     if 'username' not in st.session_state:
         st.session_state['username'] = None
 
-    # Build credentials dict from Supabase users table
-    try:
-        users_res = supabase.table('users').select('id,username,email,password').execute()
-        users = users_res.data or []
-    except Exception:
-        users = []
-
-    credentials = {'users': {}}
-    # password in DB is stored as sha256; streamlit_authenticator expects hashed passwords via its Hasher.
-    # We'll allow direct check by falling back to custom authenticate_login when needed.
-    for u in users:
-        credentials['users'][u['username']] = {
-            'email': u.get('email', ''),
-            'name': u.get('username', ''),
-            # Put placeholder for password; stauth requires a password but we'll authenticate separately
-            'password': u.get('password', '')
-        }
+    # Revalidate the signed-in account by primary key (cached for AUTH_USER_CACHE_TTL);
+    # reruns never scan the users table.
+    if st.session_state['authentication_status'] and not get_authenticated_user():
+        _clear_auth_session()
 
     with st.sidebar:
         st.title("🎯 智慧人生规划系统")
@@ -266,6 +677,7 @@ def authenticate_user():
                             st.session_state['authentication_status'] = True
                             st.session_state['username'] = username
                             st.session_state['user_id'] = user['id']
+                            _cache_auth_user(user)
                             safe_rerun()
                         else:
                             st.error("用户名或密码错误")
@@ -290,19 +702,60 @@ def authenticate_user():
         elif st.session_state['authentication_status']:
             st.write(f"👤 欢迎, {st.session_state['username']}")
             if st.button("登出"):
-                st.session_state['authentication_status'] = None
-                st.session_state['username'] = None
-                st.session_state['user_id'] = None
+                _clear_auth_session()
                 safe_rerun()
 
+
+# Authenticated user record cache (per session). Holds no password hash.
+AUTH_USER_CACHE_TTL = 300  # seconds between revalidations of the signed-in account
+AUTH_USER_FIELDS = 'id,username,email'
+
+
+def _cache_auth_user(user: Dict[str, Any]):
+    st.session_state['_auth_user'] = {k: user.get(k) for k in AUTH_USER_FIELDS.split(',')}
+    st.session_state['_auth_user_checked_at'] = time_module.monotonic()
+
+
+def _clear_auth_session():
+    flush_pending_writes(st.session_state.get('user_id'))
+    st.session_state['authentication_status'] = None
+    st.session_state['username'] = None
+    st.session_state['user_id'] = None
+    st.session_state.pop('_auth_user', None)
+    st.session_state.pop('_auth_user_checked_at', None)
+
+
+def get_authenticated_user():
+    """Return the signed-in user's record, refetching by id at most every AUTH_USER_CACHE_TTL.
+
+    Returns None when the account no longer exists; a failed lookup keeps the cached record.
+    """
+    user_id = st.session_state.get('user_id')
+    if not user_id:
+        return None
+    cached = st.session_state.get('_auth_user')
+    checked_at = st.session_state.get('_auth_user_checked_at', 0)
+    if cached and cached.get('id') == user_id and time_module.monotonic() - checked_at < AUTH_USER_CACHE_TTL:
+        return cached
+    try:
+        user = get_storage().get_user_by_id(user_id, AUTH_USER_FIELDS)
+    except Exception:
+        return cached
+    if not user:
+        return None
+    _cache_auth_user(user)
+    return st.session_state['_auth_user']
+
+
 def authenticate_login(username, password):
     """验证登录"""
     try:
-        # Compare sha256 hashes stored in DB
+        # Compare sha256 hashes stored in DB; single indexed lookup by username
         hashed_pw = hashlib.sha256(password.encode()).hexdigest()
-        result = supabase.table('users').select("*").eq('username', username).execute()
-        if result.data and result.data[0].get('password') == hashed_pw:
-            return result.data[0]
+        user = get_storage().get_user_by_username(username, AUTH_USER_FIELDS + ',password')
+        if user and user.get('password') == hashed_pw:
+            # never hand the hash back to callers / session state
+            return {k: v for k, v in user.items() if k != 'password'}
         return None
     except:
         return None
@@ -312,89 +765,697 @@ def register_user(username, email, password):
     try:
         hashed_pw = hashlib.sha256(password.encode()).hexdigest()
         # basic uniqueness check
-        existing = supabase.table('users').select('id').eq('username', username).execute()
-        if existing.data:
+        if get_storage().get_user_by_username(username, 'id'):
             return False
-        supabase.table('users').insert({
+        get_storage().insert_user({
             'username': username,
             'email': email,
             'password': hashed_pw,
             'created_at': datetime.now().isoformat()
-        }).execute()
+        })
         return True
     except:
         return False
 
-# OpenAI API调用
-def get_ai_suggestion(context: Any, data_type: str) -> str:
-    """获取AI建议"""
-    try:
-        # Structured JSON prompt to force consistent, professional output
-        base_system = (
-            "你是一位资深的职业顾问和分析师，面向中高净值用户。请基于用户给出的上下文，生成结构化的JSON输出，"
-            "包含以下字段：summary(一句话总结), recommendations(要点列表), actions(可执行步骤列表), risks(潜在风险列表), confidence(可信度，0-100)。"
-            "返回必须是有效JSON，不包含其他无关文本。每个列表项为字符串。"
-        )
+# --- Resilient LLM client ---
+# All model calls go through ResilientLLMClient: per-call deadlines, jittered retries for
+# transient errors, a circuit breaker that fails fast while the provider is unhealthy and
+# a token-bucket limiter shared by every session in the process. QWEN_BASE_URL in secrets
+# points the client at another OpenAI-compatible endpoint (e.g. a local fake for tests).
+QWEN_BASE_URL = st.secrets.get("QWEN_BASE_URL", "https://dashscope.aliyuncs.com/compatible-mode/v1")
+LLM_DEFAULT_DEADLINE = 30.0  # seconds per call, including retries
+LLM_MAX_RETRIES = 2
+LLM_RETRY_BASE_DELAY = 0.5  # seconds; doubled per attempt with ±50% jitter
+LLM_BREAKER_FAILURES = 5  # consecutive failures that open the circuit
+LLM_BREAKER_RESET = 30.0  # seconds before a half-open probe is allowed
+LLM_RPM = 120  # client-side requests per minute for the whole process
+LLM_TPM = 200000  # client-side tokens per minute for the whole process
 
-        user_prompt = (
-            f"数据类型：{data_type}\n用户上下文：\n{context}\n\n请以JSON格式返回结果，保持字段完整且简洁。"
-        )
 
-        response = openai_client.chat.completions.create(
-            model="qwen3-max-2025-09-23",
-            messages=[
-                {"role": "system", "content": base_system},
-                {"role": "user", "content": user_prompt}
-            ],
-            max_tokens=500,
-            temperature=0.2
-        )
+class LLMUnavailableError(Exception):
+    """The model could not be reached: circuit open, rate limit wait too long, or retries exhausted."""
+
+
+def estimate_tokens(text: Any) -> int:
+    """Rough token count: ~1 token per CJK character, ~4 characters per token otherwise."""
+    text = str(text or '')
+    cjk = sum(1 for ch in text if '一' <= ch <= '鿿')
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at rate_per_minute."""
+
+    def __init__(self, rate_per_minute: float, capacity: float = None):
+        self.rate_per_second = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self._tokens = self.capacity
+        self._updated = time_module.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time_module.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate_per_second)
+        self._updated = now
+
+    def try_acquire(self, amount: float = 1) -> float:
+        """Take amount if available and return 0, otherwise return the seconds to wait."""
+        amount = min(amount, self.capacity)
+        with self._lock:
+            self._refill()
+            if self._tokens >= amount:
+                self._tokens -= amount
+                return 0.0
+            return (amount - self._tokens) / self.rate_per_second
+
+    def acquire(self, amount: float = 1, timeout: float = None) -> bool:
+        """Block until amount is available; False if timeout would expire first."""
+        deadline = None if timeout is None else time_module.monotonic() + timeout
+        while True:
+            wait = self.try_acquire(amount)
+            if wait == 0:
+                return True
+            if deadline is not None and time_module.monotonic() + wait > deadline:
+                return False
+            time_module.sleep(wait)
+
+
+class LLMRateLimiter:
+    """Requests-per-minute and tokens-per-minute limits applied together."""
+
+    def __init__(self, rpm: float, tpm: float):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+
+    def acquire(self, estimated_tokens: int, timeout: float = None) -> bool:
+        return self.requests.acquire(1, timeout) and self.tokens.acquire(estimated_tokens, timeout)
+
+
+class CircuitBreaker:
+    """closed -> open after `failure_threshold` consecutive failures; half-open after `reset_timeout`.
+
+    In half-open state a single probe call is let through; its outcome closes or re-opens
+    the circuit. A probe that ends without an outcome (abandoned stream) is handed back
+    with release_probe; one still unresolved after `reset_timeout` is replaced by a new probe.
+    """
+
+    def __init__(self, failure_threshold: int = LLM_BREAKER_FAILURES, reset_timeout: float = LLM_BREAKER_RESET):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._probe_started = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            now = time_module.monotonic()
+            if self.state == 'open' and now - self._opened_at >= self.reset_timeout:
+                self.state = 'half_open'
+                self._probe_in_flight = False
+            if self.state == 'half_open' and (
+                    not self._probe_in_flight or now - self._probe_started >= self.reset_timeout):
+                self._probe_in_flight = True
+                self._probe_started = now
+                return True
+            return False
+
+    def release_probe(self):
+        """Let another half-open probe through when this one ended without an outcome."""
+        with self._lock:
+            if self.state == 'half_open':
+                self._probe_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == 'half_open' or self._failures >= self.failure_threshold:
+                if self.state != 'open':
+                    logger.warning('LLM circuit opened after %s consecutive failures', self._failures)
+                self.state = 'open'
+                self._opened_at = time_module.monotonic()
+                self._probe_in_flight = False
+
+
+def _is_transient_llm_error(error: Exception) -> bool:
+    """Timeouts, connection errors, 429 and 5xx are worth retrying; other API errors are not."""
+    transient_types = tuple(t for t in (
+        getattr(openai, 'APITimeoutError', None),
+        getattr(openai, 'APIConnectionError', None),
+        getattr(openai, 'RateLimitError', None),
+        getattr(openai, 'InternalServerError', None),
+    ) if t is not None)
+    if transient_types and isinstance(error, transient_types):
+        return True
+    status = getattr(error, 'status_code', None)
+    return status is not None and (status == 429 or status >= 500)
+
 
-        # Parse response content
-        content = None
-        if getattr(response, 'choices', None):
-            c = response.choices[0]
-            if hasattr(c, 'message') and hasattr(c.message, 'content'):
-                content = c.message.content
+def _completion_text(response) -> str:
+    """Extract the message text from a chat completion response."""
+    if getattr(response, 'choices', None):
+        c = response.choices[0]
+        if hasattr(c, 'message') and hasattr(c.message, 'content'):
+            return str(c.message.content or "")
+        return str(c)
+    return str(response)
+
+
+class LLMUsageStats:
+    """Process-wide prompt/completion token counters per call label (e.g. 'suggestion:health').
+
+    Counts come from the provider's `usage` field; when it is missing the prompt is
+    estimated with estimate_tokens and the completion is counted from the returned text.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_label: Dict[str, Dict[str, float]] = {}
+
+    def record(self, label: str, prompt_tokens: int, completion_tokens: int, latency_ms: float):
+        with self._lock:
+            entry = self._by_label.setdefault(
+                label, {'calls': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'latency_ms': 0.0})
+            entry['calls'] += 1
+            entry['prompt_tokens'] += prompt_tokens
+            entry['completion_tokens'] += completion_tokens
+            entry['latency_ms'] += latency_ms
+        logger.debug('LLM %s: prompt=%s completion=%s tokens in %.0fms', label, prompt_tokens, completion_tokens, latency_ms)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {
+                label: dict(entry, avg_latency_ms=entry['latency_ms'] / entry['calls'])
+                for label, entry in self._by_label.items()
+            }
+
+    def totals(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                key: sum(entry[key] for entry in self._by_label.values())
+                for key in ('calls', 'prompt_tokens', 'completion_tokens')
+            }
+
+
+def _usage_counts(usage, prompt_estimate: int, completion_text: str):
+    """(prompt_tokens, completion_tokens) from a usage object, estimating what is missing."""
+    prompt_tokens = getattr(usage, 'prompt_tokens', None)
+    completion_tokens = getattr(usage, 'completion_tokens', None)
+    if prompt_tokens is None:
+        prompt_tokens = prompt_estimate
+    if completion_tokens is None:
+        completion_tokens = estimate_tokens(completion_text)
+    return int(prompt_tokens), int(completion_tokens)
+
+
+class ResilientLLMClient:
+    """Wrapper around an OpenAI-compatible client adding deadlines, retries, breaker and limiter."""
+
+    def __init__(self, client, limiter: LLMRateLimiter, breaker: CircuitBreaker,
+                 default_deadline: float = LLM_DEFAULT_DEADLINE, max_retries: int = LLM_MAX_RETRIES,
+                 retry_base_delay: float = LLM_RETRY_BASE_DELAY, usage: LLMUsageStats = None):
+        self.client = client
+        self.limiter = limiter
+        self.breaker = breaker
+        self.usage = usage or LLMUsageStats()
+        self.default_deadline = default_deadline
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+
+    def chat(self, deadline: float = None, label: str = 'llm', **kwargs):
+        """chat.completions.create with an overall deadline (seconds) across all attempts.
+
+        Raises LLMUnavailableError when the circuit is open, the limiter cannot admit the
+        call before the deadline, or transient failures exhaust the retries. Non-transient
+        API errors (bad request, auth) propagate unchanged; the provider answered them, so
+        they count as a success for the breaker. Token usage is recorded under `label`; for
+        streams it is recorded once the stream is exhausted.
+
+        Every path that takes the half-open probe settles it (success, failure or
+        release_probe), so an error on the probe cannot leave the circuit stuck.
+        """
+        deadline = deadline or self.default_deadline
+        started = time_module.monotonic()
+        prompt = ''.join(str(m.get('content', '')) for m in kwargs.get('messages', []))
+        prompt_estimate = estimate_tokens(prompt)
+        if kwargs.get('stream'):
+            # ask for a final usage chunk so streamed calls are metered like the others
+            kwargs.setdefault('stream_options', {'include_usage': True})
+        # wait for capacity before taking the probe, so a limiter timeout never holds it
+        if not self.limiter.acquire(prompt_estimate + kwargs.get('max_tokens', 0), timeout=deadline):
+            raise LLMUnavailableError("LLM rate limit: no capacity before deadline")
+        if not self.breaker.allow():
+            raise LLMUnavailableError("LLM circuit open")
+        attempt = 0
+        settled = False
+        try:
+            while True:
+                remaining = deadline - (time_module.monotonic() - started)
+                if remaining <= 0:
+                    self.breaker.record_failure()
+                    settled = True
+                    raise LLMUnavailableError(f"LLM deadline of {deadline}s exceeded")
+                try:
+                    response = self.client.chat.completions.create(timeout=remaining, **kwargs)
+                    if kwargs.get('stream'):
+                        # the breaker hears about a stream once it has been read to the end;
+                        # _metered_stream settles the probe from here on
+                        settled = True
+                        return self._metered_stream(response, label, prompt_estimate, started)
+                    self.breaker.record_success()
+                    settled = True
+                    self.usage.record(label, *_usage_counts(getattr(response, 'usage', None), prompt_estimate,
+                                                            _completion_text(response)),
+                                      (time_module.monotonic() - started) * 1000)
+                    return response
+                except Exception as e:
+                    if not _is_transient_llm_error(e):
+                        self.breaker.record_success()
+                        settled = True
+                        raise
+                    self.breaker.record_failure()
+                    if attempt >= self.max_retries or not self.breaker.allow():
+                        settled = True
+                        raise LLMUnavailableError(f"LLM unavailable after {attempt + 1} attempts: {e}") from e
+                    delay = self.retry_base_delay * (2 ** attempt) * random.uniform(0.5, 1.5)
+                    time_module.sleep(min(delay, max(0.0, deadline - (time_module.monotonic() - started))))
+                    attempt += 1
+        finally:
+            if not settled:
+                self.breaker.release_probe()
+
+    def _metered_stream(self, stream, label: str, prompt_estimate: int, started: float):
+        usage, parts = None, []
+        try:
+            for chunk in stream:
+                usage = getattr(chunk, 'usage', None) or usage
+                if getattr(chunk, 'choices', None):
+                    parts.append(getattr(chunk.choices[0].delta, 'content', None) or '')
+                yield chunk
+            self.breaker.record_success()
+        except Exception as e:
+            # a connection dropped or timed out mid-stream counts like a failed call
+            if _is_transient_llm_error(e):
+                self.breaker.record_failure()
             else:
-                content = str(c)
+                self.breaker.record_success()
+            raise
+        finally:
+            # abandoned mid-iteration (GeneratorExit on a rerun or page switch): no outcome,
+            # but a half-open probe must not stay taken
+            self.breaker.release_probe()
+            self.usage.record(label, *_usage_counts(usage, prompt_estimate, ''.join(parts)),
+                              (time_module.monotonic() - started) * 1000)
+
+    def status(self) -> Dict[str, Any]:
+        return {'breaker': self.breaker.state}
+
+
+@st.cache_resource
+def get_llm_client() -> ResilientLLMClient:
+    """Process-wide resilient client; breaker and limiter state are shared by all sessions."""
+    # retries are handled by the wrapper, so the SDK's own retry loop is disabled
+    from openai import OpenAI
+    raw = OpenAI(api_key=st.secrets["QWEN_API_KEY"], base_url=QWEN_BASE_URL, max_retries=0)
+    return ResilientLLMClient(raw, LLMRateLimiter(LLM_RPM, LLM_TPM), CircuitBreaker())
+
+
+# --- Prompt compaction ---
+# Each variable context section gets a token budget so prompt size stays bounded no
+# matter how long the news blob or the children's free text grows. Over-budget text keeps
+# its leading lines (news items, sentences) and is cut with '…'.
+PROMPT_SECTION_BUDGETS = {
+    'finance_news': 200,
+    'health_tips': 100,
+    'education_info': 100,
+    'free_text': 80,  # each user-written goal/plan field
+    'child': 60,  # one child's line
+    'children': 240,  # all children together
+}
+# Upper bound per suggestion context, checked by benchmarks/prompt_size.py
+PROMPT_CONTEXT_TOKEN_LIMITS = {'life': 300, 'investment': 320, 'health': 360, 'education': 600}
+
+
+def truncate_to_tokens(text: Any, budget: int) -> str:
+    """Cut text to roughly `budget` tokens, preferring whole lines, marking the cut with '…'."""
+    text = str(text or '')
+    if estimate_tokens(text) <= budget:
+        return text
+    kept, used = [], 0
+    for line in text.splitlines():
+        cost = estimate_tokens(line)
+        if used + cost > budget:
+            break
+        kept.append(line)
+        used += cost
+    if kept:
+        return '\n'.join(kept) + '…'
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if estimate_tokens(text[:mid]) <= budget:
+            lo = mid
         else:
-            content = str(response)
+            hi = mid - 1
+    return text[:lo] + '…'
+
+
+class PromptBuilder:
+    """Assemble a context as '标签：内容' lines, holding each section to its budget."""
+
+    def __init__(self):
+        self.lines: List[str] = []
+
+    def add(self, label: str, value: Any, budget: int = None) -> 'PromptBuilder':
+        text = _normalize_context(value)
+        if budget is not None:
+            text = truncate_to_tokens(text, budget)
+        self.lines.append(f"{label}：{text}")
+        return self
+
+    def build(self) -> str:
+        return '\n'.join(self.lines)
 
-        # Try to extract JSON from content
+
+# OpenAI API调用
+AI_SUGGESTION_MODEL = "qwen3-max-2025-09-23"
+AI_SUGGESTION_MAX_TOKENS = 500
+# Structured JSON prompt to force consistent, professional output
+AI_SUGGESTION_SYSTEM_PROMPT = (
+    "你是一位资深的职业顾问和分析师，面向中高净值用户。请基于用户给出的上下文，生成结构化的JSON输出，"
+    "包含以下字段：summary(一句话总结), recommendations(要点列表), actions(可执行步骤列表), risks(潜在风险列表), confidence(可信度，0-100)。"
+    "返回必须是有效JSON，不包含其他无关文本。每个列表项为字符串。"
+)
+
+# 建议缓存（按内容寻址，跨用户共享）
+# Keyed by a hash of (model, system prompt, data_type, normalized context), so identical
+# contexts share one completion regardless of user. Tier 1 is an in-process LRU, tier 2
+# the ai_suggestion_cache table:
+#   create table ai_suggestion_cache (
+#       key text primary key,
+#       model text not null,
+#       data_type text not null,
+#       content text not null,
+#       created_at timestamptz not null default now()
+#   );
+AI_SUGGESTION_CACHE_TABLE = 'ai_suggestion_cache'
+AI_SUGGESTION_CACHE_MAX_ENTRIES = 1024
+AI_SUGGESTION_CACHE_TTL = 24 * 3600  # seconds
+
+
+def _normalize_context(context: Any) -> str:
+    """Collapse indentation/blank-line differences so equivalent contexts hash the same."""
+    lines = (' '.join(line.split()) for line in str(context or '').splitlines())
+    return '\n'.join(line for line in lines if line)
+
+
+def suggestion_cache_key(context: Any, data_type: str, model: str = AI_SUGGESTION_MODEL,
+                         system_prompt: str = AI_SUGGESTION_SYSTEM_PROMPT) -> str:
+    payload = json.dumps([model, system_prompt, data_type, _normalize_context(context)], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class SuggestionCache:
+    """Two-tier content-addressed cache of formatted AI suggestions with hit/miss counters."""
+
+    def __init__(self, max_entries: int = AI_SUGGESTION_CACHE_MAX_ENTRIES,
+                 ttl_seconds: float = AI_SUGGESTION_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # key -> (text, stored_at wall-clock seconds)
+        self._lock = threading.Lock()
+        self.counters = {'memory_hits': 0, 'table_hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+
+    def _count(self, name: str):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _remember(self, key: str, text: str, stored_at: float):
+        with self._lock:
+            self._entries[key] = (text, stored_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.counters['evictions'] += 1
+
+    def get(self, key: str):
+        now = time_module.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if now - entry[1] <= self.ttl_seconds:
+                    self._entries.move_to_end(key)
+                    self.counters['memory_hits'] += 1
+                    return entry[0]
+                del self._entries[key]
         try:
-            # If the model returned code block or text, attempt to find first '{'
-            text = str(content)
-            json_start = text.find('{')
-            if json_start != -1:
-                json_text = text[json_start:]
-            else:
-                json_text = text
-            parsed = json.loads(json_text)
-            # Format into a readable string
-            out_lines = []
-            out_lines.append(parsed.get('summary', ''))
-            if parsed.get('recommendations'):
-                out_lines.append('\n推荐要点:')
-                for r in parsed.get('recommendations'):
-                    out_lines.append(f"- {r}")
-            if parsed.get('actions'):
-                out_lines.append('\n可执行步骤:')
-                for a in parsed.get('actions'):
-                    out_lines.append(f"- {a}")
-            if parsed.get('risks'):
-                out_lines.append('\n潜在风险:')
-                for rk in parsed.get('risks'):
-                    out_lines.append(f"- {rk}")
-            conf = parsed.get('confidence')
-            if conf is not None:
-                out_lines.append(f"\n可信度: {conf}%")
-            return "\n".join([l for l in out_lines if l])
-        except Exception:
-            # Fallback to raw content
-            return str(content)
+            row = get_storage().get_cached_suggestion(key)
+            if row:
+                stored_at = datetime.fromisoformat(str(row['created_at']).replace('Z', '+00:00')).timestamp()
+                if now - stored_at <= self.ttl_seconds:
+                    self._remember(key, row['content'], stored_at)
+                    self._count('table_hits')
+                    return row['content']
+        except Exception as e:
+            logger.warning('Suggestion cache table read failed: %s', e)
+        self._count('misses')
+        return None
+
+    def put(self, key: str, text: str, data_type: str, model: str = AI_SUGGESTION_MODEL):
+        self._remember(key, text, time_module.time())
+        self._count('stores')
+        try:
+            get_storage().put_cached_suggestion({
+                'key': key,
+                'model': model,
+                'data_type': data_type,
+                'content': text,
+                'created_at': _utc_now().isoformat()
+            })
+        except Exception as e:
+            logger.warning('Suggestion cache table write failed: %s', e)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.counters)
+            stats['entries'] = len(self._entries)
+        lookups = stats['memory_hits'] + stats['table_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['memory_hits'] + stats['table_hits']) / lookups, 3) if lookups else 0.0
+        return stats
+
+
+@st.cache_resource
+def get_suggestion_cache() -> SuggestionCache:
+    """Process-wide SuggestionCache shared by all sessions."""
+    return SuggestionCache()
+
+
+def show_llm_cache_stats():
+    """Sidebar view of the shared suggestion cache counters (LLM calls saved = hits)."""
+    stats = get_suggestion_cache().stats()
+    with st.sidebar.expander("🧠 AI建议缓存"):
+        st.write(f"命中率：{stats['hit_rate'] * 100:.1f}%（内存 {stats['memory_hits']} / 数据表 {stats['table_hits']}）")
+        st.write(f"未命中（实际调用模型）：{stats['misses']}，已缓存条目：{stats['entries']}")
+        st.write(f"模型熔断器：{get_llm_client().status()['breaker']}")
+        usage = get_llm_client().usage.totals()
+        if usage['calls']:
+            st.write(f"模型调用 {usage['calls']} 次，平均输入 {usage['prompt_tokens'] / usage['calls']:.0f} tokens，"
+                     f"平均输出 {usage['completion_tokens'] / usage['calls']:.0f} tokens")
+
+
+def _format_ai_suggestion(content: Any) -> str:
+    """Render the model's JSON answer as readable text; fall back to the raw content."""
+    try:
+        # If the model returned code block or text, attempt to find first '{'
+        text = str(content)
+        json_start = text.find('{')
+        if json_start != -1:
+            json_text = text[json_start:]
+        else:
+            json_text = text
+        parsed = json.loads(json_text)
+        # Format into a readable string
+        out_lines = []
+        out_lines.append(parsed.get('summary', ''))
+        if parsed.get('recommendations'):
+            out_lines.append('\n推荐要点:')
+            for r in parsed.get('recommendations'):
+                out_lines.append(f"- {r}")
+        if parsed.get('actions'):
+            out_lines.append('\n可执行步骤:')
+            for a in parsed.get('actions'):
+                out_lines.append(f"- {a}")
+        if parsed.get('risks'):
+            out_lines.append('\n潜在风险:')
+            for rk in parsed.get('risks'):
+                out_lines.append(f"- {rk}")
+        conf = parsed.get('confidence')
+        if conf is not None:
+            out_lines.append(f"\n可信度: {conf}%")
+        return "\n".join([l for l in out_lines if l])
+    except Exception:
+        # Fallback to raw content
+        return str(content)
+
+
+def _ai_suggestion_messages(context: Any, data_type: str) -> List[Dict[str, str]]:
+    user_prompt = (
+        f"数据类型：{data_type}\n用户上下文：\n{_normalize_context(context)}\n\n请以JSON格式返回结果，保持字段完整且简洁。"
+    )
+    return [
+        {"role": "system", "content": AI_SUGGESTION_SYSTEM_PROMPT},
+        {"role": "user", "content": user_prompt}
+    ]
+
+
+def _generate_ai_suggestion(context: Any, data_type: str, use_cache: bool = True) -> str:
+    """Formatted suggestion from the shared cache or the model; raises on failure."""
+    cache = get_suggestion_cache()
+    key = suggestion_cache_key(context, data_type)
+    if use_cache:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+    response = get_llm_client().chat(
+        label=f"suggestion:{data_type}",
+        model=AI_SUGGESTION_MODEL,
+        messages=_ai_suggestion_messages(context, data_type),
+        max_tokens=AI_SUGGESTION_MAX_TOKENS,
+        temperature=0.2
+    )
+
+    suggestion = _format_ai_suggestion(_completion_text(response))
+    cache.put(key, suggestion, data_type)
+    return suggestion
+
+
+def _ai_error_message(error: Any) -> str:
+    """Generic text for the user; the underlying error only goes to the log."""
+    logger.warning('AI suggestion failed: %r', error)
+    return "AI建议暂时不可用，请稍后再试。"
+
+
+def _fallback_suggestion(user_id: str, context: Any, data_type: str, error: Any) -> str:
+    """Best answer without the model: shared cache, then the user's last (possibly stale) text."""
+    try:
+        shared = get_suggestion_cache().get(suggestion_cache_key(context, data_type))
+        if shared is not None:
+            return shared
+        if user_id:
+            cached_text, _ = _load_user_suggestion(user_id, data_type)
+            if cached_text:
+                logger.warning('AI suggestion failed, serving stored text: %r', error)
+                return str(cached_text)
     except Exception as e:
-        return f"建议生成中遇到问题，请稍后再试。错误：{str(e)}"
+        logger.warning('Suggestion fallback lookup failed: %s', e)
+    return _ai_error_message(error)
+
+
+def get_ai_suggestion(context: Any, data_type: str, use_cache: bool = True) -> str:
+    """获取AI建议（先查内容寻址缓存；use_cache=False 时强制调用模型并刷新缓存）"""
+    try:
+        return _generate_ai_suggestion(context, data_type, use_cache)
+    except Exception as e:
+        return _ai_error_message(e)
+
+
+def _load_user_suggestion(user_id: str, data_type: str):
+    """(text, date) of the suggestion stored on the user's row for data_type."""
+    field_text = f"ai_{data_type}_suggestion"
+    field_date = f"last_ai_{data_type}_date"
+    # served from this rerun's snapshot when the page projection already loaded them
+    snapshot = load_user_data(user_id, [field_text, field_date])
+    return snapshot.get(field_text), snapshot.get(field_date)
+
+
+def _save_user_suggestion(user_id: str, data_type: str, text: str, date_str: str):
+    upsert_user_data_row(user_id, {f"ai_{data_type}_suggestion": text, f"last_ai_{data_type}_date": date_str})
+
+
+# 过期内容先展示、后台刷新（stale-while-revalidate）
+# Yesterday's suggestion renders immediately with a "refreshing" marker while a
+# background worker regenerates it; the new text shows up on the next rerun.
+SUGGESTION_REFRESH_WORKERS = 4
+
+
+class SuggestionRefresher:
+    """Background regeneration of per-user suggestions, deduplicated per (user, data_type)."""
+
+    def __init__(self, max_workers: int = SUGGESTION_REFRESH_WORKERS):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='suggestion-refresh')
+        self._inflight = set()
+        self._lock = threading.Lock()
+
+    def submit(self, user_id: str, data_type: str, context: Any) -> bool:
+        """Schedule a refresh unless one is already running; True if newly scheduled."""
+        key = (user_id, data_type)
+        with self._lock:
+            if key in self._inflight:
+                return False
+            self._inflight.add(key)
+        self._pool.submit(self._refresh, key, context)
+        return True
+
+    def is_refreshing(self, user_id: str, data_type: str) -> bool:
+        with self._lock:
+            return (user_id, data_type) in self._inflight
+
+    def _refresh(self, key, context):
+        user_id, data_type = key
+        try:
+            suggestion = _generate_ai_suggestion(context, data_type)
+            # bare upsert: worker threads must not touch a rerun's snapshot
+            _upsert_user_data(user_id, {
+                f"ai_{data_type}_suggestion": suggestion,
+                f"last_ai_{data_type}_date": datetime.now().date().isoformat()
+            })
+        except Exception as e:
+            logger.warning('Background refresh of %s suggestion for %s failed: %s', data_type, user_id, e)
+        finally:
+            with self._lock:
+                self._inflight.discard(key)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+@st.cache_resource
+def get_suggestion_refresher() -> SuggestionRefresher:
+    """Process-wide SuggestionRefresher shared by all sessions."""
+    refresher = SuggestionRefresher()
+    atexit.register(refresher.shutdown)
+    return refresher
+
+
+def _resolve_cached_suggestion(user_id: str, context: Any, data_type: str):
+    """Answer without calling the model inline: (text, refreshing) or (None, False).
+
+    Order: today's text on the user's row, then the shared content cache (copied to the
+    row), then yesterday's (stale) text with a background refresh scheduled.
+    """
+    today = datetime.now().date().isoformat()
+    cached_text, cached_date = _load_user_suggestion(user_id, data_type)
+    if cached_text and cached_date == today:
+        return str(cached_text), False
+    shared = get_suggestion_cache().get(suggestion_cache_key(context, data_type))
+    if shared is not None:
+        _save_user_suggestion(user_id, data_type, shared, today)
+        return shared, False
+    if cached_text:
+        get_suggestion_refresher().submit(user_id, data_type, context)
+        return str(cached_text), True
+    return None, False
 
 
 def get_cached_ai_suggestion(user_id: str, context: Any, data_type: str) -> str:
@@ -403,163 +1464,869 @@ def get_cached_ai_suggestion(user_id: str, context: Any, data_type: str) -> str:
     This now persists the suggestion in the `user_data` row under keys:
       - ai_{data_type}_suggestion
       - last_ai_{data_type}_date
+    A stale (earlier day) suggestion is returned as-is while it is regenerated in the
+    background; only a user with no suggestion at all waits for the model.
     """
     try:
         # If no user_id provided, always fetch live
         if not user_id:
             return get_ai_suggestion(context, data_type)
 
-        field_text = f"ai_{data_type}_suggestion"
-        field_date = f"last_ai_{data_type}_date"
-
-        # helper functions
-        def load_ai():
-            row = supabase.table('user_data').select(field_text, field_date).eq('user_id', user_id).execute()
-            if row.data and len(row.data) > 0:
-                return row.data[0].get(field_text), row.data[0].get(field_date)
-            return None, None
-
-        def save_ai(text, date_str):
-            update = {field_text: text, field_date: date_str, 'updated_at': datetime.now().isoformat()}
-            existing = supabase.table('user_data').select('user_id').eq('user_id', user_id).execute()
-            if existing.data:
-                supabase.table('user_data').update(update).eq('user_id', user_id).execute()
-            else:
-                update['user_id'] = user_id
-                update['created_at'] = datetime.now().isoformat()
-                supabase.table('user_data').insert(update).execute()
-
         # Allow callers to force refresh by passing a special key in context (conservative change)
         force_refresh = False
         ctx_text = context if isinstance(context, str) else (context.get('text') if isinstance(context, dict) else '')
         if isinstance(context, dict) and context.get('__force_refresh'):
             force_refresh = True
 
-        today = datetime.now().date().isoformat()
-        cached_text, cached_date = load_ai()
-        if not force_refresh and cached_text and cached_date == today:
-            return str(cached_text)
+        if not force_refresh:
+            text, _ = _resolve_cached_suggestion(user_id, ctx_text, data_type)
+            if text is not None:
+                return text
 
-        # Call the AI and persist
-        suggestion = get_ai_suggestion(ctx_text, data_type)
-        save_ai(suggestion, today)
+        # Call the AI and persist (error text is shown but never stored)
+        try:
+            suggestion = _generate_ai_suggestion(ctx_text, data_type, use_cache=not force_refresh)
+        except Exception as e:
+            return _fallback_suggestion(user_id, ctx_text, data_type, e)
+        _save_user_suggestion(user_id, data_type, suggestion, datetime.now().date().isoformat())
         return suggestion
     except Exception:
         return get_ai_suggestion(context, data_type)
 
+
+# 流式输出
+# Render tokens as they arrive instead of waiting for the full 500-token completion;
+# AI_STREAMING=false in secrets restores the blocking panels.
+AI_STREAMING = bool(st.secrets.get("AI_STREAMING", True))
+
+
+class SuggestionStream:
+    """Iterate over streamed completion tokens while collecting the full text.
+
+    Errors end the iteration and are kept on .error instead of propagating into
+    st.write_stream.
+    """
+
+    def __init__(self, context: Any, data_type: str):
+        self.context = context
+        self.data_type = data_type
+        self.parts: List[str] = []
+        self.error = None
+
+    def __iter__(self):
+        try:
+            stream = get_llm_client().chat(
+                label=f"suggestion:{self.data_type}",
+                model=AI_SUGGESTION_MODEL,
+                messages=_ai_suggestion_messages(self.context, self.data_type),
+                max_tokens=AI_SUGGESTION_MAX_TOKENS,
+                temperature=0.2,
+                stream=True
+            )
+            for chunk in stream:
+                if not getattr(chunk, 'choices', None):
+                    continue
+                delta = getattr(chunk.choices[0].delta, 'content', None)
+                if delta:
+                    self.parts.append(delta)
+                    yield delta
+        except Exception as e:
+            self.error = e
+
+    @property
+    def text(self) -> str:
+        return ''.join(self.parts)
+
+
+def show_ai_suggestion(user_id: str, context: str, data_type: str, refresh_key: str, style: str = 'info') -> str:
+    """Render an AI suggestion panel with a refresh button, streaming fresh completions.
+
+    Cached answers (the user's row for today, then the shared suggestion cache) render
+    immediately; an earlier day's text also renders immediately, marked as refreshing,
+    while SuggestionRefresher regenerates it in the background. Otherwise tokens are
+    streamed into the panel and replaced by the formatted summary/recommendations/
+    actions/risks text once complete, which is then cached exactly like
+    get_cached_ai_suggestion does.
+    """
+    force_refresh = st.button("刷新建议", key=refresh_key)
+    render = getattr(st, style)
+    if not AI_STREAMING:
+        ctx = {'__force_refresh': True, 'text': context} if force_refresh else context
+        suggestion = get_cached_ai_suggestion(user_id, ctx, data_type)
+        render(suggestion)
+        if user_id and get_suggestion_refresher().is_refreshing(user_id, data_type):
+            st.caption("🔄 正在后台更新今日建议，稍后刷新页面即可查看")
+        return suggestion
+
+    today = datetime.now().date().isoformat()
+    cache = get_suggestion_cache()
+    key = suggestion_cache_key(context, data_type)
+    if not force_refresh:
+        try:
+            if user_id:
+                text, refreshing = _resolve_cached_suggestion(user_id, context, data_type)
+            else:
+                text, refreshing = cache.get(key), False
+            if text is not None:
+                render(text)
+                if refreshing:
+                    st.caption("🔄 正在后台更新今日建议，稍后刷新页面即可查看")
+                return text
+        except Exception as e:
+            logger.warning('Suggestion cache lookup failed: %s', e)
+
+    placeholder = st.empty()
+    stream = SuggestionStream(context, data_type)
+    with placeholder.container():
+        st.write_stream(stream)
+    if stream.error is not None or not stream.text:
+        message = _fallback_suggestion(user_id, context, data_type, stream.error or '模型未返回内容')
+        getattr(placeholder, style)(message)
+        return message
+
+    suggestion = _format_ai_suggestion(stream.text)
+    getattr(placeholder, style)(suggestion)
+    try:
+        cache.put(key, suggestion, data_type)
+        if user_id:
+            _save_user_suggestion(user_id, data_type, suggestion, today)
+    except Exception as e:
+        logger.warning('Failed to persist streamed suggestion: %s', e)
+    return suggestion
+
+
+# 每日资讯缓存
+# The daily_updates row changes once per day but is read by most pages on every rerun
+# of every session. Cache it process-wide, keyed by calendar date; the TTL bounds how
+# long a replica can serve a row that another replica has replaced.
+DAILY_UPDATES_CACHE_TTL = 300  # seconds
+DAILY_UPDATES_COLUMNS = 'date,finance_news,health_tips,education_info'
+
+
+class DailyUpdatesCache:
+    """Thread-safe, process-wide cache of daily_updates rows keyed by date (YYYY-MM-DD)."""
+
+    def __init__(self, ttl_seconds: float = DAILY_UPDATES_CACHE_TTL):
+        self.ttl_seconds = ttl_seconds
+        self._rows: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def get(self, date_str: str):
+        """Return the cached row for date_str, or None if missing or expired."""
+        with self._lock:
+            entry = self._rows.get(date_str)
+            if entry is None:
+                return None
+            row, stored_at = entry
+            if time_module.monotonic() - stored_at > self.ttl_seconds:
+                del self._rows[date_str]
+                return None
+            return row
+
+    def put(self, date_str: str, row: Dict[str, Any]):
+        with self._lock:
+            self._rows[date_str] = (row, time_module.monotonic())
+
+    def invalidate(self, date_str: str = None):
+        """Drop one date, or every cached date when date_str is None."""
+        with self._lock:
+            if date_str is None:
+                self._rows.clear()
+            else:
+                self._rows.pop(date_str, None)
+
+
+@st.cache_resource
+def get_daily_updates_cache() -> DailyUpdatesCache:
+    """One DailyUpdatesCache per server process, shared by all sessions."""
+    return DailyUpdatesCache(DAILY_UPDATES_CACHE_TTL)
+
+
+def _fetch_daily_updates_row(date_str: str):
+    """Return the daily_updates row for date_str, reading through the process cache.
+
+    Only hits are cached, so a missing row is re-checked on the next call.
+    """
+    cache = get_daily_updates_cache()
+    row = cache.get(date_str)
+    if row is not None:
+        return row
+    row = get_storage().get_daily_updates(date_str, DAILY_UPDATES_COLUMNS)
+    if row:
+        cache.put(date_str, row)
+        return row
+    return None
+
+
+# Per-section deadline (seconds) for the daily update LLM calls; search-enabled calls get longer
+DAILY_UPDATE_TIMEOUTS = {'finance': 45.0, 'health': 20.0, 'education': 45.0}
+
+
+def _daily_update_requests(today: str) -> Dict[str, Dict[str, Any]]:
+    """chat.completions.create kwargs for each daily update section."""
+    search = {"enable_search": True, "search_options": {"forced_search": True}}
+
+    # 获取金融新闻
+    finance_system_prompt = "你是一个资深的财经，政治，金融新闻获情报分析专家，擅长梳理选择对金融市场影响较大的宏观重磅新闻事件，例如美联储加息，地缘政治冲突等。"
+    finance_prompt = "今天是{today}，请调用搜索工具搜索今天的3个宏观的政治，金融新闻，请使用搜索进行获取，不要进行编造，每条不超过50字。".format(today=today)
+    # 获取健康知识
+    health_prompt = "请提供一条实用的健康小贴士，不超过100字。"
+    # 获取教育资讯
+    edu_prompt = "今天是{today}，请提供一条关于教育相关的最新资讯或建议，不超过100字。".format(today=today)
+
+    return {
+        'finance': dict(
+            model="qwen3-max-2025-09-23",
+            messages=[{"role": "system", "content": finance_system_prompt},
+                      {"role": "user", "content": finance_prompt}],
+            max_tokens=400,
+            extra_body=search
+        ),
+        'health': dict(
+            model="qwen3-max-2025-09-23",
+            messages=[{"role": "user", "content": health_prompt}],
+            max_tokens=200,
+            temperature=1.9
+        ),
+        'education': dict(
+            model="qwen3-max-2025-09-23",
+            messages=[{"role": "user", "content": edu_prompt}],
+            max_tokens=250,
+            extra_body=search
+        ),
+    }
+
+
+def _fetch_daily_update_sections(today: str) -> Dict[str, str]:
+    """Run the daily update LLM calls concurrently and collect whatever finishes in time.
+
+    Each section has its own deadline (DAILY_UPDATE_TIMEOUTS) measured from submission;
+    a section that errors or misses its deadline comes back as an empty string so the
+    other sections are still stored.
+    """
+    requests = _daily_update_requests(today)
+    updates = {key: '' for key in requests}
+    pool = ThreadPoolExecutor(max_workers=len(requests), thread_name_prefix='daily_updates')
+    try:
+        started = time_module.monotonic()
+        futures = {
+            key: pool.submit(get_llm_client().chat, deadline=DAILY_UPDATE_TIMEOUTS[key],
+                             label=f"daily_updates:{key}", **kwargs)
+            for key, kwargs in requests.items()
+        }
+        for key, future in futures.items():
+            remaining = DAILY_UPDATE_TIMEOUTS[key] - (time_module.monotonic() - started)
+            try:
+                updates[key] = _completion_text(future.result(timeout=max(0.0, remaining)))
+            except FuturesTimeoutError:
+                logger.warning("Daily update '%s' timed out after %ss", key, DAILY_UPDATE_TIMEOUTS[key])
+            except Exception as e:
+                logger.warning("Daily update '%s' failed: %s", key, e)
+    finally:
+        # don't block on stragglers; their results are discarded
+        pool.shutdown(wait=False, cancel_futures=True)
+    return updates
+
+
+# --- Single-flight coordination for expensive shared work ---
+# Identifies this replica/process as a lease holder
+INSTANCE_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+# Cross-replica leases live in a small table:
+#   create table app_leases (
+#       name text primary key,
+#       holder text not null,
+#       expires_at timestamptz not null
+#   );
+# daily_updates also needs a unique date so a lost race cannot create a second row:
+#   create unique index if not exists daily_updates_date_key on daily_updates(date);
+# Scheduled job history (one row per attempt, see record_run_start/record_run_end):
+#   create table job_runs (
+#       id bigserial primary key,
+#       job_name text not null,
+#       holder text not null,
+#       run_date date not null,
+#       started_at timestamptz not null,
+#       finished_at timestamptz,
+#       duration_ms integer,
+#       outcome text not null,   -- running | success | failed
+#       error text
+#   );
+#   create index if not exists job_runs_job_date on job_runs(job_name, run_date);
+# Resumable progress for long batch jobs (one row per job and day):
+#   create table job_checkpoints (
+#       job_name text not null,
+#       run_date date not null,
+#       state jsonb not null,
+#       updated_at timestamptz not null,
+#       primary key (job_name, run_date)
+#   );
+LEASE_TABLE = 'app_leases'
+JOB_RUNS_TABLE = 'job_runs'
+JOB_CHECKPOINTS_TABLE = 'job_checkpoints'
+DAILY_UPDATES_LEASE_TTL = 120  # seconds; longer than the slowest section deadline
+DAILY_UPDATES_FOLLOWER_WAIT = 60  # seconds another replica's generation is awaited (off the page thread)
+
+
+class _InFlightCall:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Collapse concurrent calls for the same key into one execution within this process.
+
+    The first caller runs fn; callers arriving while it is in flight block and receive
+    the same result (or exception). The key is released as soon as the call finishes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _InFlightCall] = {}
+
+    def do(self, key: str, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _InFlightCall()
+                self._calls[key] = call
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+
+@st.cache_resource
+def get_single_flight() -> SingleFlight:
+    """Process-wide SingleFlight shared by all sessions."""
+    return SingleFlight()
+
+
+def _utc_now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class SupabaseJobStateStore:
+    """Leases and job run history kept in Supabase (app_leases / job_runs tables)."""
+
+    def try_acquire_lease(self, name: str, holder: str, ttl_seconds: float) -> bool:
+        """Take, take over (expired) or renew the named lease; True if holder now owns it.
+
+        Insert wins when no row exists; otherwise a conditional update takes over an
+        expired lease or renews one this holder already owns. Raises when the lease
+        table is unreachable (e.g. the migration was never applied); callers decide
+        whether to fail open or closed.
+        """
+        now = _utc_now()
+        lease = {'name': name, 'holder': holder,
+                 'expires_at': (now + timedelta(seconds=ttl_seconds)).isoformat()}
+        try:
+            get_supabase().table(LEASE_TABLE).insert(lease).execute()
+            return True
+        except Exception:
+            pass  # row exists (or table missing): fall through to conditional update
+        taken = get_supabase().table(LEASE_TABLE).update(lease).eq('name', name).lt('expires_at', now.isoformat()).execute()
+        if taken.data:
+            return True
+        renewed = get_supabase().table(LEASE_TABLE).update(lease).eq('name', name).eq('holder', holder).execute()
+        return bool(renewed.data)
+
+    def release_lease(self, name: str, holder: str):
+        get_supabase().table(LEASE_TABLE).delete().eq('name', name).eq('holder', holder).execute()
+
+    def has_succeeded(self, job_name: str, run_date: str) -> bool:
+        res = get_supabase().table(JOB_RUNS_TABLE).select('id').eq('job_name', job_name) \
+            .eq('run_date', run_date).eq('outcome', 'success').limit(1).execute()
+        return bool(res.data)
+
+    def record_run_start(self, job_name: str, holder: str, run_date: str):
+        res = get_supabase().table(JOB_RUNS_TABLE).insert({
+            'job_name': job_name,
+            'holder': holder,
+            'run_date': run_date,
+            'started_at': _utc_now().isoformat(),
+            'outcome': 'running'
+        }).execute()
+        return res.data[0].get('id') if res.data else None
+
+    def record_run_end(self, run_id, outcome: str, duration_ms: float, error: str = None):
+        if run_id is None:
+            return
+        get_supabase().table(JOB_RUNS_TABLE).update({
+            'finished_at': _utc_now().isoformat(),
+            'duration_ms': int(duration_ms),
+            'outcome': outcome,
+            'error': error
+        }).eq('id', run_id).execute()
+
+    def recent_runs(self, limit: int = 20) -> List[Dict[str, Any]]:
+        res = get_supabase().table(JOB_RUNS_TABLE).select('*').order('started_at', desc=True).limit(limit).execute()
+        return res.data or []
+
+    def load_checkpoint(self, job_name: str, run_date: str) -> Dict[str, Any]:
+        res = get_supabase().table(JOB_CHECKPOINTS_TABLE).select('state').eq('job_name', job_name) \
+            .eq('run_date', run_date).limit(1).execute()
+        return (res.data[0].get('state') or {}) if res.data else {}
+
+    def save_checkpoint(self, job_name: str, run_date: str, state: Dict[str, Any]):
+        get_supabase().table(JOB_CHECKPOINTS_TABLE).upsert({
+            'job_name': job_name,
+            'run_date': run_date,
+            'state': state,
+            'updated_at': _utc_now().isoformat()
+        }, on_conflict='job_name,run_date').execute()
+
+
+class SqliteJobStateStore:
+    """Local SQLite stand-in for SupabaseJobStateStore.
+
+    Replicas on one host share leases by pointing at the same file; each operation
+    opens its own connection so the store is safe to use from any thread.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS app_leases ("
+                " name TEXT PRIMARY KEY, holder TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS job_runs ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT, job_name TEXT NOT NULL, holder TEXT NOT NULL,"
+                " run_date TEXT NOT NULL, started_at TEXT NOT NULL, finished_at TEXT,"
+                " duration_ms INTEGER, outcome TEXT NOT NULL, error TEXT)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS job_runs_job_date ON job_runs(job_name, run_date)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS job_checkpoints ("
+                " job_name TEXT NOT NULL, run_date TEXT NOT NULL, state TEXT NOT NULL, updated_at TEXT NOT NULL,"
+                " PRIMARY KEY (job_name, run_date))"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=5, isolation_level=None)
+
+    def try_acquire_lease(self, name: str, holder: str, ttl_seconds: float) -> bool:
+        now = time_module.time()
+        with closing(self._connect()) as conn:
+            # IMMEDIATE takes the write lock up front so check-and-set is atomic across processes
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT holder, expires_at FROM app_leases WHERE name = ?", (name,)).fetchone()
+            if row is not None and row[0] != holder and row[1] > now:
+                conn.execute("ROLLBACK")
+                return False
+            conn.execute(
+                "INSERT INTO app_leases (name, holder, expires_at) VALUES (?, ?, ?)"
+                " ON CONFLICT(name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at",
+                (name, holder, now + ttl_seconds)
+            )
+            conn.execute("COMMIT")
+            return True
+
+    def release_lease(self, name: str, holder: str):
+        with closing(self._connect()) as conn:
+            conn.execute("DELETE FROM app_leases WHERE name = ? AND holder = ?", (name, holder))
+
+    def has_succeeded(self, job_name: str, run_date: str) -> bool:
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT 1 FROM job_runs WHERE job_name = ? AND run_date = ? AND outcome = 'success' LIMIT 1",
+                (job_name, run_date)
+            ).fetchone()
+        return row is not None
+
+    def record_run_start(self, job_name: str, holder: str, run_date: str):
+        with closing(self._connect()) as conn:
+            cur = conn.execute(
+                "INSERT INTO job_runs (job_name, holder, run_date, started_at, outcome) VALUES (?, ?, ?, ?, 'running')",
+                (job_name, holder, run_date, _utc_now().isoformat())
+            )
+            return cur.lastrowid
+
+    def record_run_end(self, run_id, outcome: str, duration_ms: float, error: str = None):
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "UPDATE job_runs SET finished_at = ?, duration_ms = ?, outcome = ?, error = ? WHERE id = ?",
+                (_utc_now().isoformat(), int(duration_ms), outcome, error, run_id)
+            )
+
+    def recent_runs(self, limit: int = 20) -> List[Dict[str, Any]]:
+        with closing(self._connect()) as conn:
+            conn.row_factory = sqlite3.Row
+            rows = conn.execute("SELECT * FROM job_runs ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+        return [dict(r) for r in rows]
+
+    def load_checkpoint(self, job_name: str, run_date: str) -> Dict[str, Any]:
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT state FROM job_checkpoints WHERE job_name = ? AND run_date = ?",
+                               (job_name, run_date)).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def save_checkpoint(self, job_name: str, run_date: str, state: Dict[str, Any]):
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "INSERT INTO job_checkpoints (job_name, run_date, state, updated_at) VALUES (?, ?, ?, ?)"
+                " ON CONFLICT(job_name, run_date) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at",
+                (job_name, run_date, json.dumps(state, ensure_ascii=False), _utc_now().isoformat())
+            )
+
+
+@st.cache_resource
+def get_job_state_store():
+    """Lease/job-history store: SQLite when JOB_STATE_DB is configured, Supabase otherwise.
+
+    With the SQLite storage backend, job state defaults to the same local file.
+    """
+    path = st.secrets.get("JOB_STATE_DB")
+    if not path and st.secrets.get("STORAGE_BACKEND", "supabase") == "sqlite":
+        path = st.secrets.get("STORAGE_DB", SQLITE_STORAGE_DEFAULT_PATH)
+    if path:
+        return SqliteJobStateStore(path)
+    return SupabaseJobStateStore()
+
+
+def try_acquire_lease(name: str, ttl_seconds: float, holder: str = INSTANCE_ID, fail_open: bool = False) -> bool:
+    """Try to take (or renew) the named lease for ttl_seconds; True if holder now owns it.
+
+    When the lease store is unavailable the result is `fail_open`: False by default, so
+    work that must run on exactly one replica is skipped rather than duplicated.
+    """
+    try:
+        return get_job_state_store().try_acquire_lease(name, holder, ttl_seconds)
+    except Exception as e:
+        logger.warning("Lease store unavailable for '%s', %s lease: %s",
+                       name, 'proceeding without' if fail_open else 'not taking', e)
+        return fail_open
+
+
+def release_lease(name: str, holder: str = INSTANCE_ID):
+    """Release the named lease if holder still owns it."""
+    try:
+        get_job_state_store().release_lease(name, holder)
+    except Exception as e:
+        logger.warning("Failed to release lease '%s': %s", name, e)
+
+
+def _daily_updates_from_row(row: Dict[str, Any]) -> Dict[str, str]:
+    return {
+        'finance': row.get('finance_news', ''),
+        'health': row.get('health_tips', ''),
+        'education': row.get('education_info', '')
+    }
+
+
+def _wait_for_daily_updates_row(date_str: str, timeout: float):
+    """Poll for the row another replica is generating; None if it does not appear in time."""
+    deadline = time_module.monotonic() + timeout
+    while time_module.monotonic() < deadline:
+        time_module.sleep(2)
+        row = _fetch_daily_updates_row(date_str)
+        if row:
+            return row
+    return None
+
+
+def _generate_daily_updates(today: str):
+    """Generate and store today's updates; runs at most once per date across replicas."""
+    # a caller that finished just before we acquired the single-flight slot may have stored it
+    row = _fetch_daily_updates_row(today)
+    if row:
+        return _daily_updates_from_row(row)
+
+    lease_name = f"daily_updates:{today}"
+    # fail open: without the lease table, duplicate generation beats having no updates today
+    if not try_acquire_lease(lease_name, DAILY_UPDATES_LEASE_TTL, fail_open=True):
+        # another replica holds the lease; wait for its row instead of generating again
+        row = _wait_for_daily_updates_row(today, DAILY_UPDATES_FOLLOWER_WAIT)
+        return _daily_updates_from_row(row) if row else None
+
+    try:
+        # 三个请求并发发出；单个超时或失败只影响对应栏目
+        updates = _fetch_daily_update_sections(today)
+        if not any(updates.values()):
+            raise RuntimeError("所有资讯栏目均获取失败")
+
+        # 保存到数据库（仅当无今日记录；唯一日期约束兜底并发写入）
+        get_storage().insert_daily_updates({
+            'date': today,
+            'finance_news': updates['finance'],
+            'health_tips': updates['health'],
+            'education_info': updates['education'],
+            'created_at': datetime.now().isoformat()
+        })
+        # readers must pick up the freshly inserted row rather than a cached state
+        get_daily_updates_cache().invalidate(today)
+
+        return updates
+    finally:
+        release_lease(lease_name)
+
+
 def get_daily_updates():
     """获取每日更新的资讯"""
     try:
         today = datetime.now().date().isoformat()
         # If today's updates already exist, return them
-        existing = supabase.table('daily_updates').select('*').eq('date', today).execute()
-        if existing.data:
-            row = existing.data[0]
-            return {
-                'finance': row.get('finance_news', ''),
-                'health': row.get('health_tips', ''),
-                'education': row.get('education_info', '')
-            }
+        row = _fetch_daily_updates_row(today)
+        if row:
+            return _daily_updates_from_row(row)
 
-        updates = {}
-        
-        # 获取金融新闻
-        finance_system_prompt = "你是一个资深的财经，政治，金融新闻获情报分析专家，擅长梳理选择对金融市场影响较大的宏观重磅新闻事件，例如美联储加息，地缘政治冲突等。"
-        finance_prompt = "今天是{today}，请调用搜索工具搜索今天的3个宏观的政治，金融新闻，请使用搜索进行获取，不要进行编造，每条不超过50字。".format(today=today)
-        finance_response = openai_client.chat.completions.create(
-            model="qwen3-max-2025-09-23",
-            messages=[{"role": "system", "content": finance_system_prompt},
-                {"role": "user", "content": finance_prompt}],
-            max_tokens=400,
-                extra_body={"enable_search": True,
-                    "search_options": {"forced_search": True}
-                }
-        )
-        if getattr(finance_response, 'choices', None):
-            c = finance_response.choices[0]
-            if hasattr(c, 'message') and hasattr(c.message, 'content'):
-                updates['finance'] = str(c.message.content or "")
-            else:
-                updates['finance'] = str(c)
-        else:
-            updates['finance'] = str(finance_response)
+        # concurrent sessions in this process share one generation for the date
+        return get_single_flight().do(f"daily_updates:{today}", lambda: _generate_daily_updates(today))
+    except Exception as e:
+        st.error(f"获取每日更新失败：{str(e)}")
+        return None
+
+
+class DailyUpdatesRefresher:
+    """Background generation of a date's daily_updates row, deduplicated per date.
+
+    Pages never wait for the model (or for another replica's lease holder): they render
+    without the row and pick it up on a later rerun once it is stored.
+    """
+
+    def __init__(self):
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='daily-updates')
+        self._inflight = set()
+        self._lock = threading.Lock()
+
+    def submit(self, date_str: str) -> bool:
+        """Schedule generation unless it is already running; True if newly scheduled."""
+        with self._lock:
+            if date_str in self._inflight:
+                return False
+            self._inflight.add(date_str)
+        self._pool.submit(self._generate, date_str)
+        return True
+
+    def _generate(self, date_str: str):
+        try:
+            # shares one generation with the scheduled job through the process single-flight
+            updates = get_single_flight().do(f"daily_updates:{date_str}",
+                                             lambda: _generate_daily_updates(date_str))
+            if updates is None:
+                logger.warning('Daily updates for %s are not available yet', date_str)
+        except Exception as e:
+            logger.warning('Background daily updates generation for %s failed: %s', date_str, e)
+        finally:
+            with self._lock:
+                self._inflight.discard(date_str)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+@st.cache_resource
+def get_daily_updates_refresher() -> DailyUpdatesRefresher:
+    """Process-wide DailyUpdatesRefresher shared by all sessions."""
+    refresher = DailyUpdatesRefresher()
+    atexit.register(refresher.shutdown)
+    return refresher
+
+# 数据管理
+# upsert_user_data_row relies on one row per user and a database default for created_at:
+#   alter table user_data add constraint user_data_user_id_key unique (user_id);
+#   alter table user_data alter column created_at set default now();
+def upsert_user_data_row(user_id: str, fields: Dict[str, Any]) -> Dict[str, Any]:
+    """Insert or update the user's user_data row in a single round trip.
+
+    `fields` are DB column names. The upsert conflicts on user_id, so two concurrent
+    saves can no longer create duplicate rows. Returns the stored row (DB column
+    names) and refreshes this rerun's snapshot from it; raises on failure.
+    """
+    row = _upsert_user_data(user_id, fields)
+    if row:
+        _remember_user_data_row(user_id, row)
+    else:
+        invalidate_user_data_snapshot(user_id)
+    return row
+
+
+def _upsert_user_data(user_id: str, fields: Dict[str, Any]):
+    """The bare upsert round trip; safe to call from background threads."""
+    payload = dict(fields)
+    payload['user_id'] = user_id
+    payload['updated_at'] = datetime.now().isoformat()
+    rows = get_storage().upsert_user_data([payload])
+    return rows[0] if rows else None
+
+
+# 写入缓冲（write-behind）
+# Optional: with WRITE_BEHIND enabled, save_user_data queues changed columns per user,
+# merges bursts of saves by column and lets a background worker write them after a
+# short debounce. Queued writes are also flushed on page change, logout, session end
+# (when the session is garbage collected) and process exit; failed writes stay queued
+# and are retried with backoff.
+WRITE_BEHIND = bool(st.secrets.get("WRITE_BEHIND", False))
+WRITE_BEHIND_DEBOUNCE = 2.0  # seconds of quiet before a user's queued columns are written
+WRITE_BEHIND_MAX_BACKOFF = 60.0  # seconds; cap for retry delay after failed writes
+
+
+class WriteBehindQueue:
+    """Per-user coalescing queue of pending user_data column writes with a flush worker."""
+
+    def __init__(self, writer, debounce_seconds: float = WRITE_BEHIND_DEBOUNCE,
+                 max_backoff: float = WRITE_BEHIND_MAX_BACKOFF):
+        self._writer = writer  # writer(user_id, fields) performs one upsert
+        self.debounce_seconds = debounce_seconds
+        self.max_backoff = max_backoff
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._due: Dict[str, float] = {}
+        self._failures: Dict[str, int] = {}
+        self._inflight = set()
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+        self._thread.start()
+
+    def enqueue(self, user_id: str, fields: Dict[str, Any]):
+        """Merge fields into the user's pending write and (re)start its debounce timer."""
+        with self._cond:
+            self._pending.setdefault(user_id, {}).update(fields)
+            if not self._failures.get(user_id):
+                self._due[user_id] = time_module.monotonic() + self.debounce_seconds
+            self._cond.notify()
+
+    def pending(self, user_id: str) -> Dict[str, Any]:
+        """Columns queued (or being written) for user_id, for read-your-writes overlays."""
+        with self._cond:
+            return dict(self._pending.get(user_id, {}))
+
+    def request_flush(self, user_id: str):
+        """Ask the worker to write user_id's pending columns now (non-blocking)."""
+        with self._cond:
+            if user_id in self._pending:
+                self._due[user_id] = time_module.monotonic()
+                self._cond.notify()
+
+    def flush(self, user_id: str = None) -> bool:
+        """Write pending columns now (one user, or everyone); True if nothing is left queued."""
+        with self._cond:
+            users = [user_id] if user_id is not None else list(self._pending)
+        ok = True
+        for uid in users:
+            ok = self._flush_user(uid) and ok
+        return ok
 
-        # 获取健康知识
-        health_prompt = "请提供一条实用的健康小贴士，不超过100字。"
-        health_response = openai_client.chat.completions.create(
-            model="qwen3-max-2025-09-23",
-            messages=[{"role": "user", "content": health_prompt}],
-            max_tokens=200,
-            temperature = 1.9,
-        )
-        if getattr(health_response, 'choices', None):
-            c = health_response.choices[0]
-            if hasattr(c, 'message') and hasattr(c.message, 'content'):
-                updates['health'] = str(c.message.content or "")
-            else:
-                updates['health'] = str(c)
-        else:
-            updates['health'] = str(health_response)
+    def shutdown(self):
+        """Stop the worker and make a final attempt to write everything still queued."""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self._thread.join(5)
+        self.flush()
 
-        # 获取教育资讯
-        edu_prompt = "今天是{today}，请提供一条关于教育相关的最新资讯或建议，不超过100字。".format(today=today)
-        edu_response = openai_client.chat.completions.create(
-            model="qwen3-max-2025-09-23",
-            messages=[{"role": "user", "content": edu_prompt}],
-            max_tokens=250,
-                extra_body={"enable_search": True,
-                    "search_options": {"forced_search": True}
-                }
-        )
-        if getattr(edu_response, 'choices', None):
-            c = edu_response.choices[0]
-            if hasattr(c, 'message') and hasattr(c.message, 'content'):
-                updates['education'] = str(c.message.content or "")
+    def _flush_user(self, user_id: str) -> bool:
+        with self._cond:
+            # keep writes for one user ordered: wait for an in-flight write to land first
+            while user_id in self._inflight:
+                self._cond.wait()
+            fields = dict(self._pending.get(user_id) or {})
+            if not fields:
+                return True
+            self._inflight.add(user_id)
+            self._due.pop(user_id, None)
+        try:
+            self._writer(user_id, fields)
+            error = None
+        except Exception as e:
+            error = e
+        with self._cond:
+            self._inflight.discard(user_id)
+            current = self._pending.get(user_id, {})
+            if error is None:
+                # drop exactly what was written; columns re-queued meanwhile stay pending
+                for k, v in fields.items():
+                    if k in current and current[k] is v:
+                        del current[k]
+                if not current:
+                    self._pending.pop(user_id, None)
+                self._failures.pop(user_id, None)
             else:
-                updates['education'] = str(c)
-        else:
-            updates['education'] = str(edu_response)
+                attempts = self._failures.get(user_id, 0) + 1
+                self._failures[user_id] = attempts
+                delay = min(self.max_backoff, self.debounce_seconds * (2 ** attempts))
+                self._due[user_id] = time_module.monotonic() + delay
+                logger.warning('Write-behind flush for %s failed (attempt %s), retrying in %.0fs: %s',
+                               user_id, attempts, delay, error)
+            if user_id in self._pending and user_id not in self._due:
+                self._due[user_id] = time_module.monotonic() + self.debounce_seconds
+            self._cond.notify_all()
+        return error is None and user_id not in self._pending
 
-        # 保存到数据库（仅当无今日记录）
-        supabase.table('daily_updates').insert({
-            'date': today,
-            'finance_news': updates['finance'],
-            'health_tips': updates['health'],
-            'education_info': updates['education'],
-            'created_at': datetime.now().isoformat()
-        }).execute()
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._stopped:
+                    return
+                now = time_module.monotonic()
+                ready = [uid for uid, due in self._due.items() if due <= now and uid not in self._inflight]
+                if not ready:
+                    next_due = min(self._due.values(), default=None)
+                    self._cond.wait(None if next_due is None else max(0.05, next_due - now))
+                    continue
+            for uid in ready:
+                self._flush_user(uid)
+
+
+@st.cache_resource
+def get_write_behind_queue() -> WriteBehindQueue:
+    """Process-wide write-behind queue, flushed on interpreter exit."""
+    queue = WriteBehindQueue(_upsert_user_data)
+    atexit.register(queue.shutdown)
+    return queue
+
+
+class _WriteBehindSessionGuard:
+    """Stored in session_state; when Streamlit drops the session, its finalizer flushes the user."""
+
+
+def track_write_behind_session(user_id: str):
+    """Arrange for user_id's queued writes to be flushed when this browser session ends."""
+    if not WRITE_BEHIND or not user_id or st.session_state.get('_write_behind_guard_user') == user_id:
+        return
+    guard = _WriteBehindSessionGuard()
+    weakref.finalize(guard, get_write_behind_queue().request_flush, user_id)
+    st.session_state['_write_behind_guard'] = guard
+    st.session_state['_write_behind_guard_user'] = user_id
+
+
+def flush_pending_writes(user_id: str) -> bool:
+    """Synchronously write user_id's queued columns (no-op unless WRITE_BEHIND)."""
+    if not WRITE_BEHIND or not user_id:
+        return True
+    return get_write_behind_queue().flush(user_id)
 
-        return updates
-    except Exception as e:
-        st.error(f"获取每日更新失败：{str(e)}")
-        return None
 
-# 数据管理
 def save_user_data(user_id: str, data: Dict[str, Any]):
     """保存用户数据"""
     try:
         # --- Pre-save normalization & validation ---
-        # Coerce numeric fields where applicable
-        if 'total_assets' in data:
-            try:
-                data['total_assets'] = float(data.get('total_assets') or 0.0)
-            except Exception:
-                data['total_assets'] = 0.0
-
-        # Normalize/validate asset percentages if any present
+        # Per-field coercion happens in encode_user_data; the percentages are normalized
+        # together here because they must sum to 100.
         pct_keys = ['stock_percentage', 'bond_percentage', 'property_percentage', 'cash_percentage']
         present_pcts = [k for k in pct_keys if k in data]
         if present_pcts:
             # Coerce to ints and ensure non-negative
             pcts = []
             for k in pct_keys:
-                v = data.get(k, None)
-                try:
-                    v_int = int(v) if v is not None else 0
-                except Exception:
-                    v_int = 0
-                if v_int < 0:
-                    v_int = 0
+                v_int = _encode_percentage(data.get(k, None))
                 data[k] = v_int
                 pcts.append(v_int)
 
@@ -585,131 +2352,511 @@ def save_user_data(user_id: str, data: Dict[str, Any]):
                 for i, k in enumerate(pct_keys):
                     data[k] = int(normalized[i])
 
-        # Ensure priorities list is a clean list
-        if 'priorities' in data:
-            pr = data.get('priorities')
-            if isinstance(pr, (list, tuple)):
-                data['priorities'] = [str(x) for x in pr]
-            else:
-                data['priorities'] = []
+        # 仅发送相对上次加载有变化的字段；表单未改动则跳过写入
+        changed = diff_user_data_fields(user_id, encode_user_data(data))
+        if not changed:
+            return True
 
-        # Ensure boolean fields are boolean
-        for bool_k in ['smoke', 'daily_news', 'investment_alert', 'health_reminder', 'education_update']:
-            if bool_k in data:
-                data[bool_k] = bool(data[bool_k])
+        if WRITE_BEHIND:
+            # 写入缓冲：合并入队，由后台线程批量写入；本次 rerun 的快照立即反映新值
+            get_write_behind_queue().enqueue(user_id, changed)
+            baseline = dict(_user_data_baselines.get(user_id) or {})
+            baseline.update(changed)
+            _remember_user_data_row(user_id, baseline, _with_loaded_columns(user_id, changed))
+            return True
 
-        # 检查是否已有数据
-        existing = supabase.table('user_data').select("*").eq('user_id', user_id).execute()
-        
-        # Map app keys to DB column names and filter by supported columns
-        mapped = _map_app_to_db(data)
-        filtered = {k: v for k, v in mapped.items() if k in SUPPORTED_USER_DATA_COLUMNS or k in ('user_id', 'created_at', 'updated_at')}
-        filtered['user_id'] = user_id
-        filtered['updated_at'] = datetime.now().isoformat()
-
-        if existing.data:
-            # 更新现有数据
-            result = supabase.table('user_data').update(filtered).eq('user_id', user_id).execute()
-        else:
-            # 插入新数据
-            filtered['created_at'] = datetime.now().isoformat()
-            result = supabase.table('user_data').insert(filtered).execute()
-        
+        # 单次往返写入（插入或更新），返回的行同时刷新本次 rerun 的快照
+        upsert_user_data_row(user_id, changed)
         return True
     except Exception as e:
         st.error(f"保存数据失败：{str(e)}")
         return False
 
-def load_user_data(user_id: str) -> Dict[str, Any]:
-    """加载用户数据"""
+# Request-scoped user_data snapshots.
+# Every rerun executes all page functions plus init_session_from_db; they share one
+# load per user instead of each issuing its own select. The dict is reset at the start
+# of every rerun (begin_rerun_scope) and invalidated explicitly by save_user_data.
+_user_data_snapshots: Dict[str, UserRecord] = {}
+# Raw DB rows (DB column names, unsanitized) behind the snapshots; save_user_data diffs
+# against these so only changed columns are written. {} means "no row exists yet".
+_user_data_baselines: Dict[str, Dict[str, Any]] = {}
+# DB columns already fetched into each snapshot this rerun (None: all of them)
+_user_data_loaded_columns: Dict[str, Any] = {}
+# This rerun's user_data read cost, reported with the rerun timing
+_rerun_io = {'queries': 0, 'bytes': 0, 'decode_ms': 0.0}
+
+
+def begin_rerun_scope():
+    """Reset request-scoped caches; called once at the top of every script run."""
+    _user_data_snapshots.clear()
+    _user_data_baselines.clear()
+    _user_data_loaded_columns.clear()
+    _rerun_io.update(queries=0, bytes=0, decode_ms=0.0)
+
+
+def invalidate_user_data_snapshot(user_id: str):
+    """Drop the snapshot for user_id so the next load_user_data hits the database."""
+    _user_data_snapshots.pop(user_id, None)
+    _user_data_baselines.pop(user_id, None)
+    _user_data_loaded_columns.pop(user_id, None)
+
+
+def _remember_user_data_row(user_id: str, row: Dict[str, Any], columns: Any = None):
+    """Record a read or written DB row as this rerun's snapshot and diff baseline.
+
+    `columns` are the DB columns the row is known to contain; None means the row is
+    complete (a select *, an upsert's returned row, or no row at all).
+    """
+    _user_data_baselines[user_id] = dict(row)
+    _user_data_loaded_columns[user_id] = None if columns is None or not row else frozenset(columns)
+    started = time_module.perf_counter()
+    _user_data_snapshots[user_id] = decode_user_row(row)
+    _rerun_io['decode_ms'] += (time_module.perf_counter() - started) * 1000
+
+
+def _with_loaded_columns(user_id: str, fields: Dict[str, Any]) -> Any:
+    """Loaded column set after `fields` were written into the user's baseline."""
+    loaded = _user_data_loaded_columns.get(user_id, frozenset())
+    return None if loaded is None else loaded | set(fields)
+
+
+def _same_db_value(old: Any, new: Any) -> bool:
+    """Compare a stored column value with a submitted one, tolerating int/float/str drift."""
+    if old == new:
+        return True
+    if old is None or new is None or isinstance(old, bool) or isinstance(new, bool):
+        return False
+    if isinstance(old, (int, float)) and isinstance(new, (int, float)):
+        return abs(float(old) - float(new)) < 1e-9
+    # PostgREST returns numeric/date columns as strings in some setups
+    return str(old) == str(new)
+
+
+def diff_user_data_fields(user_id: str, fields: Dict[str, Any]) -> Dict[str, Any]:
+    """Return the subset of `fields` (DB column names) that differ from the last loaded row.
+
+    Without a baseline for this rerun (nothing loaded, or the load failed) every field
+    is treated as changed.
+    """
+    baseline = _user_data_baselines.get(user_id)
+    if baseline is None:
+        return dict(fields)
+    return {k: v for k, v in fields.items() if k not in baseline or not _same_db_value(baseline[k], v)}
+
+
+def _fetch_user_data(user_id: str, columns: Any = None) -> UserRecord:
+    """Query the given user_data columns (None: all) and merge them into the snapshot."""
     try:
-        result = supabase.table('user_data').select("*").eq('user_id', user_id).execute()
-        if result.data:
-            # map DB columns back to app keys
-            row = _map_db_row_to_app(result.data[0])
-            return sanitize_user_data(row)
-        return {}
+        fetched = get_storage().get_user_data(user_id, columns)
+        _rerun_io['queries'] += 1
+        _rerun_io['bytes'] += len(json.dumps([fetched] if fetched else [], ensure_ascii=False, default=str).encode('utf-8'))
+        if fetched:
+            row = {**_user_data_baselines.get(user_id, {}), **fetched}
+            loaded = _user_data_loaded_columns.get(user_id, frozenset())
+            loaded = None if columns is None or loaded is None else loaded | columns
+        else:
+            row, loaded = {}, None
+        if WRITE_BEHIND:
+            # read-your-writes: overlay columns still waiting in the write-behind queue
+            pending = get_write_behind_queue().pending(user_id)
+            if pending:
+                row = {**row, **pending}
+                loaded = None if loaded is None else loaded | set(pending)
+        # decode into app keys (and keep the raw row as the diff baseline)
+        _remember_user_data_row(user_id, row, loaded)
+        return _user_data_snapshots[user_id]
     except:
-        return {}
+        return _user_data_snapshots.get(user_id, UserRecord())
 
 
-def sanitize_user_data(data: Dict[str, Any]) -> Dict[str, Any]:
-    """Normalize user_data dict, coercing None to safe defaults for keys used across pages."""
-    if not data:
-        return {}
+def _needs_legacy_children(user_id: str) -> bool:
+    baseline = _user_data_baselines.get(user_id) or {}
+    loaded = _user_data_loaded_columns.get(user_id)
+    return (loaded is not None and 'child_0_age' not in loaded and raw_children(baseline.get('children')) is None
+            and bool(baseline.get('num_children')))
+
+
+def load_user_data(user_id: str, projection: Any = None) -> UserRecord:
+    """加载用户数据（按页面投影只查询本次 rerun 尚未加载的列，各页面共享同一快照）
+
+    `projection` is a USER_DATA_PROJECTIONS name or a list of app keys; None loads
+    every column.
+    """
+    if not user_id:
+        return UserRecord()
+    columns = projection_columns(projection)
+    if user_id in _user_data_snapshots:
+        loaded = _user_data_loaded_columns.get(user_id)
+        if loaded is None:
+            return _user_data_snapshots[user_id]
+        if columns is not None:
+            missing = columns - loaded
+            if not missing:
+                return _user_data_snapshots[user_id]
+            columns = missing | {'user_id'}
+    snapshot = _fetch_user_data(user_id, columns)
+    if columns is not None and 'children' in columns and _needs_legacy_children(user_id):
+        # row not migrated to the children JSON column yet: one extra query for the flat columns
+        snapshot = _fetch_user_data(user_id, projection_columns(LEGACY_CHILD_FIELDS))
+    if user_id not in _user_data_snapshots:
+        # failed load: don't retry within this rerun
+        _user_data_snapshots[user_id] = snapshot
+        _user_data_loaded_columns[user_id] = None
+    # records are read-only, so every page can share the snapshot without copying
+    return snapshot
 
-    normalized = dict(data)  # shallow copy
-
-    # Numeric defaults
-    normalized['total_assets'] = float(normalized.get('total_assets') or 0.0)
-    normalized['stock_percentage'] = int(normalized.get('stock_percentage') or 0)
-    normalized['bond_percentage'] = int(normalized.get('bond_percentage') or 0)
-    normalized['property_percentage'] = int(normalized.get('property_percentage') or 0)
-    normalized['cash_percentage'] = int(normalized.get('cash_percentage') or 0)
-    normalized['health_score'] = int(normalized.get('health_score') or 0)
-    normalized['education_progress'] = int(normalized.get('education_progress') or 0)
-    normalized['life_score'] = int(normalized.get('life_score') or 0)
-
-    # Simple string/list defaults
-    normalized['risk_level'] = normalized.get('risk_level') or '平衡'
-    normalized['exercise_freq'] = normalized.get('exercise_freq') or '每周3-4次'
-    normalized['drink'] = normalized.get('drink') or '偶尔'
-    normalized['health_goals'] = normalized.get('health_goals') or ''
-    normalized['education_plan'] = normalized.get('education_plan') or ''
-
-    # Children-related defaults: ensure num_children is int and child fields are present
-    normalized['num_children'] = int(normalized.get('num_children') or 0)
-    for i in range(normalized['num_children']):
-        normalized.setdefault(f'child_{i}_age', 10)
-        normalized.setdefault(f'child_{i}_grade', '小学')
-        normalized.setdefault(f'child_{i}_interests', '')
-        normalized.setdefault(f'child_{i}_goals', '')
-
-    return normalized
 
 def load_daily_updates() -> Dict[str, Any]:
     """加载今日更新"""
     try:
         today = datetime.now().date().isoformat()
-        result = supabase.table('daily_updates').select("*").eq('date', today).execute()
-        if result.data:
-            return result.data[0]
-        else:
-            # 如果今天没有更新，立即获取
-            updates = get_daily_updates()
-            return updates or {}
+        row = _fetch_daily_updates_row(today)
+        if row:
+            return row
+        # 如果今天没有更新，后台获取；页面先不显示资讯，之后的重跑读到已保存的记录
+        get_daily_updates_refresher().submit(today)
+        return {}
     except:
         return {}
 
 
 def _scheduled_fetch_daily_updates():
     """内部函数：每天定时抓取并保存每日更新"""
+    # get_daily_updates reports errors itself; raise so the job run is recorded as failed
+    if get_daily_updates() is None:
+        raise RuntimeError("daily updates were not generated")
+
+
+SCHEDULER_MAX_SLEEP = 60  # seconds; upper bound between scheduler wakeups
+# False keeps this process out of scheduling entirely (benchmarks, load tests, extra replicas)
+SCHEDULER_ENABLED = st.secrets.get("SCHEDULER_ENABLED", True)
+SCHEDULER_LEADER_TTL = 150  # seconds; must exceed SCHEDULER_MAX_SLEEP so the leader renews in time
+
+
+class LeaderElector:
+    """Lease-based leader election: exactly one replica holding the lease runs scheduled jobs.
+
+    ensure_leadership() acquires or renews the lease and is called on every scheduler
+    tick. While a job runs, hold() keeps renewing from a heartbeat thread so a long
+    job does not lose the lease. If the leader dies its lease expires and the next
+    replica to tick takes over.
+    """
+
+    def __init__(self, store, name: str = 'scheduler-leader', ttl_seconds: float = SCHEDULER_LEADER_TTL,
+                 holder: str = INSTANCE_ID):
+        self.store = store
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.holder = holder
+        self.is_leader = False
+
+    def ensure_leadership(self) -> bool:
+        try:
+            acquired = self.store.try_acquire_lease(self.name, self.holder, self.ttl_seconds)
+        except Exception as e:
+            logger.warning('Leader election failed: %s', e)
+            acquired = False
+        if acquired != self.is_leader:
+            logger.info("%s %s leader for '%s'", self.holder, 'became' if acquired else 'lost', self.name)
+        self.is_leader = acquired
+        return acquired
+
+    def resign(self):
+        if self.is_leader:
+            try:
+                self.store.release_lease(self.name, self.holder)
+            except Exception as e:
+                logger.warning('Failed to resign leadership: %s', e)
+            self.is_leader = False
+
+    @contextmanager
+    def hold(self):
+        """Renew the lease every ttl/3 seconds for the duration of the block."""
+        stop = threading.Event()
+
+        def heartbeat():
+            while not stop.wait(self.ttl_seconds / 3):
+                self.ensure_leadership()
+
+        thread = threading.Thread(target=heartbeat, name=f'lease-heartbeat-{self.name}', daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join(1)
+
+
+class SchedulerService:
+    """One background scheduler per server process.
+
+    Owns a private schedule.Scheduler (not the module-global registry), a named job
+    registry, a single daemon thread that sleeps until the next due job, and a stop
+    event for clean shutdown.
+    """
+
+    def __init__(self, max_sleep: float = SCHEDULER_MAX_SLEEP, elector: LeaderElector = None,
+                 history=None):
+        self.max_sleep = max_sleep
+        # with an elector only the leader replica runs jobs; history records each run
+        self.elector = elector
+        self.history = history
+        self._scheduler = schedule.Scheduler()
+        self._jobs: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def register(self, name: str, at: str, fn):
+        """Register (or replace) a job that runs fn daily at HH:MM local time."""
+        with self._lock:
+            old = self._jobs.pop(name, None)
+            if old is not None:
+                self._scheduler.cancel_job(old)
+            self._jobs[name] = self._scheduler.every().day.at(at).do(self._run_job, name, fn).tag(name)
+
+    def unregister(self, name: str):
+        with self._lock:
+            job = self._jobs.pop(name, None)
+            if job is not None:
+                self._scheduler.cancel_job(job)
+
+    def next_runs(self) -> Dict[str, Any]:
+        """Map of job name -> next scheduled run (datetime)."""
+        return {name: job.next_run for name, job in list(self._jobs.items())}
+
+    def jobs(self) -> List[Dict[str, Any]]:
+        """Registry snapshot for introspection."""
+        return [{'name': name, 'next_run': job.next_run, 'last_run': job.last_run}
+                for name, job in list(self._jobs.items())]
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.is_running():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='scheduler-service', daemon=True)
+        self._thread.start()
+
+    def shutdown(self, timeout: float = 5.0):
+        """Stop the loop and wait for the thread (and any running job) to finish."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        if self.elector is not None:
+            self.elector.resign()
+
+    def _run_job(self, name: str, fn):
+        run_date = date.today().isoformat()
+        run_id = None
+        if self.history is not None:
+            try:
+                # a previous leader may already have finished today's run before dying
+                if self.history.has_succeeded(name, run_date):
+                    logger.info("Scheduled job '%s' already succeeded for %s, skipping", name, run_date)
+                    return
+            except Exception as e:
+                # fail closed: without history every replica that took over would rerun the job
+                logger.warning("Job history unavailable for '%s', skipping run: %s", name, e)
+                return
+            try:
+                run_id = self.history.record_run_start(name, INSTANCE_ID, run_date)
+            except Exception as e:
+                logger.warning("Failed to record start of '%s': %s", name, e)
+        started = time_module.monotonic()
+        outcome, error = 'success', None
+        with self.elector.hold() if self.elector is not None else nullcontext():
+            try:
+                fn()
+            except Exception as e:
+                # swallow errors so one job cannot kill the loop
+                outcome, error = 'failed', str(e)
+                logger.warning("Scheduled job '%s' failed: %s", name, e)
+        duration_ms = (time_module.monotonic() - started) * 1000
+        logger.info("Scheduled job '%s' %s on %s in %.0fms", name, outcome, INSTANCE_ID, duration_ms)
+        if self.history is not None and run_id is not None:
+            try:
+                self.history.record_run_end(run_id, outcome, duration_ms, error)
+            except Exception as e:
+                logger.warning("Failed to record run of '%s': %s", name, e)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            # followers leave due jobs pending, so a replica that takes over runs them at once
+            if self.elector is not None and not self.elector.ensure_leadership():
+                self._stop.wait(self.max_sleep)
+                continue
+            try:
+                with self._lock:
+                    self._scheduler.run_pending()
+                    idle = self._scheduler.idle_seconds
+            except Exception as e:
+                logger.error('Scheduler error: %s', e)
+                idle = None
+            # sleep until the next job is due, but wake at least every max_sleep seconds
+            wait = self.max_sleep if idle is None else min(max(idle, 1.0), self.max_sleep)
+            self._stop.wait(wait)
+
+
+@st.cache_resource
+def get_scheduler_service() -> SchedulerService:
+    """Start the process-wide scheduler on first use; every later session reuses it."""
+    store = get_job_state_store()
+    service = SchedulerService(elector=LeaderElector(store), history=store)
+    service.register('daily_updates', '07:00', _scheduled_fetch_daily_updates)
+    # after daily_updates: the investment/health/education contexts quote today's news
+    service.register('precompute_ai_suggestions', '07:15', precompute_ai_suggestions)
+    # before recompute_scores and the AI precompute, which still read unmigrated rows' flat columns
+    service.register('migrate_children', '03:00', migrate_children_storage)
+    service.register('recompute_scores', '03:30', recompute_all_scores)
+    service.start()
+    atexit.register(service.shutdown)
+    return service
+
+
+# --- Batch precomputation of AI suggestions ---
+BATCH_PAGE_SIZE = 200  # user_data rows per keyset page
+BATCH_WORKERS = 4  # users processed concurrently
+BATCH_LLM_RPM = 60  # requests per minute across the batch
+BATCH_LLM_TPM = 120000  # prompt + completion tokens per minute across the batch
+
+
+@st.cache_resource
+def get_batch_rate_limiter() -> LLMRateLimiter:
+    """Process-wide limiter for batch LLM traffic (only the leader replica runs batches)."""
+    return LLMRateLimiter(BATCH_LLM_RPM, BATCH_LLM_TPM)
+
+
+def _precompute_user_suggestions(row: Dict[str, Any], daily_updates: Dict[str, Any], today: str,
+                                 limiter: LLMRateLimiter) -> Dict[str, int]:
+    """Generate one user's stale suggestions and store them with a single upsert.
+
+    Never raises: a row that cannot be decoded counts as one failure, so a bad row does
+    not abort the page (and the checkpoint moves past it).
+    """
+    counts = {'generated': 0, 'fresh': 0, 'failed': 0}
     try:
-        get_daily_updates()
+        user_data = decode_user_row(row)
     except Exception as e:
-        # swallow errors in scheduler
-        print("Scheduled update failed:", e)
+        counts['failed'] += 1
+        logger.warning('Precompute for %s skipped, row could not be decoded: %s', row.get('user_id'), e)
+        return counts
+    fields = {}
+    for data_type, build in AI_CONTEXT_BUILDERS.items():
+        if row.get(f"last_ai_{data_type}_date") == today and row.get(f"ai_{data_type}_suggestion"):
+            counts['fresh'] += 1
+            continue
+        try:
+            context = build(user_data, daily_updates)
+            limiter.acquire(estimate_tokens(AI_SUGGESTION_SYSTEM_PROMPT) + estimate_tokens(context)
+                            + AI_SUGGESTION_MAX_TOKENS)
+            fields[f"ai_{data_type}_suggestion"] = _generate_ai_suggestion(context, data_type)
+            fields[f"last_ai_{data_type}_date"] = today
+            counts['generated'] += 1
+        except Exception as e:
+            counts['failed'] += 1
+            logger.warning('Precompute %s for %s failed: %s', data_type, row.get('user_id'), e)
+    if fields:
+        try:
+            _upsert_user_data(row['user_id'], fields)
+        except Exception as e:
+            counts['failed'] += counts['generated']
+            counts['generated'] = 0
+            logger.warning('Storing precomputed suggestions for %s failed: %s', row.get('user_id'), e)
+    return counts
 
 
-def start_scheduler_in_background():
-    """Start schedule loop in a background thread once per session"""
-    if st.session_state.get('_scheduler_started'):
-        return
+def precompute_ai_suggestions(page_size: int = BATCH_PAGE_SIZE, workers: int = BATCH_WORKERS) -> Dict[str, Any]:
+    """Generate today's missing or stale AI suggestions for every user_data row.
 
-    def run_loop():
-        # schedule job at 07:00 daily
-        schedule.clear('daily_updates')
-        schedule.every().day.at("07:00").do(_scheduled_fetch_daily_updates).tag('daily_updates')
+    Rows are read with keyset pagination on user_id and each page is processed by a
+    bounded worker pool under the global RPM/TPM limiter. The cursor and counters are
+    checkpointed after every page, so a restarted (or newly elected) replica resumes
+    where the previous attempt stopped. Returns the summary report.
+    """
+    job_name = 'precompute_ai_suggestions'
+    today = datetime.now().date().isoformat()
+    store = get_job_state_store()
+    state = store.load_checkpoint(job_name, today) or {}
+    if state.get('done'):
+        logger.info('%s already completed for %s: %s', job_name, today, state)
+        return state
+
+    daily_updates = _fetch_daily_updates_row(today)
+    if not daily_updates and get_daily_updates():
+        daily_updates = _fetch_daily_updates_row(today)
+    daily_updates = daily_updates or {}
+
+    limiter = get_batch_rate_limiter()
+    started = time_module.monotonic()
+    elapsed_before = state.get('duration_s', 0.0)
+    summary = {
+        'run_date': today,
+        'resumed_from': state.get('cursor'),
+        'cursor': state.get('cursor'),
+        'pages': state.get('pages', 0),
+        'users_scanned': state.get('users_scanned', 0),
+        'generated': state.get('generated', 0),
+        'fresh': state.get('fresh', 0),
+        'failed': state.get('failed', 0),
+        'duration_s': elapsed_before,
+        'done': False
+    }
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='precompute') as pool:
         while True:
-            try:
-                schedule.run_pending()
-            except Exception as e:
-                print('Scheduler error', e)
-            time_module.sleep(60)
+            rows = get_storage().page_user_data(projection_columns('precompute'), summary['cursor'], page_size)
+            if not rows:
+                break
+            for counts in pool.map(lambda r: _precompute_user_suggestions(r, daily_updates, today, limiter), rows):
+                for k, v in counts.items():
+                    summary[k] += v
+            summary['cursor'] = rows[-1]['user_id']
+            summary['pages'] += 1
+            summary['users_scanned'] += len(rows)
+            summary['duration_s'] = round(elapsed_before + time_module.monotonic() - started, 1)
+            store.save_checkpoint(job_name, today, summary)
+            if len(rows) < page_size:
+                break
+
+    summary['duration_s'] = round(elapsed_before + time_module.monotonic() - started, 1)
+    summary['done'] = True
+    summary['llm_cache'] = get_suggestion_cache().stats()
+    store.save_checkpoint(job_name, today, summary)
+    logger.info('%s summary: %s', job_name, json.dumps(summary, ensure_ascii=False))
+    return summary
+
 
-    thread = threading.Thread(target=run_loop, daemon=True)
-    thread.start()
-    st.session_state['_scheduler_started'] = True
+CHILDREN_MIGRATION_PAGE_SIZE = 500
+
+
+def migrate_children_storage(page_size: int = CHILDREN_MIGRATION_PAGE_SIZE) -> Dict[str, Any]:
+    """Copy the flat child_{i}_* columns into the children JSON column for rows not migrated yet.
+
+    Values are copied as stored (no defaults applied) and the flat columns are left in
+    place, so the migration is lossless and can be rolled back. Idempotent: only rows
+    with a null `children` and num_children > 0 are selected.
+    """
+    started = time_module.monotonic()
+    summary = {'pages': 0, 'migrated': 0}
+    cursor = None
+    while True:
+        rows = get_storage().page_user_data(['user_id', 'num_children'] + LEGACY_CHILD_FIELDS, cursor, page_size,
+                                            legacy_children_only=True)
+        if not rows:
+            break
+        updates = [{'user_id': row['user_id'], 'children': legacy_children(row, row.get('num_children'))}
+                   for row in rows]
+        get_storage().upsert_user_data(updates)
+        cursor = rows[-1]['user_id']
+        summary['pages'] += 1
+        summary['migrated'] += len(rows)
+        if len(rows) < page_size:
+            break
+    summary['duration_s'] = round(time_module.monotonic() - started, 1)
+    logger.info("migrate_children_storage summary: %s", json.dumps(summary, ensure_ascii=False))
+    return summary
 
 
 def init_session_from_db(user_id: str):
@@ -724,7 +2871,7 @@ def init_session_from_db(user_id: str):
     if st.session_state.get(guard):
         return
 
-    user_data = load_user_data(user_id)
+    user_data = load_user_data(user_id, 'session_init')
     if not user_data:
         st.session_state[guard] = True
         return
@@ -752,20 +2899,9 @@ def init_session_from_db(user_id: str):
 
     # Child inputs (education page): set widgets keys used (age_{i}, grade_{i}, interests_{i}, goals_{i})
     try:
-        num_children = int(user_data.get('num_children', 0) or 0)
-        for i in range(num_children):
-            age_k = f"age_{i}"
-            grade_k = f"grade_{i}"
-            interests_k = f"interests_{i}"
-            goals_k = f"goals_{i}"
-            if age_k not in st.session_state:
-                st.session_state[age_k] = int(user_data.get(f'child_{i}_age', 10) or 10)
-            if grade_k not in st.session_state:
-                st.session_state[grade_k] = user_data.get(f'child_{i}_grade', '小学')
-            if interests_k not in st.session_state:
-                st.session_state[interests_k] = user_data.get(f'child_{i}_interests', '')
-            if goals_k not in st.session_state:
-                st.session_state[goals_k] = user_data.get(f'child_{i}_goals', '')
+        for i, child in enumerate(user_data.get('children', ())):
+            for attr in CHILD_ATTRS:
+                st.session_state.setdefault(f"{attr}_{i}", getattr(child, attr))
     except Exception:
         pass
 
@@ -838,12 +2974,144 @@ def init_session_from_db(user_id: str):
 
     st.session_state[guard] = True
 
+# AI 上下文构建（页面与批量预计算共用）
+def build_dashboard_context(user_data: Dict[str, Any], daily_updates: Dict[str, Any] = None) -> str:
+    budget = PROMPT_SECTION_BUDGETS['free_text']
+    return (PromptBuilder()
+            .add('用户资产', f"{user_data.get('total_assets', 0)}万元")
+            .add('健康状况', user_data.get('health_status', '良好'), budget)
+            .add('教育目标', user_data.get('education_goals', '未设定'), budget)
+            .add('人生阶段', user_data.get('life_stage', '事业发展期'))
+            .build())
+
+
+def build_investment_context(user_data: Dict[str, Any], daily_updates: Dict[str, Any]) -> str:
+    return (PromptBuilder()
+            .add('总资产', f"{user_data.get('total_assets', 0)}万元")
+            .add('股票占比', f"{user_data.get('stock_percentage', 30)}%")
+            .add('风险偏好', user_data.get('risk_level', '平衡'))
+            .add('今日金融新闻', daily_updates.get('finance_news', ''), PROMPT_SECTION_BUDGETS['finance_news'])
+            .build())
+
+
+def build_health_context(user_data: Dict[str, Any], daily_updates: Dict[str, Any]) -> str:
+    return (PromptBuilder()
+            .add('年龄', f"{user_data.get('age', 35)}岁")
+            .add('BMI', user_data.get('bmi', 23))
+            .add('运动频率', user_data.get('exercise_freq', '每周3-4次'))
+            .add('睡眠时长', f"{user_data.get('sleep_hours', 7)}小时")
+            .add('健康目标', user_data.get('health_goals', '保持健康'), PROMPT_SECTION_BUDGETS['free_text'])
+            .add('今日健康贴士', daily_updates.get('health_tips', ''), PROMPT_SECTION_BUDGETS['health_tips'])
+            .build())
+
+
+def build_education_context(user_data: Dict[str, Any], daily_updates: Dict[str, Any]) -> str:
+    children = []
+    for i, child in enumerate(user_data.get('children', ())):
+        line = (f"孩子{i+1}：{child.age}岁，{child.grade}，"
+                f"兴趣：{child.interests or '未知'}，目标：{child.goals or '未知'}")
+        children.append(truncate_to_tokens(_normalize_context(line).replace('\n', ' '),
+                                           PROMPT_SECTION_BUDGETS['child']))
+
+    return (PromptBuilder()
+            .add('子女数量', len(user_data.get('children', ())))
+            .add('子女情况', '\n'.join(children) or '无', PROMPT_SECTION_BUDGETS['children'])
+            .add('教育预算', f"{user_data.get('education_budget', 0)}万元/年")
+            .add('教育规划', user_data.get('education_plan', '未设定'), PROMPT_SECTION_BUDGETS['free_text'])
+            .add('今日教育资讯', daily_updates.get('education_info', ''), PROMPT_SECTION_BUDGETS['education_info'])
+            .build())
+
+
+def build_life_planning_context(user_data: Dict[str, Any], daily_updates: Dict[str, Any] = None) -> str:
+    budget = PROMPT_SECTION_BUDGETS['free_text']
+    return (PromptBuilder()
+            .add('人生阶段', user_data.get('life_stage', '事业发展期'))
+            .add('短期目标', user_data.get('short_term_goals', '未设定'), budget)
+            .add('中期目标', user_data.get('medium_term_goals', '未设定'), budget)
+            .add('长期目标', user_data.get('long_term_goals', '未设定'), budget)
+            .add('人生愿景', user_data.get('life_vision', '未设定'), budget)
+            .add('优先级', user_data.get('priorities', []))
+            .add('财富状况', f"{user_data.get('total_assets', 0)}万元")
+            .add('健康评分', f"{user_data.get('health_score', 85)}/100")
+            .add('教育进度', f"{user_data.get('education_progress', 75)}%")
+            .build())
+
+
+# Context builder per stored suggestion type, used by the batch precompute. 'life' uses
+# the dashboard context: the dashboard is the landing page, so it is the first 'life'
+# panel a user sees each day.
+AI_CONTEXT_BUILDERS = {
+    'life': build_dashboard_context,
+    'investment': build_investment_context,
+    'health': build_health_context,
+    'education': build_education_context,
+}
+
+
+# --- 投资收益预测（蒙特卡洛）---
+# Annual expected return and volatility per asset class, and their correlations
+# (order: stock, bond, property, cash). The portfolio is treated as rebalanced daily, so
+# its daily return is normal with mean w·mu and variance wᵀΣw and each path needs one
+# draw per day.
+PROJECTION_ASSETS = ('stock', 'bond', 'property', 'cash')
+PROJECTION_ANNUAL_RETURN = (0.07, 0.03, 0.04, 0.018)
+PROJECTION_ANNUAL_VOLATILITY = (0.20, 0.05, 0.10, 0.005)
+PROJECTION_CORRELATION = (
+    (1.0, 0.1, 0.4, 0.0),
+    (0.1, 1.0, 0.2, 0.0),
+    (0.4, 0.2, 1.0, 0.0),
+    (0.0, 0.0, 0.0, 1.0),
+)
+# risk_level picks riskier or safer instruments within stocks and property: their excess
+# return over cash and their volatility are scaled by this factor
+PROJECTION_RISK_SCALE = {'保守': 0.7, '稳健': 0.85, '平衡': 1.0, '进取': 1.15, '激进': 1.3}
+PROJECTION_DAYS = 365
+PROJECTION_PATHS = 2000
+PROJECTION_SEED = 20240101
+PROJECTION_PERCENTILES = (5, 50, 95)
+
+
+def portfolio_daily_moments(weights, risk_level: str):
+    """(mean, std) of the portfolio's daily simple return for allocation weights in percent."""
+    w = np.asarray(weights, dtype=float)
+    w = w / w.sum() if w.sum() > 0 else np.array([0.0, 0.0, 0.0, 1.0])
+    scale = PROJECTION_RISK_SCALE.get(risk_level, 1.0)
+    cash_return = PROJECTION_ANNUAL_RETURN[3]
+    tilt = np.array([scale, 1.0, scale, 1.0])
+    annual_return = cash_return + (np.asarray(PROJECTION_ANNUAL_RETURN) - cash_return) * tilt
+    annual_vol = np.asarray(PROJECTION_ANNUAL_VOLATILITY) * tilt
+    covariance = np.outer(annual_vol, annual_vol) * np.asarray(PROJECTION_CORRELATION)
+    return float(w @ annual_return) / 365, float(np.sqrt(w @ covariance @ w / 365))
+
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def project_portfolio(initial_value: float, weights: tuple, risk_level: str, start: str,
+                      days: int = PROJECTION_DAYS, paths: int = PROJECTION_PATHS,
+                      seed: int = PROJECTION_SEED,
+                      percentiles: tuple = PROJECTION_PERCENTILES) -> pd.DataFrame:
+    """Percentile bands of simulated portfolio value, one row per day from `start`.
+
+    Simulates `paths` geometric random walks at once; the same inputs and seed always
+    give the same bands, and results are memoized on the inputs.
+    """
+    mean, std = portfolio_daily_moments(weights, risk_level)
+    rng = np.random.default_rng(seed)
+    log_returns = rng.normal(mean - std ** 2 / 2, std, size=(paths, days - 1))
+    growth = np.exp(np.cumsum(log_returns, axis=1))
+    values = initial_value * np.hstack([np.ones((paths, 1)), growth])
+    bands = np.percentile(values, percentiles, axis=0)
+    return pd.DataFrame(
+        {f"P{p}": band for p, band in zip(percentiles, bands)},
+        index=pd.date_range(start=start, periods=days, freq='D')
+    )
+
+
 # 页面功能
 def dashboard_page():
     """主页面"""
     st.title("📊 智能仪表盘")
     
-    user_data = load_user_data(st.session_state.get('user_id', ''))
+    user_data = load_user_data(st.session_state.get('user_id', ''), 'dashboard')
     daily_updates = load_daily_updates()
     
     # 概览指标
@@ -873,20 +3141,11 @@ def dashboard_page():
     with col1:
         st.subheader("🤖 AI综合建议")
 
-        context = f"""
-        用户资产：{user_data.get('total_assets', 0)}万元
-        健康状况：{user_data.get('health_status', '良好')}
-        教育目标：{user_data.get('education_goals', '未设定')}
-        人生阶段：{user_data.get('life_stage', '事业发展期')}
-        """
+        context = build_dashboard_context(user_data, daily_updates)
 
         # allow manual refresh of suggestion to avoid calling API on every page load
         user_id = st.session_state.get('user_id', '')
-        if st.button("刷新建议", key="refresh_life_suggestion"):
-            suggestion = get_cached_ai_suggestion(user_id, {'__force_refresh': True, 'text': context}, 'life')
-        else:
-            suggestion = get_cached_ai_suggestion(user_id, context, 'life')
-        st.info(suggestion)
+        show_ai_suggestion(user_id, context, 'life', "refresh_life_suggestion")
         
         # 可视化图表
         st.subheader("📈 资产配置分布")
@@ -925,7 +3184,7 @@ def investment_page():
     """投资页面"""
     st.title("💰 投资管理")
     
-    user_data = load_user_data(st.session_state.get('user_id', ''))
+    user_data = load_user_data(st.session_state.get('user_id', ''), 'investment')
     daily_updates = load_daily_updates()
     
     col1, col2 = st.columns([2, 1])
@@ -1023,40 +3282,36 @@ def investment_page():
 
         # 投资建议
         st.subheader("🎯 AI投资建议")
-        context = f"""
-        总资产：{user_data.get('total_assets', 0)}万元
-        股票占比：{user_data.get('stock_percentage', 30)}%
-        风险偏好：{user_data.get('risk_level', '平衡')}
-        今日金融新闻：{daily_updates.get('finance_news', '')}
-        """
+        context = build_investment_context(user_data, daily_updates)
 
         user_id = st.session_state.get('user_id', '')
-        if st.button("刷新建议", key="refresh_investment_suggestion"):
-            investment_suggestion = get_cached_ai_suggestion(user_id, {'__force_refresh': True, 'text': context}, 'investment')
-        else:
-            investment_suggestion = get_cached_ai_suggestion(user_id, context, 'investment')
-        st.info(investment_suggestion)
+        show_ai_suggestion(user_id, context, 'investment', "refresh_investment_suggestion")
         
         # 模拟收益图表
         st.subheader("📈 模拟收益趋势")
-        
-        dates = pd.date_range(start='2024-01-01', periods=365, freq='D')
-        portfolio_value = [total_assets * 10000]
-        
-        for i in range(1, len(dates)):
-            daily_return = 0.0008 if risk_level == '保守' else 0.0012 if risk_level == '稳健' else 0.0015
-            portfolio_value.append(portfolio_value[-1] * (1 + daily_return + (0.002 * (np.random.randn()))))
-        
+
+        bands = project_portfolio(
+            float(total_assets) * 10000,
+            (stock_pct, bond_pct, property_pct, cash_pct),
+            risk_level,
+            date.today().isoformat()
+        )
+
         fig = go.Figure()
         fig.add_trace(go.Scatter(
-            x=dates,
-            y=portfolio_value,
-            mode='lines',
-            name='Portfolio Value',
+            x=bands.index, y=bands['P95'], mode='lines', name='乐观（P95）',
+            line=dict(color='#4ECDC4', width=0)
+        ))
+        fig.add_trace(go.Scatter(
+            x=bands.index, y=bands['P5'], mode='lines', name='悲观（P5）',
+            line=dict(color='#4ECDC4', width=0), fill='tonexty', fillcolor='rgba(78, 205, 196, 0.2)'
+        ))
+        fig.add_trace(go.Scatter(
+            x=bands.index, y=bands['P50'], mode='lines', name='中位数（P50）',
             line=dict(color='#4ECDC4', width=2)
         ))
         fig.update_layout(
-            title='投资组合价值趋势',
+            title=f'投资组合价值预测（{PROJECTION_PATHS}条模拟路径）',
             xaxis_title='日期',
             yaxis_title='价值（元）',
             hovermode='x'
@@ -1082,7 +3337,7 @@ def health_page():
     """健康页面"""
     st.title("🏥 健康管理")
     
-    user_data = load_user_data(st.session_state.get('user_id', ''))
+    user_data = load_user_data(st.session_state.get('user_id', ''), 'health')
     daily_updates = load_daily_updates()
     
     col1, col2 = st.columns([2, 1])
@@ -1094,7 +3349,7 @@ def health_page():
             col_a, col_b = st.columns(2)
             
             with col_a:
-                age_default = int(st.session_state.get('age', user_data.get('age', 35)))
+                age_default = int(st.session_state.get('age', user_data.get('age') or 35))
                 height_default = float(st.session_state.get('height', user_data.get('height', 170) or 170) or 170)
                 weight_default = float(st.session_state.get('weight', user_data.get('weight', 70) or 70) or 70)
                 age = st.number_input("年龄", value=age_default, min_value=1, max_value=120)
@@ -1112,7 +3367,7 @@ def health_page():
                     exercise_options,
                     index=ex_index
                 )
-                sleep_hours = st.slider("平均睡眠时长(小时)", 4, 12, int(st.session_state.get('sleep_hours', user_data.get('sleep_hours', 7))))
+                sleep_hours = st.slider("平均睡眠时长(小时)", 4, 12, int(st.session_state.get('sleep_hours', user_data.get('sleep_hours') or 7)))
                 smoke_val = st.session_state.get('smoke', user_data.get('smoke', False))
                 smoke = st.selectbox("吸烟", ['否', '是'], index=0 if not smoke_val else 1)
                 drink_options = ['不饮酒', '偶尔', '经常']
@@ -1125,7 +3380,7 @@ def health_page():
                                        placeholder="例如：减重10kg，改善睡眠质量等")
             
             if st.form_submit_button("保存健康数据"):
-                bmi = weight / ((height/100) ** 2)
+                bmi = calculate_bmi(height, weight)
                 health_score = calculate_health_score(age, bmi, exercise_freq, sleep_hours, smoke == '否')
                 
                 data = {
@@ -1185,21 +3440,10 @@ def health_page():
         
         # AI健康建议
         st.subheader("🤖 AI健康建议")
-        context = f"""
-        年龄：{user_data.get('age', 35)}岁
-        BMI：{user_data.get('bmi', 23)}
-        运动频率：{user_data.get('exercise_freq', '每周3-4次')}
-        睡眠时长：{user_data.get('sleep_hours', 7)}小时
-        健康目标：{user_data.get('health_goals', '保持健康')}
-        今日健康贴士：{daily_updates.get('health_tips', '')}
-        """
+        context = build_health_context(user_data, daily_updates)
 
         user_id = st.session_state.get('user_id', '')
-        if st.button("刷新建议", key="refresh_health_suggestion"):
-            health_suggestion = get_cached_ai_suggestion(user_id, {'__force_refresh': True, 'text': context}, 'health')
-        else:
-            health_suggestion = get_cached_ai_suggestion(user_id, context, 'health')
-        st.success(health_suggestion)
+        show_ai_suggestion(user_id, context, 'health', "refresh_health_suggestion", style='success')
     
     with col2:
         st.subheader("💡 健康贴士")
@@ -1228,7 +3472,7 @@ def education_page():
     """教育页面"""
     st.title("🎓 教育规划")
     
-    user_data = load_user_data(st.session_state.get('user_id', ''))
+    user_data = load_user_data(st.session_state.get('user_id', ''), 'education')
     daily_updates = load_daily_updates()
     
     col1, col2 = st.columns([2, 1])
@@ -1238,35 +3482,36 @@ def education_page():
         
         with st.form("education_form"):
             # defensively handle None values stored in user_data
-            num_children_default = int(user_data.get('num_children') or 0)
+            saved_children = user_data.get('children', ())
+            num_children_default = len(saved_children)
             # prefer session_state (hydrated from DB) so returning users see saved value
             num_children = st.number_input(
                 "子女数量",
                 value=int(st.session_state.get('num_children', num_children_default)),
                 min_value=0,
-                max_value=10,
+                max_value=EDUCATION_MAX_CHILDREN,
                 key='num_children'
             )
             
             if num_children > 0:
                 children_info = []
                 for i in range(int(num_children)):
+                    saved = saved_children[i] if i < len(saved_children) else _child()
                     st.markdown(f"**孩子 {i+1}**")
                     col_a, col_b = st.columns(2)
                     with col_a:
-                        default_age = int(st.session_state.get(f'age_{i}', int(user_data.get(f'child_{i}_age') or 10)))
+                        default_age = int(st.session_state.get(f'age_{i}', saved.age))
                         child_age = st.number_input(f"年龄", key=f"age_{i}", value=default_age, min_value=0, max_value=30)
                         grade_options = ['幼儿园', '小学', '初中', '高中', '大学', '其他']
-                        val_gr = user_data.get(f'child_{i}_grade')
-                        default_grade = st.session_state.get(f'grade_{i}', val_gr if isinstance(val_gr, str) and val_gr in grade_options else '小学')
+                        default_grade = st.session_state.get(f'grade_{i}', saved.grade if saved.grade in grade_options else '小学')
                         # ensure default_grade is valid
                         if default_grade not in grade_options:
                             default_grade = '小学'
                         grade_index = grade_options.index(default_grade) if default_grade in grade_options else 0
                         child_grade = st.selectbox(f"年级", key=f"grade_{i}", options=grade_options, index=grade_index)
                     with col_b:
-                        child_interests = st.text_input(f"兴趣特长", key=f"interests_{i}", value=st.session_state.get(f'interests_{i}', user_data.get(f'child_{i}_interests') or ''))
-                        child_goals = st.text_input(f"教育目标", key=f"goals_{i}", value=st.session_state.get(f'goals_{i}', user_data.get(f'child_{i}_goals') or ''))
+                        child_interests = st.text_input(f"兴趣特长", key=f"interests_{i}", value=st.session_state.get(f'interests_{i}', saved.interests))
+                        child_goals = st.text_input(f"教育目标", key=f"goals_{i}", value=st.session_state.get(f'goals_{i}', saved.goals))
                     
                     children_info.append({
                         'age': child_age,
@@ -1287,16 +3532,11 @@ def education_page():
                 if st.form_submit_button("保存教育信息"):
                     data = {
                         'num_children': num_children,
+                        'children': children_info,
                         'education_budget': education_budget,
                         'education_plan': education_plan
                     }
                     
-                    for i, child in enumerate(children_info):
-                        data[f'child_{i}_age'] = child['age']
-                        data[f'child_{i}_grade'] = child['grade']
-                        data[f'child_{i}_interests'] = child['interests']
-                        data[f'child_{i}_goals'] = child['goals']
-                    
                     # 计算教育进度
                     data['education_progress'] = calculate_education_progress(children_info)
                     
@@ -1306,19 +3546,19 @@ def education_page():
             else:
                 st.info("暂无子女教育规划")
                 if st.form_submit_button("保存"):
-                    data = {'num_children': 0, 'education_progress': 0}
+                    data = {'num_children': 0, 'children': [], 'education_progress': 0}
                     save_user_data(st.session_state['user_id'], data)
         
         # 教育进度可视化
-        if user_data.get('num_children', 0) > 0:
+        if user_data.get('children'):
             st.subheader("📈 教育进度追踪")
             
             progress_data = []
-            for i in range(int(user_data.get('num_children', 0))):
+            for i, child in enumerate(user_data['children']):
                 progress_data.append({
                     '孩子': f"孩子{i+1}",
-                    '当前阶段': user_data.get(f'child_{i}_grade', '未知'),
-                    '进度': get_education_stage_progress(user_data.get(f'child_{i}_grade', '小学'))
+                    '当前阶段': child.grade,
+                    '进度': get_education_stage_progress(child.grade)
                 })
             
             if progress_data:
@@ -1331,29 +3571,10 @@ def education_page():
         # AI教育建议
         st.subheader("🤖 AI教育建议")
         
-        children_context = ""
-        for i in range(int(user_data.get('num_children', 0))):
-            children_context += f"""
-            孩子{i+1}：{user_data.get(f'child_{i}_age', 0)}岁，
-            {user_data.get(f'child_{i}_grade', '未知')}，
-            兴趣：{user_data.get(f'child_{i}_interests', '未知')}，
-            目标：{user_data.get(f'child_{i}_goals', '未知')}
-            """
-        
-        context = f"""
-        子女数量：{user_data.get('num_children', 0)}
-        {children_context}
-        教育预算：{user_data.get('education_budget', 0)}万元/年
-        教育规划：{user_data.get('education_plan', '未设定')}
-        今日教育资讯：{daily_updates.get('education_info', '')}
-        """
+        context = build_education_context(user_data, daily_updates)
 
         user_id = st.session_state.get('user_id', '')
-        if st.button("刷新建议", key="refresh_education_suggestion"):
-            education_suggestion = get_cached_ai_suggestion(user_id, {'__force_refresh': True, 'text': context}, 'education')
-        else:
-            education_suggestion = get_cached_ai_suggestion(user_id, context, 'education')
-        st.info(education_suggestion)
+        show_ai_suggestion(user_id, context, 'education', "refresh_education_suggestion")
     
     with col2:
         st.subheader("📚 教育资讯")
@@ -1369,8 +3590,8 @@ def education_page():
             '大学': ['专业学习', '实习就业', '人生规划']
         }
         
-        for i in range(int(user_data.get('num_children', 0))):
-            grade = user_data.get(f'child_{i}_grade', '小学')
+        for i, child in enumerate(user_data.get('children', ())):
+            grade = child.grade
             if grade in milestones:
                 st.write(f"**孩子{i+1} - {grade}阶段重点**")
                 for milestone in milestones[grade]:
@@ -1380,7 +3601,7 @@ def life_planning_page():
     """人生规划页面"""
     st.title("🎯 人生规划")
     
-    user_data = load_user_data(st.session_state.get('user_id', ''))
+    user_data = load_user_data(st.session_state.get('user_id', ''), 'life_planning')
     
     st.subheader("人生目标设定")
     
@@ -1542,24 +3763,10 @@ def life_planning_page():
     # AI综合建议
     st.subheader("🤖 AI人生规划建议")
     
-    context = f"""
-    人生阶段：{user_data.get('life_stage', '事业发展期')}
-    短期目标：{user_data.get('short_term_goals', '未设定')}
-    中期目标：{user_data.get('medium_term_goals', '未设定')}
-    长期目标：{user_data.get('long_term_goals', '未设定')}
-    人生愿景：{user_data.get('life_vision', '未设定')}
-    优先级：{user_data.get('priorities', [])}
-    财富状况：{user_data.get('total_assets', 0)}万元
-    健康评分：{user_data.get('health_score', 85)}/100
-    教育进度：{user_data.get('education_progress', 75)}%
-    """
+    context = build_life_planning_context(user_data)
     
     user_id = st.session_state.get('user_id', '')
-    if st.button("刷新建议", key="refresh_lifeplanning_suggestion"):
-        life_suggestion = get_cached_ai_suggestion(user_id, {'__force_refresh': True, 'text': context}, 'life')
-    else:
-        life_suggestion = get_cached_ai_suggestion(user_id, context, 'life')
-    st.success(life_suggestion)
+    show_ai_suggestion(user_id, context, 'life', "refresh_lifeplanning_suggestion", style='success')
     
     # 行动计划
     st.subheader("📝 行动计划")
@@ -1584,7 +3791,7 @@ def profile_page():
     """个人信息页面"""
     st.title("👤 个人信息")
     
-    user_data = load_user_data(st.session_state.get('user_id', ''))
+    user_data = load_user_data(st.session_state.get('user_id', ''), 'profile')
     
     st.subheader("基本信息")
     
@@ -1674,7 +3881,7 @@ def profile_page():
             st.success("数据导出成功！")
             st.download_button(
                 label="下载数据",
-                data=json.dumps(user_data, ensure_ascii=False, indent=2),
+                data=json.dumps(dict(user_data), ensure_ascii=False, indent=2),
                 file_name=f"personal_data_{datetime.now().strftime('%Y%m%d')}.json",
                 mime="application/json"
             )
@@ -1712,6 +3919,10 @@ def profile_page():
             st.success("隐私设置已更新")
 
 # 辅助函数
+EXERCISE_SCORE_ADJUSTMENTS = {'从不': -20, '偶尔(每月1-2次)': -10, '每周1-2次': 0, '每周3-4次': 5, '每天': 10}
+EDUCATION_GRADE_PROGRESS = {'幼儿园': 20, '小学': 40, '初中': 60, '高中': 80, '大学': 95, '其他': 50}
+
+
 def calculate_health_score(age, bmi, exercise_freq, sleep_hours, no_smoke):
     """计算健康评分"""
     score = 100
@@ -1723,8 +3934,7 @@ def calculate_health_score(age, bmi, exercise_freq, sleep_hours, no_smoke):
         score -= 10
     
     # 运动评分
-    exercise_scores = {'从不': -20, '偶尔(每月1-2次)': -10, '每周1-2次': 0, '每周3-4次': 5, '每天': 10}
-    score += exercise_scores.get(exercise_freq, 0)
+    score += EXERCISE_SCORE_ADJUSTMENTS.get(exercise_freq, 0)
     
     # 睡眠评分
     if sleep_hours < 6 or sleep_hours > 9:
@@ -1744,6 +3954,10 @@ def calculate_health_score(age, bmi, exercise_freq, sleep_hours, no_smoke):
     
     return max(0, min(100, score))
 
+def calculate_bmi(height_cm, weight_kg):
+    """计算BMI（健康评分用未取整的值；bmi 列存的是保留一位小数的结果）"""
+    return weight_kg / ((height_cm / 100) ** 2)
+
 def get_bmi_status(bmi):
     """获取BMI状态"""
     if bmi < 18.5:
@@ -1778,13 +3992,14 @@ def calculate_education_progress(children_info: List[Dict[str, Any]]) -> int:
     for child in children_info:
         grade = child.get('grade', '')
         # map stage to progress
-        mapping = {'幼儿园': 20, '小学': 40, '初中': 60, '高中': 80, '大学': 95, '其他': 50}
-        total += mapping.get(grade, 0)
+        total += EDUCATION_GRADE_PROGRESS.get(grade, 0)
     return int(total / len(children_info))
 
 def calculate_life_score(user_data: Dict[str, Any]) -> int:
     """粗略计算人生规划得分，基于财富、健康、教育的简单加权"""
-    wealth = user_data.get('wealth_score', user_data.get('total_assets', 0) and 70 or 50)
+    wealth = user_data.get('wealth_score')
+    if wealth is None:
+        wealth = 70 if user_data.get('total_assets', 0) else 50
     health = user_data.get('health_score', 50)
     education = user_data.get('education_progress', 50)
 
@@ -1793,29 +4008,222 @@ def calculate_life_score(user_data: Dict[str, Any]) -> int:
     return int(max(0, min(100, score)))
 
 
-# --- App entry: initialize and route pages ---
-init_database()
-authenticate_user()
-
-# start scheduler once per session
-try:
-    start_scheduler_in_background()
-except Exception:
-    pass
-
-# If not logged in, stop here
-if not st.session_state.get('authentication_status'):
-    st.stop()
-
-# Hydrate session_state for returning users so widgets reflect saved values
-try:
-    init_session_from_db(st.session_state.get('user_id', ''))
-except Exception:
-    # non-fatal: continue without hydration
-    pass
-
-# Top-center navigation (replaces sidebar radio)
-pages = {
+# --- 批量评分（向量化）---
+# Same rules as calculate_health_score / get_bmi_status / calculate_education_progress /
+# calculate_life_score, applied to a whole DataFrame of user_data rows at once. Missing
+# values (None/NaN) follow score_user_row, the per-row reference built on the scalar
+# functions; benchmarks/score_engine.py checks both agree on synthetic users.
+SCORE_INPUT_COLUMNS = (
+    ['user_id', 'age', 'height_cm', 'weight_kg', 'exercise_freq', 'sleep_hours', 'smoke', 'num_children', 'children',
+     'total_assets', 'wealth_score', 'health_score', 'education_progress', 'life_score']
+    + [f'child_{i}_grade' for i in range(USER_DATA_MAX_CHILDREN)]  # rows not migrated to `children` yet
+)
+# Health inputs assumed when a row has health data (height and weight) but misses one of them
+SCORE_HEALTH_DEFAULTS = {'age': 35, 'sleep_hours': 7}
+RECOMPUTE_SCORES_PAGE_SIZE = 1000
+
+
+def _present(value) -> bool:
+    return value is not None and not (isinstance(value, float) and np.isnan(value))
+
+
+def score_user_row(row: Dict[str, Any]) -> Dict[str, Any]:
+    """Scores for one user_data row using the scalar functions (reference for the batch engine).
+
+    health_score is recomputed only for rows with height_cm and weight_kg (the health form
+    was saved), from the unrounded calculate_bmi like the health page does, and
+    education_progress only for rows with children or num_children; otherwise the stored
+    value is kept (None when absent). life_score is computed like the life planning page
+    does: on the decoded record, where a missing health_score/education_progress is 0.
+    """
+    row = {k: v for k, v in row.items() if _present(v)}
+    result = {'health_score': row.get('health_score'), 'bmi_status': None,
+              'education_progress': row.get('education_progress')}
+    if row.get('height_cm') and 'weight_kg' in row:
+        bmi = calculate_bmi(float(row['height_cm']), float(row['weight_kg']))
+        result['health_score'] = calculate_health_score(
+            row.get('age', SCORE_HEALTH_DEFAULTS['age']), bmi, row.get('exercise_freq'),
+            row.get('sleep_hours', SCORE_HEALTH_DEFAULTS['sleep_hours']), not bool(row.get('smoke', False)))
+        result['bmi_status'] = get_bmi_status(bmi)
+    children = raw_children(row.get('children'))
+    if children is None and 'num_children' in row:
+        children = legacy_children(row, row['num_children'])
+    if children is not None:
+        result['education_progress'] = calculate_education_progress(children)
+    life_inputs = decode_user_row({'wealth_score': row.get('wealth_score'), 'total_assets': row.get('total_assets'),
+                                   'health_score': result['health_score'],
+                                   'education_progress': result['education_progress']})
+    result['life_score'] = calculate_life_score(life_inputs)
+    return result
+
+
+def _child_grade_lists(df: pd.DataFrame):
+    """(per-row grade lists, has-education-data mask), from `children` or the legacy columns.
+
+    The JSON column has to be decoded row by row; everything after that is vectorized.
+    """
+    num_children = _score_column(df, 'num_children').to_numpy()
+    flat = [_score_column(df, f'child_{i}_grade').to_numpy() for i in range(USER_DATA_MAX_CHILDREN)]
+    grade_lists = []
+    has_children = np.zeros(len(df), dtype=bool)
+    for j, value in enumerate(_score_column(df, 'children').to_numpy()):
+        children = raw_children(value)
+        if children is not None:
+            grade_lists.append([c.get('grade') for c in children])
+            has_children[j] = True
+        elif _present(num_children[j]):
+            n = max(0, min(int(num_children[j]), USER_DATA_MAX_CHILDREN))
+            grade_lists.append([flat[i][j] for i in range(n)])
+            has_children[j] = True
+        else:
+            grade_lists.append([])
+    return grade_lists, has_children
+
+
+def _score_column(df: pd.DataFrame, name: str) -> pd.Series:
+    return df[name] if name in df else pd.Series(np.nan, index=df.index, dtype=object)
+
+
+def _numeric_column(df: pd.DataFrame, name: str) -> np.ndarray:
+    return pd.to_numeric(_score_column(df, name), errors='coerce').to_numpy(dtype=float)
+
+
+def health_scores_vectorized(age, bmi, exercise_freq, sleep_hours, no_smoke) -> np.ndarray:
+    """calculate_health_score over arrays (age/bmi/sleep numeric, no_smoke boolean)."""
+    age, bmi, sleep_hours = (np.asarray(a, dtype=float) for a in (age, bmi, sleep_hours))
+    score = np.full(bmi.shape, 100, dtype=np.int64)
+    score -= np.where((bmi < 18.5) | (bmi > 30), 20, np.where((bmi < 20) | (bmi > 25), 10, 0))
+    score += pd.Series(exercise_freq).map(EXERCISE_SCORE_ADJUSTMENTS).fillna(0).to_numpy(dtype=np.int64)
+    score -= np.where((sleep_hours < 6) | (sleep_hours > 9), 10,
+                      np.where((sleep_hours < 7) | (sleep_hours > 8), 5, 0))
+    score -= np.where(np.asarray(no_smoke, dtype=bool), 0, 15)
+    score += np.where(age > 60, -5, np.where(age < 25, 5, 0))
+    return np.clip(score, 0, 100)
+
+
+def bmi_status_vectorized(bmi) -> np.ndarray:
+    """get_bmi_status over an array; NaN falls through to '肥胖' exactly like the scalar version."""
+    bmi = np.asarray(bmi, dtype=float)
+    return np.select([bmi < 18.5, bmi < 24, bmi < 28], ['偏瘦', '正常', '偏胖'], default='肥胖')
+
+
+def education_progress_vectorized(num_children, grades: pd.DataFrame) -> np.ndarray:
+    """calculate_education_progress where child i's grade is grades.iloc[:, i] for i < num_children."""
+    n = np.clip(np.nan_to_num(np.asarray(num_children, dtype=float)), 0, grades.shape[1]).astype(np.int64)
+    total = np.zeros(len(n), dtype=np.int64)
+    for i in range(grades.shape[1]):
+        progress = grades.iloc[:, i].map(EDUCATION_GRADE_PROGRESS).fillna(0).to_numpy(dtype=np.int64)
+        total += np.where(i < n, progress, 0)
+    average = np.divide(total, n, out=np.zeros(len(n), dtype=float), where=n > 0)
+    return np.floor(average).astype(np.int64)
+
+
+def life_scores_vectorized(wealth_score, total_assets, health_score, education_progress) -> np.ndarray:
+    """calculate_life_score over decoded records, as arrays; NaN means the field is missing.
+
+    Like decode_user_row, a missing health_score/education_progress counts as 0 and a
+    missing total_assets as 0 (so the wealth default is 50).
+    """
+    wealth_score, total_assets, health_score, education_progress = (
+        np.asarray(a, dtype=float) for a in (wealth_score, total_assets, health_score, education_progress))
+    wealth = np.where(np.isnan(wealth_score), np.where(np.nan_to_num(total_assets) != 0, 70, 50), wealth_score)
+    health = np.where(np.isnan(health_score), 0, health_score)
+    education = np.where(np.isnan(education_progress), 0, education_progress)
+    score = 0.4 * wealth + 0.3 * health + 0.3 * education
+    return np.floor(np.clip(score, 0, 100)).astype(np.int64)
+
+
+def score_users_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Vectorized score_user_row for every row of a user_data DataFrame (same index)."""
+    height = _numeric_column(df, 'height_cm')
+    has_health = ~np.isnan(height) & (height != 0) & ~np.isnan(_numeric_column(df, 'weight_kg'))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        bmi = calculate_bmi(height, _numeric_column(df, 'weight_kg'))
+    age = _numeric_column(df, 'age')
+    age = np.where(np.isnan(age), SCORE_HEALTH_DEFAULTS['age'], age)
+    sleep = _numeric_column(df, 'sleep_hours')
+    sleep = np.where(np.isnan(sleep), SCORE_HEALTH_DEFAULTS['sleep_hours'], sleep)
+    smoke = _score_column(df, 'smoke')
+    no_smoke = ~smoke.where(smoke.notna(), False).astype(bool).to_numpy()
+    health = np.where(has_health,
+                      health_scores_vectorized(age, bmi, _score_column(df, 'exercise_freq').to_numpy(),
+                                               sleep, no_smoke),
+                      _numeric_column(df, 'health_score'))
+
+    grade_lists, has_children = _child_grade_lists(df)
+    education = np.where(has_children,
+                         education_progress_vectorized([len(g) for g in grade_lists], pd.DataFrame(grade_lists)),
+                         _numeric_column(df, 'education_progress'))
+
+    return pd.DataFrame({
+        'health_score': pd.array(health, dtype='Int64'),
+        'bmi_status': np.where(has_health, bmi_status_vectorized(bmi), None),
+        'education_progress': pd.array(education, dtype='Int64'),
+        'life_score': life_scores_vectorized(_numeric_column(df, 'wealth_score'), _numeric_column(df, 'total_assets'),
+                                             health, education),
+    }, index=df.index)
+
+
+def cohort_score_summary(df: pd.DataFrame, by: str = 'life_stage') -> pd.DataFrame:
+    """Mean/median of the recomputed scores per cohort (e.g. life_stage, risk_level)."""
+    scores = score_users_frame(df).drop(columns='bmi_status').astype(float)
+    groups = _score_column(df, by).fillna('未设定')
+    summary = scores.groupby(groups).agg(['mean', 'median'])
+    summary.insert(0, 'users', groups.value_counts())
+    return summary
+
+
+def recompute_all_scores(page_size: int = RECOMPUTE_SCORES_PAGE_SIZE) -> Dict[str, Any]:
+    """Recompute health/education/life scores for every user_data row and store the changes.
+
+    Pages are read with keyset pagination on user_id, scored with score_users_frame, and
+    only rows whose stored scores differ are written back, in one bulk upsert per page.
+    Progress is checkpointed per page so a restarted leader resumes where it stopped.
+    """
+    job_name = 'recompute_scores'
+    today = datetime.now().date().isoformat()
+    store = get_job_state_store()
+    summary = store.load_checkpoint(job_name, today) or {
+        'run_date': today, 'cursor': None, 'pages': 0, 'users_scanned': 0, 'updated': 0, 'done': False}
+    if summary.get('done'):
+        return summary
+    started = time_module.monotonic()
+    while True:
+        rows = get_storage().page_user_data(SCORE_INPUT_COLUMNS, summary['cursor'], page_size)
+        if not rows:
+            break
+        frame = pd.DataFrame.from_records(rows)
+        scores = score_users_frame(frame)
+        changes = []
+        for i, row in enumerate(rows):
+            fields = {
+                key: int(scores[key].iat[i]) for key in ('health_score', 'education_progress', 'life_score')
+                if not pd.isna(scores[key].iat[i]) and not _same_db_value(row.get(key), int(scores[key].iat[i]))
+            }
+            if fields:
+                changes.append({'user_id': row['user_id'], 'health_score': row.get('health_score'),
+                                'education_progress': row.get('education_progress'),
+                                'life_score': row.get('life_score'), **fields})
+        if changes:
+            # every row in a bulk upsert must carry the same columns
+            get_storage().upsert_user_data(changes)
+        summary['cursor'] = rows[-1]['user_id']
+        summary['pages'] += 1
+        summary['users_scanned'] += len(rows)
+        summary['updated'] += len(changes)
+        store.save_checkpoint(job_name, today, summary)
+        if len(rows) < page_size:
+            break
+    summary['done'] = True
+    summary['duration_s'] = round(time_module.monotonic() - started, 1)
+    store.save_checkpoint(job_name, today, summary)
+    logger.info('%s summary: %s', job_name, json.dumps(summary, ensure_ascii=False))
+    return summary
+
+
+# --- Navigation: render only the active page ---
+# Page registry in display order (top-center navigation)
+PAGES = {
     '仪表盘': dashboard_page,
     '投资': investment_page,
     '健康': health_page,
@@ -1824,9 +4232,108 @@ pages = {
     '个人信息': profile_page
 }
 
-tabs = st.tabs(list(pages.keys()))
-# Streamlit tabs return a list of tab objects; render the selected page within each tab's context
-for tab_obj, label in zip(tabs, list(pages.keys())):
-    with tab_obj:
-        # Each tab calls its page function
-        pages[label]()
+# 'lazy' runs only the selected page function per rerun; 'tabs' keeps the legacy
+# st.tabs layout where every page function runs on every rerun (useful for comparison).
+NAV_MODE = st.secrets.get("NAV_MODE", "lazy")
+RERUN_TIMINGS_KEEP = 50
+
+
+def _record_rerun_timing(mode: str, page: str, pages_rendered: int, elapsed_ms: float):
+    """Append one page-render timing to the session history and log it at DEBUG."""
+    timings = st.session_state.setdefault('_rerun_timings', [])
+    timings.append({
+        'mode': mode,
+        'page': page,
+        'pages_rendered': pages_rendered,
+        'ms': round(elapsed_ms, 1),
+        'user_data_queries': _rerun_io['queries'],
+        'user_data_bytes': _rerun_io['bytes'],
+        'decode_ms': round(_rerun_io['decode_ms'], 3),
+        'at': datetime.now().isoformat(timespec='seconds')
+    })
+    del timings[:-RERUN_TIMINGS_KEEP]
+    logger.debug('rerun mode=%s page=%s pages_rendered=%s ms=%.1f user_data_bytes=%s decode_ms=%.3f',
+                 mode, page, pages_rendered, elapsed_ms, _rerun_io['bytes'], _rerun_io['decode_ms'])
+
+
+def show_rerun_timings():
+    """Sidebar summary of recent rerun timings grouped by navigation mode."""
+    timings = st.session_state.get('_rerun_timings') or []
+    if not timings:
+        return
+    with st.sidebar.expander("⏱ 页面渲染耗时"):
+        df = pd.DataFrame(timings)
+        summary = df.groupby('mode')['ms'].agg(['count', 'mean', 'median', 'max']).round(1)
+        st.dataframe(summary, use_container_width=True)
+        if 'user_data_bytes' in df:
+            io = df.groupby('page')[['user_data_queries', 'user_data_bytes', 'decode_ms']].mean().round(2)
+            st.caption("每页 user_data 读取（平均查询次数 / 字节 / 解码毫秒）")
+            st.dataframe(io, use_container_width=True)
+        st.caption(f"最近一次：{timings[-1]['page']} {timings[-1]['ms']}ms")
+
+
+def render_pages(pages: Dict[str, Any]):
+    """Route to page functions; in lazy mode only the active page executes."""
+    labels = list(pages.keys())
+    start = time_module.perf_counter()
+    if NAV_MODE == 'tabs':
+        page_label, pages_rendered = 'all', len(labels)
+    else:
+        page_label = st.radio("导航", labels, horizontal=True, key='active_page',
+                              label_visibility='collapsed')
+        pages_rendered = 1
+        # leaving a page writes whatever it queued before the next page reads
+        if st.session_state.get('_last_active_page') not in (None, page_label):
+            flush_pending_writes(st.session_state.get('user_id'))
+        st.session_state['_last_active_page'] = page_label
+    try:
+        if NAV_MODE == 'tabs':
+            tabs = st.tabs(labels)
+            # Streamlit tabs return a list of tab objects; every page function runs inside its tab
+            for tab_obj, label in zip(tabs, labels):
+                with tab_obj:
+                    pages[label]()
+        else:
+            pages[page_label]()
+    finally:
+        # also runs when a page calls st.rerun()/st.stop() mid-render
+        _record_rerun_timing(NAV_MODE, page_label, pages_rendered,
+                             (time_module.perf_counter() - start) * 1000)
+
+
+# --- App entry: initialize and route pages ---
+def main():
+    begin_rerun_scope()
+    authenticate_user()
+
+    # start scheduler once per server process
+    if SCHEDULER_ENABLED:
+        try:
+            get_scheduler_service()
+        except Exception:
+            pass
+
+    # If not logged in, stop here
+    if not st.session_state.get('authentication_status'):
+        st.stop()
+
+    init_database()
+
+    track_write_behind_session(st.session_state.get('user_id'))
+
+    # Hydrate session_state for returning users so widgets reflect saved values
+    try:
+        init_session_from_db(st.session_state.get('user_id', ''))
+    except Exception:
+        # non-fatal: continue without hydration
+        pass
+
+    render_pages(PAGES)
+    if st.secrets.get("SHOW_RERUN_TIMINGS", False):
+        show_rerun_timings()
+        show_llm_cache_stats()
+
+
+# streamlit runs the script as __main__; importing the module (benchmarks) skips the app entry
+if __name__ == "__main__":
+    main()
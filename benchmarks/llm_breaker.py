@@ -0,0 +1,161 @@
+"""Check that every exit of a half-open probe call leaves the circuit breaker usable.
+
+Drives ResilientLLMClient with a scripted fake provider and a breaker that goes
+half-open after a few milliseconds. For each way a probe call can end, it checks the
+breaker state afterwards and that the next call reaches the provider again:
+- a non-transient API error (400 bad request);
+- a transient error (503), which re-opens the circuit;
+- a limiter timeout (the probe must not be taken at all);
+- a stream read to the end, one that fails with a non-transient error, and one
+  abandoned mid-iteration (GeneratorExit, as on a rerun or page switch);
+- a stream that is never iterated (the probe expires after reset_timeout).
+
+Run from the repository root (no network calls are made):
+
+    python benchmarks/llm_breaker.py
+"""
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import MVP_DEMO as app  # noqa: E402
+
+RESET_S = 0.05
+
+
+class APIError(Exception):
+    def __init__(self, status_code: int):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+
+
+def chunk(text: str):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))], usage=None)
+
+
+class FakeProvider:
+    """chat.completions.create that pops the next scripted outcome and counts calls."""
+
+    def __init__(self):
+        self.script = []
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, timeout=None, **kwargs):
+        self.calls += 1
+        outcome = self.script.pop(0) if self.script else 'ok'
+        if isinstance(outcome, Exception):
+            raise outcome
+        if kwargs.get('stream'):
+            return self.stream(outcome)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content='ok'))], usage=None)
+
+    @staticmethod
+    def stream(outcome):
+        for i in range(3):
+            yield chunk(f'part{i}')
+            if outcome == 'stream_error' and i == 1:
+                raise APIError(400)
+
+
+class FakeLimiter:
+    def __init__(self):
+        self.admit = True
+
+    def acquire(self, estimated_tokens, timeout=None):
+        return self.admit
+
+
+def half_open_client():
+    provider, limiter = FakeProvider(), FakeLimiter()
+    breaker = app.CircuitBreaker(failure_threshold=1, reset_timeout=RESET_S)
+    client = app.ResilientLLMClient(provider, limiter, breaker, retry_base_delay=0.001)
+    breaker.record_failure()
+    time.sleep(RESET_S * 1.2)
+    return client, provider, limiter
+
+
+def call(client, **kwargs):
+    try:
+        result = client.chat(messages=[{'role': 'user', 'content': 'hi'}], **kwargs)
+        return list(result) if kwargs.get('stream') else result
+    except Exception as e:
+        return e
+
+
+def probe_non_transient(client, provider, limiter):
+    provider.script = [APIError(400)]
+    assert isinstance(call(client), APIError)
+    return 'closed'
+
+
+def probe_transient(client, provider, limiter):
+    provider.script = [APIError(503)]
+    assert isinstance(call(client), app.LLMUnavailableError)
+    time.sleep(RESET_S * 1.2)
+    return 'open'  # turns half-open on the next allow()
+
+
+def probe_limiter_timeout(client, provider, limiter):
+    limiter.admit = False
+    assert isinstance(call(client), app.LLMUnavailableError)
+    limiter.admit = True
+    assert provider.calls == 0
+    return 'open'
+
+
+def probe_stream_complete(client, provider, limiter):
+    assert len(call(client, stream=True)) == 3
+    return 'closed'
+
+
+def probe_stream_error(client, provider, limiter):
+    provider.script = ['stream_error']
+    assert isinstance(call(client, stream=True), APIError)
+    return 'closed'
+
+
+def probe_stream_abandoned(client, provider, limiter):
+    stream = client.chat(messages=[{'role': 'user', 'content': 'hi'}], stream=True)
+    next(stream)
+    stream.close()
+    return 'half_open'
+
+
+def probe_stream_never_read(client, provider, limiter):
+    client.chat(messages=[{'role': 'user', 'content': 'hi'}], stream=True)
+    assert isinstance(call(client), app.LLMUnavailableError), 'probe still in flight'
+    time.sleep(RESET_S * 1.2)
+    return 'half_open'
+
+
+CASES = [probe_non_transient, probe_transient, probe_limiter_timeout, probe_stream_complete,
+         probe_stream_error, probe_stream_abandoned, probe_stream_never_read]
+
+
+def main() -> int:
+    failures = 0
+    for case in CASES:
+        client, provider, limiter = half_open_client()
+        try:
+            expected_state = case(client, provider, limiter)
+            state = client.breaker.state
+            assert state == expected_state, f'breaker {state}, expected {expected_state}'
+            calls = provider.calls
+            result = call(client)
+            assert not isinstance(result, Exception), f'next call failed: {result!r}'
+            assert provider.calls == calls + 1, 'next call did not reach the provider'
+            assert client.breaker.state == 'closed', f'breaker {client.breaker.state} after a good call'
+            print(f"ok      {case.__name__}")
+        except AssertionError as e:
+            failures += 1
+            print(f"FAILED  {case.__name__}: {e}")
+    print("OK: every probe exit releases the breaker" if not failures else f"FAILED: {failures} cases")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
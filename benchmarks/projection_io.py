@@ -0,0 +1,66 @@
+"""Bytes and decode time per page: projected user_data columns vs select("*").
+
+Builds a fully populated user_data row (long suggestion texts, goal free text, all
+child_* columns) and, for every projection in USER_DATA_PROJECTIONS, reports the JSON
+size of the row a page now fetches and the time to decode it into a UserRecord,
+next to the same numbers for the whole row.
+
+Run from the repository root (uses .streamlit/secrets.toml; no network calls are made):
+
+    python benchmarks/projection_io.py
+"""
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import MVP_DEMO as app  # noqa: E402
+
+
+def full_row() -> dict:
+    row = {'id': 1, 'user_id': 'bench-user', 'created_at': '2024-01-01T00:00:00+00:00'}
+    for field in app.USER_DATA_SCHEMA:
+        row[field.column] = 1
+    row.update({
+        'risk_level': '平衡', 'exercise_freq': '每周3-4次', 'drink': '偶尔', 'num_children': 3,
+        'priorities': ['健康', '家庭', '财富'], 'smoke': False,
+        'health_goals': '保持健康，控制体重，改善睡眠质量。' * 10,
+        'education_plan': '国内升学为主，兼顾兴趣培养与综合素质提升。' * 10,
+        'short_term_goals': '完成年度储蓄目标。' * 10, 'medium_term_goals': '购置改善型住房。' * 10,
+        'long_term_goals': '实现财务自由。' * 10, 'life_vision': '家庭和睦，身体健康，持续成长。' * 10,
+    })
+    for data_type in app.AI_SUGGESTION_TYPES:
+        row[f'ai_{data_type}_suggestion'] = '【总结】' + '根据您的情况，建议保持均衡配置并定期复盘。' * 40
+        row[f'last_ai_{data_type}_date'] = '2024-01-01'
+    for i in range(app.USER_DATA_MAX_CHILDREN):
+        row.update({f'child_{i}_age': 8, f'child_{i}_grade': '小学',
+                    f'child_{i}_interests': '钢琴、足球、编程' * 3, f'child_{i}_goals': '全面发展' * 3})
+    return row
+
+
+def measure(row: dict):
+    size = len(json.dumps([row], ensure_ascii=False, default=str).encode('utf-8'))
+    runs = 2000
+    seconds = timeit.timeit(lambda: app.decode_user_row(row), number=runs)
+    return size, seconds / runs * 1e6
+
+
+def main() -> int:
+    row = full_row()
+    full_bytes, full_us = measure(row)
+    print(f"{'projection':<16}{'columns':>8}{'bytes':>9}{'saved':>8}{'decode µs':>11}")
+    print(f"{'select *':<16}{len(row):>8}{full_bytes:>9}{'':>8}{full_us:>11.1f}")
+    for name in app.USER_DATA_PROJECTIONS:
+        columns = app.projection_columns(name)
+        if columns is None:
+            continue
+        projected = {k: v for k, v in row.items() if k in columns}
+        size, micros = measure(projected)
+        print(f"{name:<16}{len(projected):>8}{size:>9}{1 - size / full_bytes:>8.0%}{micros:>11.1f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
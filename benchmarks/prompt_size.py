@@ -0,0 +1,79 @@
+"""Prompt size benchmark for the AI suggestion contexts.
+
+Builds every suggestion context for a typical user and for a worst-case user (many
+children with long free text, a very long news blob) and reports the estimated token
+count of the full prompt. Exits non-zero when a context exceeds
+PROMPT_CONTEXT_TOKEN_LIMITS, so prompt size regressions show up here.
+
+Run from the repository root (uses .streamlit/secrets.toml; no network calls are made):
+
+    python benchmarks/prompt_size.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import MVP_DEMO as app  # noqa: E402
+
+# user_data rows as stored (DB column names); the contexts get them decoded, as the pages do
+TYPICAL_ROW = {
+    'user_id': 'bench-user', 'total_assets': 500, 'stock_percentage': 30, 'risk_level': '平衡', 'age': 38,
+    'bmi': 23.5, 'exercise_freq': '每周3-4次', 'sleep_hours': 7, 'health_goals': '保持健康，控制体重',
+    'num_children': 2, 'children': [
+        {'age': 8, 'grade': '小学', 'interests': '钢琴、足球', 'goals': '全面发展'},
+        {'age': 14, 'grade': '初中', 'interests': '编程', 'goals': '重点高中'},
+    ],
+    'education_budget': 20, 'education_plan': '国内升学为主', 'life_stage': '事业发展期',
+}
+TYPICAL_UPDATES = {
+    'finance_news': '1. 美联储维持利率不变。\n2. 欧元区通胀回落。\n3. 原油价格小幅上涨。',
+    'health_tips': '每天保持30分钟中等强度运动。',
+    'education_info': '多地发布中考改革方案，强调综合素质评价。',
+}
+
+WORST_ROW = dict(TYPICAL_ROW, num_children=app.EDUCATION_MAX_CHILDREN, health_goals='减重、增肌、改善睡眠。' * 40,
+                 education_plan='出国留学准备，语言考试与背景提升。' * 40,
+                 children=[{'age': 6 + i % 12, 'grade': '小学', 'interests': '钢琴、足球、编程、绘画、游泳、' * 30,
+                            'goals': '考入理想学校并保持兴趣。' * 30} for i in range(app.EDUCATION_MAX_CHILDREN)])
+TYPICAL_USER = app.decode_user_row(TYPICAL_ROW)
+WORST_USER = app.decode_user_row(WORST_ROW)
+WORST_UPDATES = {
+    'finance_news': '\n'.join(f'{i}. 全球市场重大事件，央行政策与地缘政治变化对资产价格产生影响。' for i in range(60)),
+    'health_tips': '规律作息，均衡饮食。' * 100,
+    'education_info': '教育政策更新，关注升学与素质教育。' * 100,
+}
+
+CONTEXTS = {
+    'life': app.build_dashboard_context,
+    'investment': app.build_investment_context,
+    'health': app.build_health_context,
+    'education': app.build_education_context,
+}
+
+
+def prompt_tokens(context: str, data_type: str) -> int:
+    messages = app._ai_suggestion_messages(context, data_type)
+    return sum(app.estimate_tokens(m['content']) for m in messages)
+
+
+def main() -> int:
+    failed = False
+    if '孩子1' not in app.build_education_context(WORST_USER, WORST_UPDATES):
+        print("FAILED: the education context lists no children; the fixtures no longer match the record shape")
+        failed = True
+    print(f"{'context':<12}{'typical':>10}{'worst':>10}{'limit':>10}")
+    for data_type, builder in CONTEXTS.items():
+        typical = app.estimate_tokens(builder(TYPICAL_USER, TYPICAL_UPDATES))
+        worst = app.estimate_tokens(builder(WORST_USER, WORST_UPDATES))
+        limit = app.PROMPT_CONTEXT_TOKEN_LIMITS[data_type]
+        flag = '' if worst <= limit else '  OVER LIMIT'
+        failed = failed or bool(flag)
+        print(f"{data_type:<12}{typical:>10}{worst:>10}{limit:>10}{flag}")
+    worst_prompt = max(prompt_tokens(b(WORST_USER, WORST_UPDATES), t) for t, b in CONTEXTS.items())
+    print(f"largest full prompt (system + user): {worst_prompt} tokens")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,147 @@
+"""Equivalence check and benchmark for the vectorized scoring engine.
+
+Generates synthetic user_data rows (100k by default), including missing values and
+values on every rule boundary, scores them with the per-row reference
+(score_user_row, built on the scalar calculate_* functions) and with
+score_users_frame, and reports both timings. Also checks the batch against the pages:
+- health_score matches what the health page computes from height and weight (the
+  stored bmi is rounded, so heights and weights near the BMI band edges are included),
+  and rows without height/weight keep their stored health_score;
+- every life_score matches what the life planning page computes from the decoded
+  record (including users who saved only a life plan).
+Exits non-zero if any row differs.
+
+Run from the repository root (uses .streamlit/secrets.toml; no network calls are made):
+
+    python benchmarks/score_engine.py [num_users]
+"""
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import MVP_DEMO as app  # noqa: E402
+
+GRADES = list(app.EDUCATION_GRADE_PROGRESS) + ['未知', None]
+EXERCISE = list(app.EXERCISE_SCORE_ADJUSTMENTS) + ['其他', None]
+# just either side of the band edges, so the stored bmi (rounded to 0.1) sits on the edge
+BOUNDARY_BMI = [18.45, 18.46, 18.54, 19.96, 20.04, 23.96, 24.04, 24.96, 25.04, 27.96, 28.04, 29.96, 30.04]
+LIFE_STAGES = ['求学期', '事业发展期', '家庭建设期', '财富积累期', '退休规划期']
+
+
+def synthetic_users(n: int, seed: int = 7) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+
+    def with_missing(values, rate=0.1):
+        values = pd.Series(values, dtype=object)
+        values[rng.random(n) < rate] = None
+        return values
+
+    height = np.round(rng.uniform(150, 195, n), 1)
+    target_bmi = np.where(rng.random(n) < 0.3, rng.choice(BOUNDARY_BMI, n), rng.uniform(15, 35, n))
+    weight = np.round(target_bmi * (height / 100) ** 2, 2)
+    has_health = rng.random(n) >= 0.2
+    data = {
+        'user_id': [f'user-{i:06d}' for i in range(n)],
+        'age': with_missing(rng.integers(18, 80, n)),
+        'height_cm': pd.Series(height, dtype=object).where(has_health, None),
+        'weight_kg': pd.Series(weight, dtype=object).where(has_health, None),
+        # what the health page stores next to height and weight
+        'bmi': pd.Series(np.round(weight / (height / 100) ** 2, 1), dtype=object).where(has_health, None),
+        'exercise_freq': with_missing(rng.choice(EXERCISE, n)),
+        'sleep_hours': with_missing(rng.choice([4, 5, 6, 7, 8, 9, 10, 12], n)),
+        'smoke': with_missing(rng.random(n) < 0.2),
+        'num_children': with_missing(rng.integers(0, 12, n), 0.2),
+        'total_assets': with_missing(np.where(rng.random(n) < 0.2, 0, rng.uniform(0, 5000, n))),
+        'wealth_score': with_missing(rng.integers(-10, 120, n), 0.5),
+        'health_score': with_missing(rng.integers(0, 101, n), 0.3),
+        'education_progress': with_missing(rng.integers(0, 101, n), 0.3),
+        'life_stage': with_missing(rng.choice(LIFE_STAGES, n)),
+    }
+    for i in range(app.USER_DATA_MAX_CHILDREN):
+        data[f'child_{i}_grade'] = rng.choice(GRADES, n)
+    # half the rows are migrated to the children JSON column (larger families included)
+    data['children'] = [
+        [{'age': 8, 'grade': g, 'interests': '', 'goals': ''} for g in rng.choice(GRADES, rng.integers(0, 15))]
+        if migrated else None
+        for migrated in rng.random(n) < 0.5
+    ]
+    df = pd.DataFrame(data)
+    # users who saved a life plan but no assets, health or education data
+    plan_only = rng.random(n) < 0.05
+    df.loc[plan_only, [c for c in df.columns if c not in ('user_id', 'life_stage')]] = None
+    return df
+
+
+def main() -> int:
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    df = synthetic_users(n)
+    records = df.to_dict('records')
+
+    started = time.perf_counter()
+    expected = pd.DataFrame([app.score_user_row(r) for r in records], index=df.index)
+    scalar_s = time.perf_counter() - started
+
+    started = time.perf_counter()
+    actual = app.score_users_frame(df)
+    vector_s = time.perf_counter() - started
+
+    mismatches = 0
+    for column in expected.columns:
+        left = expected[column].astype(object).where(expected[column].notna(), None)
+        right = actual[column].astype(object).where(actual[column].notna(), None)
+        # None on both sides is a match (plain != treats None != None as a difference)
+        differs = ~((left == right) | (left.isna() & right.isna()))
+        mismatches += int(differs.sum())
+        if differs.any():
+            first = differs.idxmax()
+            print(f"{column}: {int(differs.sum())} mismatches, e.g. row {first}: "
+                  f"scalar={left[first]!r} vectorized={right[first]!r} input={records[first]}")
+
+    # the health page scores the unrounded bmi of the saved height and weight
+    page_health = pd.Series([
+        app.calculate_health_score(
+            r['age'] if app._present(r['age']) else 35,
+            app.calculate_bmi(r['height_cm'], r['weight_kg']), r['exercise_freq'],
+            r['sleep_hours'] if app._present(r['sleep_hours']) else 7,
+            not (app._present(r['smoke']) and r['smoke']))
+        if app._present(r['height_cm']) else r['health_score']
+        for r in records
+    ], index=df.index, dtype=object)
+    batch_health = actual['health_score'].astype(object).where(actual['health_score'].notna(), None)
+    health_differs = ~((page_health == batch_health) | (page_health.isna() & batch_health.isna()))
+    if health_differs.any():
+        first = health_differs.idxmax()
+        print(f"health_score vs page: {int(health_differs.sum())} mismatches, e.g. row {first}: "
+              f"page={page_health[first]!r} batch={batch_health[first]!r} input={records[first]}")
+    mismatches += int(health_differs.sum())
+
+    # the life planning page scores the decoded record: the nightly job must store the same value
+    page_scores = pd.Series([
+        app.calculate_life_score(app.decode_user_row({
+            **{k: v for k, v in r.items() if app._present(v)},
+            'health_score': None if pd.isna(h) else h,
+            'education_progress': None if pd.isna(e) else e}))
+        for r, h, e in zip(records, expected['health_score'], expected['education_progress'])
+    ], index=df.index)
+    page_differs = page_scores != actual['life_score']
+    if page_differs.any():
+        first = page_differs.idxmax()
+        print(f"life_score vs page: {int(page_differs.sum())} mismatches, e.g. row {first}: "
+              f"page={page_scores[first]} batch={actual['life_score'][first]} input={records[first]}")
+    mismatches += int(page_differs.sum())
+
+    print(f"users: {n}")
+    print(f"scalar reference: {scalar_s:.2f}s ({n / scalar_s:,.0f} users/s)")
+    print(f"vectorized:       {vector_s:.3f}s ({n / vector_s:,.0f} users/s), {scalar_s / vector_s:.0f}x faster")
+    print(app.cohort_score_summary(df).round(1))
+    print("OK: results identical" if not mismatches else f"FAILED: {mismatches} mismatching values")
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,341 @@
+"""Per-session cost benchmark: drives MVP_DEMO.py sessions one after another through AppTest.
+
+All sessions live in one process, like sessions on one Streamlit worker: they share the
+process-wide caches, the LLM client with its limiter and breaker, the storage backend
+and the background suggestion refresher. Every session goes through the same rounds:
+- log in;
+- visit every page, then revisit them --switch-rounds more times;
+- save the health form;
+- refresh the health suggestion.
+
+Script runs are serial: AppTest swaps process globals (the runtime instance,
+st.secrets) on every run, so only one session reruns at a time. Latencies are
+therefore per-rerun costs without contention, not latencies under concurrent load;
+only the background refreshes overlap with other sessions' reruns. The capacity
+figure is an estimate projected from those serial timings, not a measurement: it
+divides --think-time-s (one rerun per user per think time) by the mean rerun time.
+That is conservative, since a real server overlaps the DB/LLM waits of sessions.
+
+The backends are local and deterministic:
+- Storage is the SQLite backend (STORAGE_BACKEND = "sqlite") in a temp directory.
+  Every storage operation opens its own connection, so each connect counts as one
+  DB round trip, delayed by --db-latency-ms.
+- The LLM is a fake OpenAI-compatible endpoint on localhost (QWEN_BASE_URL). It
+  answers chat completions, streamed or not, after --llm-latency-ms.
+
+The report lists, per round:
+- rerun latency percentiles, measured around AppTest.run;
+- DB round trips, user_data queries and LLM requests per rerun.
+
+Call counts are round totals divided by the round's reruns, so they include work
+done by background refreshes. A second pass with tracemalloc reports memory per
+logged-in session. Exits non-zero on script errors or when p95 exceeds
+--p95-budget-ms.
+
+    python benchmarks/session_cost.py [--sessions 20] [--db-latency-ms 5] [--llm-latency-ms 300]
+"""
+import argparse
+import contextlib
+import gc
+import hashlib
+import http.server
+import json
+import logging
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import date
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP = os.path.join(REPO, 'MVP_DEMO.py')
+PASSWORD = 'load-test-password'
+SUGGESTION = json.dumps({
+    'summary': '整体状况良好，建议保持当前节奏并定期复盘。',
+    'recommendations': ['保持均衡配置', '规律作息'],
+    'actions': ['每月检查一次预算执行情况'],
+    'risks': ['短期市场波动'],
+    'confidence': 80,
+}, ensure_ascii=False)
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def add(self, n: int = 1):
+        with self._lock:
+            self.value += n
+
+
+DB_CALLS = Counter()
+LLM_CALLS = Counter()
+
+
+def install_db_latency(latency_s: float):
+    """Count and delay every SQLite connection the app's storage opens (one per operation)."""
+    connect = sqlite3.connect
+
+    def metered_connect(*args, **kwargs):
+        DB_CALLS.add()
+        if latency_s:
+            time.sleep(latency_s)
+        return connect(*args, **kwargs)
+
+    sqlite3.connect = metered_connect
+
+
+def fake_llm_server(latency_s: float) -> http.server.ThreadingHTTPServer:
+    """OpenAI-compatible /v1/chat/completions stub answering every prompt with SUGGESTION."""
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            LLM_CALLS.add()
+            time.sleep(latency_s)
+            model = request.get('model', 'fake')
+            usage = {'prompt_tokens': 500, 'completion_tokens': 120, 'total_tokens': 620}
+            if not request.get('stream'):
+                body = json.dumps({
+                    'id': 'fake', 'object': 'chat.completion', 'created': 0, 'model': model,
+                    'choices': [{'index': 0, 'finish_reason': 'stop',
+                                 'message': {'role': 'assistant', 'content': SUGGESTION}}],
+                    'usage': usage,
+                }).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            pieces = [SUGGESTION[i:i + 20] for i in range(0, len(SUGGESTION), 20)]
+            for piece in pieces:
+                chunk = {'id': 'fake', 'object': 'chat.completion.chunk', 'created': 0, 'model': model,
+                         'choices': [{'index': 0, 'delta': {'content': piece}, 'finish_reason': None}]}
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            final = {'id': 'fake', 'object': 'chat.completion.chunk', 'created': 0, 'model': model,
+                     'choices': [], 'usage': usage}
+            self.wfile.write(f"data: {json.dumps(final)}\n\ndata: [DONE]\n\n".encode())
+            self.close_connection = True
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def write_secrets(workdir: str, secrets: dict):
+    # module-level imports read the file; AppTest runs read at.secrets (set to the same values)
+    os.makedirs(os.path.join(workdir, '.streamlit'), exist_ok=True)
+    with open(os.path.join(workdir, '.streamlit', 'secrets.toml'), 'w') as f:
+        f.writelines(f"{key} = {json.dumps(value)}\n" for key, value in secrets.items())
+
+
+def seed(app, db_path: str, sessions: int):
+    storage = app.SqliteStorage(db_path)
+    hashed = hashlib.sha256(PASSWORD.encode()).hexdigest()
+    for i in range(sessions):
+        if not storage.get_user_by_username(f'load_user_{i}', 'id'):
+            storage.insert_user({'username': f'load_user_{i}', 'email': f'load_user_{i}@example.com',
+                                 'password': hashed, 'created_at': date.today().isoformat()})
+    # today's news already exists, as after the scheduled morning fetch
+    storage.insert_daily_updates({
+        'date': date.today().isoformat(),
+        'finance_news': '1. 央行维持利率不变。\n2. 股市小幅上涨。',
+        'health_tips': '每天保持30分钟中等强度运动。',
+        'education_info': '多地发布中考改革方案。',
+    })
+
+
+class Session:
+    """One simulated family user: an AppTest instance plus its rerun measurements."""
+
+    def __init__(self, index: int, secrets: dict, timeout: float):
+        from streamlit.testing.v1 import AppTest
+        self.index = index
+        self.at = AppTest.from_file(APP, default_timeout=timeout)
+        self.at.secrets.update(secrets)
+
+    def _run(self):
+        started = time.perf_counter()
+        self.at.run()
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        errors = [str(e.value) for e in self.at.exception]
+        timings = self.at.session_state['_rerun_timings'] if '_rerun_timings' in self.at.session_state else []
+        queries = timings[-1]['user_data_queries'] if timings else 0
+        return {'ms': elapsed_ms, 'errors': errors, 'user_data_queries': queries}
+
+    def login(self):
+        self.at.run()
+        self.at.sidebar.text_input[0].input(f'load_user_{self.index}')
+        self.at.sidebar.text_input[1].input(PASSWORD)
+        next(b for b in self.at.sidebar.button if b.label == '登录').click()
+        submitted = self._run()
+        if not self.at.session_state['authentication_status']:
+            submitted['errors'].append('login failed')
+            return [submitted]
+        # safe_rerun only stops the run on streamlits without experimental_rerun: the
+        # browser's next rerun is what renders the landing page
+        return [submitted, self._run()]
+
+    def switch(self, page: str):
+        self.at.radio(key='active_page').set_value(page)
+        return [self._run()]
+
+    def save_health_form(self):
+        self.at.radio(key='active_page').set_value('健康')
+        opened = self._run()
+        next(n for n in self.at.number_input if n.label == '年龄').set_value(30 + self.index % 40)
+        next(b for b in self.at.button if b.label == '保存健康数据').click()
+        return [opened, self._run()]
+
+    def refresh_suggestion(self):
+        self.at.button(key='refresh_health_suggestion').click()
+        return [self._run()]
+
+
+def run_round(sessions, action):
+    """Run one action on every session in turn; returns per-rerun results plus call deltas."""
+    db_before, llm_before = DB_CALLS.value, LLM_CALLS.value
+    results = []
+    for session in sessions:
+        try:
+            results += action(session)
+        except Exception as e:
+            results.append({'ms': 0.0, 'errors': [f'{type(e).__name__}: {e}'], 'user_data_queries': 0})
+    return results, DB_CALLS.value - db_before, LLM_CALLS.value - llm_before
+
+
+def percentile(values, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))] if ordered else 0.0
+
+
+def report_row(name, results, db_calls, llm_calls):
+    ms = [r['ms'] for r in results if not r['errors']]
+    n = len(results)
+    errors = sum(1 for r in results if r['errors'])
+    queries = statistics.mean(r['user_data_queries'] for r in results) if results else 0
+    print(f"{name:<14}{n:>6}{percentile(ms, 50):>9.0f}{percentile(ms, 90):>9.0f}{percentile(ms, 95):>9.0f}"
+          f"{percentile(ms, 99):>9.0f}{max(ms, default=0):>9.0f}{db_calls / n:>8.1f}{queries:>8.1f}"
+          f"{llm_calls / n:>8.2f}{errors:>7}")
+    return ms, errors
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sessions', type=int, default=20)
+    parser.add_argument('--think-time-s', type=float, default=15.0, help='seconds between one user\'s reruns')
+    parser.add_argument('--switch-rounds', type=int, default=2, help='extra passes over all pages (warm)')
+    parser.add_argument('--db-latency-ms', type=float, default=5.0, help='added per storage round trip')
+    parser.add_argument('--llm-latency-ms', type=float, default=300.0, help='added per LLM request')
+    parser.add_argument('--memory-sessions', type=int, default=5, help='sessions in the tracemalloc pass')
+    parser.add_argument('--timeout', type=float, default=60.0, help='seconds per AppTest run')
+    parser.add_argument('--p95-budget-ms', type=float, default=None)
+    parser.add_argument('--verbose', action='store_true', help="show the app's own log output")
+    args = parser.parse_args()
+    if args.verbose:
+        logging.basicConfig(level=logging.DEBUG)
+    else:
+        logging.getLogger('family_office').setLevel(logging.ERROR)
+
+    workdir = tempfile.mkdtemp(prefix='session_cost_')
+    server = fake_llm_server(args.llm_latency_ms / 1000)
+    secrets = {
+        'QWEN_API_KEY': 'load-test',
+        'QWEN_BASE_URL': f'http://127.0.0.1:{server.server_address[1]}/v1',
+        'SUPABASE_URL': 'http://127.0.0.1:9',
+        'SUPABASE_KEY': 'load-test',
+        'STORAGE_BACKEND': 'sqlite',
+        'STORAGE_DB': os.path.join(workdir, 'session_cost.db'),
+        'SCHEDULER_ENABLED': False,
+    }
+    write_secrets(workdir, secrets)
+    os.chdir(workdir)
+    sys.path.insert(0, REPO)
+    import MVP_DEMO as app
+
+    seed(app, secrets['STORAGE_DB'], args.sessions + args.memory_sessions)
+    install_db_latency(args.db_latency_ms / 1000)
+    pages = list(app.PAGES)
+
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, 'w'))
+    rounds = []
+    started = time.perf_counter()
+    with quiet:
+        sessions = [Session(i, secrets, args.timeout) for i in range(args.sessions)]
+        rounds.append(('login', *run_round(sessions, Session.login)))
+        for n in range(args.switch_rounds + 1):
+            for page in pages[1:] + pages[:1]:
+                name = f"{'first' if n == 0 else 'warm'}:{page}"
+                rounds.append((name, *run_round(sessions, lambda s, p=page: s.switch(p))))
+        rounds.append(('save:健康', *run_round(sessions, Session.save_health_form)))
+        rounds.append(('refresh:健康', *run_round(sessions, Session.refresh_suggestion)))
+    wall_s = time.perf_counter() - started
+
+    print(f"{args.sessions} sessions run in turn, "
+          f"db latency {args.db_latency_ms:g} ms, llm latency {args.llm_latency_ms:g} ms")
+    print(f"{'round':<14}{'reruns':>6}{'p50':>9}{'p90':>9}{'p95':>9}{'p99':>9}{'max':>9}"
+          f"{'db/run':>8}{'ud_q':>8}{'llm/run':>8}{'errors':>7}")
+    all_ms, all_errors, total_reruns, total_db, total_llm = [], 0, 0, 0, 0
+    first_error = None
+    for name, results, db_calls, llm_calls in rounds:
+        ms, errors = report_row(name, results, db_calls, llm_calls)
+        all_ms += ms
+        all_errors += errors
+        total_reruns += len(results)
+        total_db += db_calls
+        total_llm += llm_calls
+        first_error = first_error or next((r['errors'][0] for r in results if r['errors']), None)
+    print(f"{'all':<14}{total_reruns:>6}{percentile(all_ms, 50):>9.0f}{percentile(all_ms, 90):>9.0f}"
+          f"{percentile(all_ms, 95):>9.0f}{percentile(all_ms, 99):>9.0f}{max(all_ms, default=0):>9.0f}"
+          f"{total_db / total_reruns:>8.1f}{'':>8}{total_llm / total_reruns:>8.2f}{all_errors:>7}")
+    print(f"throughput: {total_reruns / wall_s:.1f} reruns/s over {wall_s:.1f}s")
+    if all_ms:
+        mean_s = statistics.mean(all_ms) / 1000
+        print(f"estimated capacity: ~{args.think_time_s / mean_s:.0f} users per worker "
+              f"at one rerun every {args.think_time_s:g}s (projected from the serial mean rerun "
+              f"of {mean_s * 1000:.0f} ms, not measured under concurrency)")
+
+    # memory: shared caches are warm now, so the growth is what each extra session costs
+    with quiet:
+        gc.collect()
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        extra = [Session(args.sessions + i, secrets, args.timeout) for i in range(args.memory_sessions)]
+        for session in extra:
+            session.login()
+            for page in pages[1:]:
+                session.switch(page)
+        gc.collect()
+        per_session = (tracemalloc.get_traced_memory()[0] - baseline) / max(1, len(extra))
+        tracemalloc.stop()
+    print(f"memory per logged-in session (all pages visited): {per_session / 1024:.0f} KiB")
+
+    server.shutdown()
+    failed = False
+    if all_errors:
+        print(f"FAILED: {all_errors} reruns with errors, e.g. {first_error}")
+        failed = True
+    if args.p95_budget_ms is not None and percentile(all_ms, 95) > args.p95_budget_ms:
+        print(f"FAILED: p95 rerun latency over {args.p95_budget_ms:g} ms")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
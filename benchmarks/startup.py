@@ -0,0 +1,103 @@
+"""Cold-start benchmark: app module import time and first render of the login sidebar.
+
+Every measurement runs in a fresh interpreter, so nothing is already in sys.modules.
+The probes run from a temporary directory with dummy secrets and the scheduler
+disabled. No network calls are made: the login form renders before any client
+is built.
+
+- import: `import MVP_DEMO` on top of an already imported streamlit.
+- first render: AppTest runs the script once for a logged-out session, until the
+  sidebar login form exists.
+
+Also lists the heavy dependencies loaded by the time the login form renders. With
+lazy imports this should be none beyond what streamlit itself loads. Exits non-zero
+when a median exceeds its budget or the login form is missing.
+
+    python benchmarks/startup.py [--runs 5] [--import-budget 0.5] [--render-budget 2.5]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP = os.path.join(REPO, 'MVP_DEMO.py')
+HEAVY_MODULES = ['pandas', 'numpy', 'plotly', 'openai', 'supabase', 'schedule']
+SECRETS = {
+    'QWEN_API_KEY': 'dummy',
+    'SUPABASE_URL': 'http://127.0.0.1:9',
+    'SUPABASE_KEY': 'dummy',
+    'SCHEDULER_ENABLED': False,
+}
+
+IMPORT_PROBE = """
+import json, sys, time
+import streamlit
+baseline = [m for m in {heavy!r} if m in sys.modules]
+started = time.perf_counter()
+import MVP_DEMO
+print(json.dumps({{'seconds': time.perf_counter() - started, 'baseline': baseline,
+                  'loaded': [m for m in {heavy!r} if m in sys.modules and m not in baseline]}}))
+"""
+
+RENDER_PROBE = """
+import json, sys, time
+from streamlit.testing.v1 import AppTest
+baseline = [m for m in {heavy!r} if m in sys.modules]
+started = time.perf_counter()
+at = AppTest.from_file({app!r}, default_timeout=60)
+at.secrets.update({secrets!r})  # AppTest runs read at.secrets, not the secrets file
+at.run()
+elapsed = time.perf_counter() - started
+login = any(w.label == '用户名' for w in at.sidebar.text_input)
+print(json.dumps({{'seconds': elapsed, 'login_form': login, 'exceptions': [str(e.value) for e in at.exception],
+                  'loaded': [m for m in {heavy!r} if m in sys.modules and m not in baseline]}}))
+"""
+
+
+def probe(code: str, workdir: str) -> dict:
+    env = dict(os.environ, PYTHONPATH=REPO + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    out = subprocess.run([sys.executable, '-c', code], cwd=workdir, env=env,
+                         capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--import-budget', type=float, default=0.5, help='seconds, median')
+    parser.add_argument('--render-budget', type=float, default=2.5, help='seconds, median')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.makedirs(os.path.join(workdir, '.streamlit'))
+        with open(os.path.join(workdir, '.streamlit', 'secrets.toml'), 'w') as f:
+            f.writelines(f"{key} = {json.dumps(value)}\n" for key, value in SECRETS.items())
+        imports = [probe(IMPORT_PROBE.format(heavy=HEAVY_MODULES), workdir) for _ in range(args.runs)]
+        renders = [probe(RENDER_PROBE.format(heavy=HEAVY_MODULES, app=APP, secrets=SECRETS), workdir) for _ in range(args.runs)]
+
+    import_s = statistics.median(r['seconds'] for r in imports)
+    render_s = statistics.median(r['seconds'] for r in renders)
+    print(f"import MVP_DEMO:      median {import_s * 1000:7.1f} ms  (budget {args.import_budget * 1000:.0f} ms)")
+    print(f"first login render:   median {render_s * 1000:7.1f} ms  (budget {args.render_budget * 1000:.0f} ms)")
+    print(f"loaded by streamlit:  {', '.join(imports[0]['baseline']) or 'none'}")
+    print(f"loaded by the app before login: {', '.join(renders[0]['loaded']) or 'none'}")
+
+    failed = False
+    if import_s > args.import_budget:
+        print("FAILED: import time over budget")
+        failed = True
+    if render_s > args.render_budget:
+        print("FAILED: first render over budget")
+        failed = True
+    if not all(r['login_form'] for r in renders):
+        print("FAILED: login form not rendered", renders[0]['exceptions'])
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())